@@ -0,0 +1,105 @@
+# 【ファイル名: bench/bench_chunker.py】
+# (要約で使うノート単位のチャンク分け (summarize.iter_pending_chunks) を以前の固定幅分割と比べ、
+#  ノートが分断されない・チャンクが上限以内・チャンク数が固定幅分割以下 であることを確認する)
+#
+# 使い方:
+#   python3 bench/bench_chunker.py --notes 10000 100000 --limit 50000
+#   -> どれかを満たさない場合は終了コード 1 を返します。
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_notes import generate_notes
+
+
+def install_fake_config(data_dir, limit):
+    sys.modules['config'] = types.SimpleNamespace(
+        GCP_FUNCTION_URL="http://127.0.0.1:1/",
+        DATA_DIR=data_dir,
+        CHUNK_SIZE=limit,
+    )
+
+
+def fixed_width_chunks(text, limit):
+    # なぜ？: 比較対象として、以前の split_text と同じ固定幅スライスを再現します。
+    return [text[pos:pos + limit] for pos in range(0, len(text), limit)]
+
+
+def legacy_note_file_text(entries):
+    # なぜ？: 以前の daily_notes.txt と同じく、各ノートに閉じの "=========" を付けて空行でつなぎます。
+    return "\n\n".join(entry + "\n=========" for entry in entries)
+
+
+def count_split_entries(chunks, entries):
+    """
+    どのチャンクにも丸ごと含まれていないノートの数を数える
+    （チャンクもノートも時系列順なので、先頭から順に照合します）
+    """
+    split_count = 0
+    chunk_index = 0
+    for entry in entries:
+        if entry in chunks[chunk_index]:
+            continue
+        if chunk_index + 1 < len(chunks) and entry in chunks[chunk_index + 1]:
+            chunk_index += 1
+            continue
+        split_count += 1
+    return split_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ノート単位のチャンク分けを固定幅分割と比べて確認します")
+    parser.add_argument('--notes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--limit', type=int, default=50000)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="misskey_summarizer_chunker_")
+    install_fake_config(data_dir, args.limit)
+    sys.path.insert(0, os.path.join(BENCH_DIR, "..", "bot"))
+    import summarize
+    from note_store import NoteStore, format_note_entry, note_to_row
+
+    results = []
+    print(f"{'notes':>8} {'方式':<10} {'chunks':>7} {'分断':>6} {'最大(文字)':>10} {'time(s)':>8}")
+    for note_count in args.notes:
+        with NoteStore(os.path.join(data_dir, f"notes_{note_count}.sqlite3")) as store:
+            store.upsert_notes([note_to_row(note) for note in generate_notes(note_count)])
+            entries = [format_note_entry(row) for row in store.iter_notes()]
+
+            start = time.perf_counter()
+            fixed = fixed_width_chunks(legacy_note_file_text(entries), args.limit)
+            fixed_time = time.perf_counter() - start
+
+            # なぜ？: 要約バッチと同じ経路 (ストアから読み出して整形し、ノート単位で詰める) でチャンクを作ります。
+            start = time.perf_counter()
+            packed = list(summarize.iter_pending_chunks(store))
+            packed_time = time.perf_counter() - start
+
+        entry_set = set(entries)
+        split = count_split_entries(packed, entries)
+        oversized = [chunk for chunk in packed if len(chunk) > args.limit and chunk not in entry_set]
+        for name, chunks, split_count, seconds in (('固定幅', fixed, count_split_entries(fixed, entries), fixed_time),
+                                                   ('ノート単位', packed, split, packed_time)):
+            print(f"{note_count:>8} {name:<10} {len(chunks):>7} {split_count:>6} "
+                  f"{max(map(len, chunks)):>10} {seconds:>8.3f}")
+        ok = split == 0 and not oversized and len(packed) <= len(fixed)
+        if not ok:
+            print(f"  NG: 分断 {split}件 / 上限超え {len(oversized)}チャンク / チャンク数 {len(packed)} (固定幅 {len(fixed)})")
+        results.append(ok)
+
+    print("==============================================")
+    ok = all(results)
+    print("OK" if ok else "NG")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# 【ファイル名: bench/bench_compaction.py】
+# (要約前の圧縮 (note_compactor.py) で、AIへ送る入力がどれだけ減るか・どれだけ時間がかかるかを測る)
+#
+# 使い方:
+#   python3 bench/bench_compaction.py --notes 100000
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_notes import generate_notes
+
+
+def install_fake_config(data_dir, chunk_size):
+    sys.modules['config'] = types.SimpleNamespace(
+        GCP_FUNCTION_URL="http://127.0.0.1:1/",
+        DATA_DIR=data_dir,
+        NOTE_STORE_PATH=os.path.join(data_dir, "notes.sqlite3"),
+        CHUNK_SIZE=chunk_size,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="要約前の圧縮の効果を測ります")
+    parser.add_argument('--notes', type=int, default=100000)
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        install_fake_config(data_dir, args.chunk_size)
+        sys.path.insert(0, os.path.join(BENCH_DIR, "..", "bot"))
+        from note_chunker import iter_chunks, ENTRY_JOINER
+        from note_compactor import COMPACT_JOINER, NoteCompactor
+        from note_store import NoteStore, format_note_entry, note_to_row
+
+        store = NoteStore(os.path.join(data_dir, "notes.sqlite3"))
+        store.upsert_notes([note_to_row(note) for note in generate_notes(args.notes)])
+
+        started = time.perf_counter()
+        plain = list(iter_chunks((format_note_entry(row) for row in store.iter_notes()), args.chunk_size))
+        plain_seconds = time.perf_counter() - started
+
+        compactor = NoteCompactor()
+        started = time.perf_counter()
+        compact = list(iter_chunks(compactor.iter_entries(store.iter_notes()), args.chunk_size, len, COMPACT_JOINER))
+        compact_seconds = time.perf_counter() - started
+        store.close()
+
+    print("==============================================")
+    print(f"ノート数: {args.notes} / チャンク上限: {args.chunk_size}文字")
+    print(f"従来形式: {sum(map(len, plain)):>12,}文字 / {len(plain):>4}チャンク / {plain_seconds:.2f}秒")
+    print(f"圧縮形式: {sum(map(len, compact)):>12,}文字 / {len(compact):>4}チャンク / {compact_seconds:.2f}秒")
+    compactor.report()
+
+
+if __name__ == "__main__":
+    main()
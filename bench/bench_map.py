@@ -0,0 +1,102 @@
+# 【ファイル名: bench/bench_map.py】
+# (Mapステージの並列化ベンチマーク: ローカルのスタブHTTPサーバーに対して実行)
+#
+# 使い方:
+#   python3 bench/bench_map.py --latency 0.5 --chunks 4 8 16 --workers 1 2 4 8
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot")
+
+
+class StubSummarizerHandler(BaseHTTPRequestHandler):
+    """
+    Cloud Function の代わりに、一定時間待ってから固定の要約を返すスタブ
+    """
+    latency = 0.5
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        time.sleep(self.latency)
+        body = "・スタブ要約".encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # なぜ？: リクエストごとのアクセスログが計測結果を埋もれさせるため出力しません。
+        pass
+
+
+def start_stub_server(latency):
+    StubSummarizerHandler.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubSummarizerHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def install_fake_config(function_url):
+    """
+    本物の config.py が無くても summarize を import できるよう、ダミーの config を登録する
+    """
+    data_dir = tempfile.mkdtemp(prefix="misskey_summarizer_bench_")
+    sys.modules['config'] = types.SimpleNamespace(
+        GCP_FUNCTION_URL=function_url,
+        DATA_DIR=data_dir,
+        NOTE_STORE_PATH=os.path.join(data_dir, "notes.sqlite3"),
+        SUMMARY_DATA_FILE_PATH=os.path.join(data_dir, "summary_for_today.txt"),
+        CHUNK_SIZE=50000,
+        GCP_RETRY_WAIT_SECONDS=0,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mapステージの壁時計時間を チャンク数 × 並列度 で計測します")
+    parser.add_argument('--latency', type=float, default=0.5, help="スタブの1リクエストあたりの応答時間(秒)")
+    parser.add_argument('--chunks', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    server = start_stub_server(args.latency)
+    install_fake_config(f"http://127.0.0.1:{server.server_address[1]}/")
+    sys.path.insert(0, BOT_DIR)
+    import summarize
+
+    # なぜ？: summarize 側の進捗ログで表が読みにくくなるため、計測中の print を抑制します。
+    results = []
+    for chunk_count in args.chunks:
+        for workers in args.workers:
+            # なぜ？: 要約キャッシュにヒットすると計測にならないため、計測ごと (チャンク数 × 並列度) に本文を変えます。
+            chunks = [f"チャンク{i}の本文 (chunks={chunk_count}, workers={workers})" for i in range(chunk_count)]
+            with open(os.devnull, 'w') as devnull:
+                stdout = sys.stdout
+                sys.stdout = devnull
+                try:
+                    start = time.perf_counter()
+                    summaries = summarize.summarize_chunks(chunks, summarize.PROMPT_FOR_CHUNK, max_workers=workers)
+                    elapsed = time.perf_counter() - start
+                finally:
+                    sys.stdout = stdout
+            ok = sum(1 for s in summaries if s)
+            results.append((chunk_count, workers, elapsed, ok))
+
+    server.shutdown()
+
+    print(f"スタブ応答時間: {args.latency:.2f}秒")
+    print(f"{'chunks':>7} {'workers':>8} {'wall(s)':>9} {'成功':>5}")
+    for chunk_count, workers, elapsed, ok in results:
+        print(f"{chunk_count:>7} {workers:>8} {elapsed:>9.2f} {ok:>5}")
+
+
+if __name__ == "__main__":
+    main()
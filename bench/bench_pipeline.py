@@ -0,0 +1,285 @@
+# 【ファイル名: bench/bench_pipeline.py】
+# (収集 -> Map -> Reduce -> 投稿 を、偽の Misskey と偽の AI要約サーバーに対して通しで実行し、段階ごとの時間とメモリを計測する)
+#
+# 使い方:
+#   python3 bench/bench_pipeline.py --notes 50000 --latency 0.2 --error-rate 0.02 --save result.json
+#   python3 bench/bench_pipeline.py --notes 50000 --latency 0.2 --baseline result.json   # 前回より遅くなっていないか確認
+#   python3 bench/bench_pipeline.py --notes 200000 --set NOTE_COMPACTION=True --set SALIENCE_MAX_NOTES=30000
+
+import argparse
+import ast
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from datetime import datetime, timedelta, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_DIR = os.path.join(BENCH_DIR, "..", "bot")
+sys.path.insert(0, BENCH_DIR)
+
+from fake_gemini import FakeGemini
+from fake_misskey import FakeMisskey
+from synthetic_notes import generate_notes
+
+STAGES = ('collect', 'prepare', 'map', 'reduce', 'post')
+
+
+def serve_fakes(args, conn):
+    """
+    (子プロセス) 1日分の合成ノートを持つ偽 Misskey と、偽の AI要約サーバーを起動し、親からの指示を待つ
+    """
+    # なぜ？: ノートは「収集を待つ15分」より前に投稿されたことにし、1回の収集で全件が対象になるようにします。
+    end = datetime.now(timezone.utc) - timedelta(minutes=20)
+    interval = args.hours * 3600 / args.notes
+    misskey = FakeMisskey(seed=args.seed)
+    misskey.add_notes(list(generate_notes(args.notes, start=end - timedelta(hours=args.hours),
+                                          interval_seconds=interval, seed=args.seed)))
+    gemini = FakeGemini(args.latency, args.latency_per_kchar, args.error_rate, args.stall_rate,
+                        args.output_chars, seed=args.seed)
+    rest = misskey.start_rest()
+    function = gemini.start()
+    conn.send((f"http://127.0.0.1:{rest.server_address[1]}", f"http://127.0.0.1:{function.server_address[1]}/"))
+    while conn.recv() == 'stats':
+        conn.send({
+            'misskey_requests': misskey.rest_requests,
+            'posted': len(misskey.created),
+            **{f"gcp_{key}": value for key, value in gemini.stats.items()},
+        })
+
+
+def install_fake_config(args, misskey_url, function_url):
+    """
+    本物の config.py が無くても bot を import できるよう、偽サーバーを向いた config を登録する
+    """
+    data_dir = tempfile.mkdtemp(prefix="misskey_summarizer_pipeline_")
+    values = dict(
+        MISSKEY_URL=misskey_url,
+        MISSKEY_TOKEN="bench",
+        GCP_FUNCTION_URL=function_url,
+        EXCLUDE_USER_ID="user0",
+        DATA_DIR=data_dir,
+        NOTE_STORE_PATH=os.path.join(data_dir, "notes.sqlite3"),
+        SUMMARY_DATA_FILE_PATH=os.path.join(data_dir, "summary_for_today.txt"),
+        LAST_POST_ID_FILE_PATH=os.path.join(data_dir, "last_post_id.txt"),
+        CHUNK_SIZE=50000,
+        MAX_CONCURRENT_REQUESTS=args.workers,
+        GCP_RETRY_WAIT_SECONDS=0,
+        GCP_STREAM_STALL_SECONDS=args.stall_seconds,
+        RETRY_BASE_WAIT_SECONDS=0,
+        PAGE_INTERVAL_SECONDS=0,
+        MAX_PAGES_PER_RUN=args.notes // 100 + 10,
+    )
+    for assignment in args.set:
+        key, _, value = assignment.partition('=')
+        values[key.strip()] = ast.literal_eval(value.strip())
+    sys.modules['config'] = types.SimpleNamespace(**values)
+    return values
+
+
+class StageMeter:
+    """
+    段階ごとの壁時計時間・Pythonのメモリ使用量のピーク・プロセスの最大RSS・偽サーバーへのリクエスト数を記録する
+    """
+
+    def __init__(self, conn, trace_memory):
+        self.conn = conn
+        self.trace_memory = trace_memory
+        self.results = {stage: {'seconds': 0.0, 'peak_mb': 0.0} for stage in STAGES}
+        self.active = []
+
+    def _record_peak(self):
+        # なぜ？: 段階は入れ子になる (要約の中に Map と Reduce) ため、ピークをリセットする前に外側の段階へも反映します。
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        for stage in self.active:
+            self.results[stage]['peak_mb'] = max(self.results[stage]['peak_mb'], peak_mb)
+
+    def fake_stats(self):
+        self.conn.send('stats')
+        return self.conn.recv()
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        before = self.fake_stats()
+        if self.trace_memory:
+            self._record_peak()
+            tracemalloc.reset_peak()
+        self.active.append(stage)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            result = self.results[stage]
+            result['seconds'] += time.perf_counter() - started
+            if self.trace_memory:
+                self._record_peak()
+            self.active.pop()
+            # なぜ？: ru_maxrss は Linux では KB 単位で、プロセス開始からの最大値です（段階ごとの増え方を見ます）。
+            result['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            after = self.fake_stats()
+            for key, value in after.items():
+                result[key] = result.get(key, 0) + value - before[key]
+
+
+def run_pipeline(meter):
+    """
+    本番の4つのスクリプトと同じ関数を順に呼ぶ。Map と Reduce は summarize の関数を包んで時間を分けて測る
+    """
+    sys.path.insert(0, BOT_DIR)
+    import collect_notes
+    import post_note
+    import summarize
+    from note_store import NoteStore
+
+    # なぜ？: 初回の収集は「30分前から」になるため、カーソルを最古より前に置いて1日分を全て取り込ませます。
+    store = NoteStore(sys.modules['config'].NOTE_STORE_PATH)
+    store.set_meta(collect_notes.CURSOR_ID_KEY, '0')
+    store.close()
+
+    original_chunks = summarize.summarize_chunks
+    original_reduce = summarize.reduce_summaries
+
+    def timed_chunks(chunks, *args, **kwargs):
+        # なぜ？: Reduce の中からも summarize_chunks が呼ばれるため、Map として数えるのは step_prefix が map の呼び出しだけです。
+        if kwargs.get('step_prefix', 'map') != 'map':
+            return original_chunks(chunks, *args, **kwargs)
+        with meter.measure('map'):
+            return original_chunks(chunks, *args, **kwargs)
+
+    def timed_reduce(*args, **kwargs):
+        with meter.measure('reduce'):
+            return original_reduce(*args, **kwargs)
+
+    summarize.summarize_chunks = timed_chunks
+    summarize.reduce_summaries = timed_reduce
+
+    outcome = {}
+    with meter.measure('collect'):
+        collect_notes.execute_periodic_collection()
+    started = time.perf_counter()
+    with meter.measure('prepare'):
+        outcome['summarized'] = summarize.execute_summarize()
+    # なぜ？: 'prepare' (ストアの読み出し・チャンク分割・見積もり) は、要約全体から Map と Reduce を引いた残りです。
+    prepare = meter.results['prepare']
+    prepare['seconds'] = time.perf_counter() - started - meter.results['map']['seconds'] - meter.results['reduce']['seconds']
+    for key in list(prepare):
+        if key.startswith('gcp_'):
+            prepare[key] -= meter.results['map'].get(key, 0) + meter.results['reduce'].get(key, 0)
+    with meter.measure('post'):
+        outcome['posted'] = post_note.execute_post()
+
+    store = NoteStore(sys.modules['config'].NOTE_STORE_PATH)
+    outcome['stored_notes'] = store.count_notes()
+    store.close()
+    return outcome
+
+
+def compare(results, baseline, tolerance):
+    """
+    前回の結果と比べ、tolerance の割合より遅く (メモリが多く) なった段階を返す
+    """
+    regressions = []
+    for stage in STAGES:
+        for metric in ('seconds', 'peak_mb'):
+            old = baseline.get('stages', {}).get(stage, {}).get(metric)
+            new = results[stage][metric]
+            # なぜ？: ごく短い段階は誤差で何割も変わるため、0.05秒 / 1MB 未満の差は無視します。
+            floor = 0.05 if metric == 'seconds' else 1.0
+            if old is not None and new - old > max(old * tolerance, floor):
+                regressions.append(f"{stage} の {metric}: {old:.2f} -> {new:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="収集から投稿までを偽サーバー相手に通しで実行し、段階ごとの時間とメモリを計測します")
+    parser.add_argument('--notes', type=int, default=20000, help="1日分として配信する合成ノート数")
+    parser.add_argument('--hours', type=float, default=24, help="ノートを投稿した期間(時間)")
+    parser.add_argument('--latency', type=float, default=0.2, help="偽 AI要約の1回あたりの固定の応答時間(秒)")
+    parser.add_argument('--latency-per-kchar', type=float, default=0.002, help="入力1000文字あたりに追加でかかる時間(秒)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="AI要約が失敗する確率 (再試行の影響を測ります)")
+    parser.add_argument('--stall-rate', type=float, default=0.0, help="ストリーミング応答が途中で止まる確率")
+    parser.add_argument('--stall-seconds', type=float, default=2.0, help="止まった応答を打ち切るまでの秒数")
+    parser.add_argument('--output-chars', type=int, default=400, help="偽 AI要約が返す要約の文字数")
+    parser.add_argument('--workers', type=int, default=4, help="Mapステージの並列度")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help="config の値を上書きする (例: --set NOTE_COMPACTION=True)")
+    parser.add_argument('--no-trace-memory', action='store_true',
+                        help="tracemalloc を使わない (tracemalloc は処理を数倍遅くするため、時間だけを正確に測りたい場合に)")
+    parser.add_argument('--verbose', action='store_true', help="bot のログをそのまま表示する")
+    parser.add_argument('--save', help="結果を JSON で保存するパス")
+    parser.add_argument('--baseline', help="比較する前回の結果 (JSON)")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="この割合を超えて悪化したら失敗とする")
+    args = parser.parse_args()
+
+    # なぜ？: 偽サーバーを別プロセスで動かし、合成ノートや応答の生成が bot 側の時間・メモリに混ざらないようにします。
+    parent_conn, child_conn = multiprocessing.Pipe()
+    fakes = multiprocessing.Process(target=serve_fakes, args=(args, child_conn), daemon=True)
+    fakes.start()
+    misskey_url, function_url = parent_conn.recv()
+    settings = install_fake_config(args, misskey_url, function_url)
+
+    if not args.no_trace_memory:
+        tracemalloc.start()
+    meter = StageMeter(parent_conn, not args.no_trace_memory)
+    log = io.StringIO()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else log):
+        outcome = run_pipeline(meter)
+    total = time.perf_counter() - started
+    parent_conn.send('stop')
+    fakes.join(timeout=5)
+
+    results = meter.results
+    print(f"ノート: {args.notes}件 / {args.hours:g}時間 (ストア: {outcome['stored_notes']}件)  "
+          f"AI応答: {args.latency:.2f}秒 + {args.latency_per_kchar:.3f}秒/1000文字, "
+          f"エラー率 {args.error_rate:.0%}, 停止率 {args.stall_rate:.0%}  並列度: {args.workers}")
+    if args.set:
+        print(f"config の上書き: {', '.join(args.set)}")
+    print(f"{'stage':>8} {'wall(s)':>9} {'py peak(MB)':>12} {'max RSS(MB)':>12} {'API':>6} {'GCP':>6} {'失敗':>5} {'GCP入力(KB)':>12}")
+    for stage in STAGES:
+        r = results[stage]
+        print(f"{stage:>8} {r['seconds']:>9.2f} {r['peak_mb']:>12.1f} {r['max_rss_mb']:>12.1f} "
+              f"{r.get('misskey_requests', 0):>6} {r.get('gcp_requests', 0):>6} "
+              f"{r.get('gcp_errors', 0) + r.get('gcp_stalls', 0):>5} {r.get('gcp_bytes_in', 0) / 1024:>12.1f}")
+    print(f"{'total':>8} {total:>9.2f}  要約: {'成功' if outcome['summarized'] else '失敗'} / "
+          f"投稿: {'成功' if outcome['posted'] else '失敗'}")
+    if not (outcome['summarized'] and outcome['posted']):
+        # なぜ？: 途中で失敗した場合は、原因を追えるよう bot のログの末尾を表示します。
+        print("--- bot のログ (末尾) ---")
+        print("\n".join(log.getvalue().splitlines()[-30:]))
+
+    report = {
+        'args': {key: value for key, value in vars(args).items() if key not in ('save', 'baseline', 'verbose')},
+        'config': {key: value for key, value in settings.items() if not key.endswith(('_URL', '_PATH', '_DIR'))},
+        'stages': results,
+        'total_seconds': total,
+        'outcome': outcome,
+    }
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果を {args.save} に保存しました。")
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('args') != report['args']:
+            print("警告: 前回と計測条件が異なります。比較結果は参考程度にしてください。")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"前回より {args.tolerance:.0%} 以上悪化しました:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"前回から {args.tolerance:.0%} 以上の悪化はありませんでした。")
+
+
+if __name__ == "__main__":
+    main()
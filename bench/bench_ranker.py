@@ -0,0 +1,67 @@
+# 【ファイル名: bench/bench_ranker.py】
+# (注目度による絞り込み (note_ranker.py) の速さと、選ばれたノートの傾向を測り、
+#  急上昇した話題の投稿が全体の選択率以上の割合で残ることを確認する)
+#
+# 使い方:
+#   python3 bench/bench_ranker.py --notes 200000 --keep 30000
+#   -> 急上昇した話題の選択率が全体の選択率を下回る場合は終了コード 1 を返します。
+
+import argparse
+import os
+import sys
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_notes import generate_notes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="注目度による絞り込みの速さを測ります")
+    parser.add_argument('--notes', type=int, default=200000)
+    parser.add_argument('--keep', type=int, default=30000)
+    parser.add_argument('--sampling', choices=('top', 'diverse'), help="抽出の方式 (省略時は SALIENCE_SAMPLING の既定値)")
+    args = parser.parse_args()
+
+    sys.modules['config'] = types.SimpleNamespace()
+    sys.path.insert(0, os.path.join(BENCH_DIR, "..", "bot"))
+    from note_store import note_to_row
+    from note_ranker import SALIENCE_SAMPLING, score_notes, select_salient_rows
+
+    rows = [note_to_row(note) for note in generate_notes(args.notes, interval_seconds=86400 / args.notes)]
+    # なぜ？: 急上昇するキーワードを検出できるか確かめるため、ある1時間だけ同じ話題の投稿を混ぜます。
+    burst_start = len(rows) // 2
+    burst_end = burst_start + len(rows) // 24
+    for row in rows[burst_start:burst_end:5]:
+        row['text'] = "地震速報きた！揺れた " + row['text']
+
+    started = time.perf_counter()
+    scores, topics = score_notes(rows)
+    score_seconds = time.perf_counter() - started
+    sampling = args.sampling or SALIENCE_SAMPLING
+    selected = select_salient_rows(rows, args.keep, sampling=sampling)
+
+    def mean(values):
+        values = list(values)
+        return sum(values) / len(values) if values else 0
+
+    print("==============================================")
+    print(f"ノート数: {len(rows)} / 採点: {score_seconds:.2f}秒 / 話題の数: {len(set(topics.tolist()))}")
+    print(f"平均リアクション数: 全体 {mean(r['reaction_count'] for r in rows):.2f}"
+          f" -> 選択 {mean(r['reaction_count'] for r in selected):.2f}")
+    burst_total = sum(1 for r in rows if r['text'].startswith("地震速報"))
+    burst_kept = sum(1 for r in selected if r['text'].startswith("地震速報"))
+    keep_rate = len(selected) / len(rows)
+    print(f"急上昇した話題の投稿: {burst_kept}/{burst_total}件 ({burst_kept / burst_total:.1%}) を選択 "
+          f"(方式: {sampling} / 全体の選択率: {keep_rate:.1%})")
+    # なぜ？: その日いちばんの出来事が、ふつうの投稿より低い割合でしか要約に残らないのは絞り込みの不具合です。
+    ok = burst_kept >= burst_total * keep_rate
+    print("OK" if ok else "NG")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
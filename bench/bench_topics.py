@@ -0,0 +1,123 @@
+# 【ファイル名: bench/bench_topics.py】
+# (話題ごとのチャンク分け (note_clusterer.py) で、同じ話題がいくつのチャンクに散らばるかを時刻順の場合と比べる)
+#
+# 使い方:
+#   python3 bench/bench_topics.py --notes 30000 --topics 40
+
+import argparse
+import io
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_notes import generate_notes
+
+_COMMON = ["今日", "なんか", "めっちゃ", "それ", "ほんと", "みんな", "あとで", "ちょっと"]
+_KANA = "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモラリルレロ"
+
+
+def make_topic_words(topic_count, rng):
+    """
+    話題ごとに、その話題でだけ使われる言葉を作る
+    """
+    return [
+        ["".join(rng.choice(_KANA) for _ in range(rng.randint(2, 4))) for _ in range(8)]
+        for _ in range(topic_count)
+    ]
+
+
+def plant_topics(rows, topic_count, seed=0):
+    """
+    各ノートの本文を、ランダムに選んだ1つの話題の言葉で書き換え、ノートごとの正解の話題番号を返す
+    """
+    rng = random.Random(seed)
+    vocabularies = make_topic_words(topic_count, rng)
+    topics = []
+    for row in rows:
+        topic = rng.randrange(topic_count)
+        words = [rng.choice(vocabularies[topic]) for _ in range(rng.randint(3, 8))]
+        words += [rng.choice(_COMMON) for _ in range(rng.randint(1, 3))]
+        rng.shuffle(words)
+        row['text'] = "".join(words)
+        topics.append(topic)
+    return topics
+
+
+def spread(chunks, marker_of_topic):
+    """
+    各話題が平均していくつのチャンクに現れるか
+    """
+    counts = [sum(1 for chunk in chunks if marker in chunk) for marker in marker_of_topic]
+    return sum(counts) / len(counts)
+
+
+def run(rows, topics, topic_count, chunk_size, clustering):
+    with tempfile.TemporaryDirectory() as data_dir:
+        sys.modules['config'] = types.SimpleNamespace(
+            GCP_FUNCTION_URL="http://127.0.0.1:1/",
+            DATA_DIR=data_dir,
+            NOTE_STORE_PATH=os.path.join(data_dir, "notes.sqlite3"),
+            CHUNK_SIZE=chunk_size,
+            NOTE_COMPACTION=True,
+            TOPIC_CLUSTERING=clustering,
+        )
+        for name in ('summarize', 'note_compactor', 'note_clusterer'):
+            sys.modules.pop(name, None)
+        import summarize
+        from note_store import NoteStore
+
+        store = NoteStore(os.path.join(data_dir, "notes.sqlite3"))
+        store.upsert_notes(rows)
+        started = time.perf_counter()
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            chunks = list(summarize.iter_pending_chunks(store))
+        seconds = time.perf_counter() - started
+        store.close()
+
+    # なぜ？: 各ノートの本文の一部を目印にし、同じ話題のノートがいくつのチャンクに分かれたかを数えます。
+    chunk_of_note = {}
+    for index, chunk in enumerate(chunks):
+        for line in chunk.split("\n"):
+            chunk_of_note[line.split(": ", 1)[-1][:12]] = index
+    spans = {}
+    for row, topic in zip(rows, topics):
+        index = chunk_of_note.get(row['text'][:12])
+        if index is not None:
+            spans.setdefault(topic, set()).add(index)
+    average_spread = sum(len(indices) for indices in spans.values()) / max(len(spans), 1)
+    return len(chunks), average_spread, seconds, log.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="話題ごとのチャンク分けの効果を測ります")
+    parser.add_argument('--notes', type=int, default=30000)
+    parser.add_argument('--topics', type=int, default=40)
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(BENCH_DIR, "..", "bot"))
+    sys.modules['config'] = types.SimpleNamespace()
+    from note_store import note_to_row
+    rows = [note_to_row(note) for note in generate_notes(args.notes)]
+    topics = plant_topics(rows, args.topics)
+
+    print("==============================================")
+    print(f"ノート数: {args.notes} / 正解の話題数: {args.topics} / チャンク上限: {args.chunk_size}文字")
+    for label, clustering in (("時刻順", False), ("話題ごと", True)):
+        chunk_count, average_spread, seconds, log = run(rows, topics, args.topics, args.chunk_size, clustering)
+        print(f"{label}: {chunk_count:>4}チャンク / 1つの話題が平均 {average_spread:.1f}チャンクに散らばる / {seconds:.2f}秒")
+        for line in log.splitlines():
+            if "話題ごとに分けました" in line:
+                print(f"   {line.strip()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# 【ファイル名: bench/check_cloud_function.py】
+# (cloud_function/main.py を functions-framework でローカルに起動し、Vertex AI の代わりに偽のモデル
+#  (fake_gemini.FakeGenerativeModel) を使って、モデル初期化の再試行・応答のキャッシュ・生成設定の指定を確認する)
+#
+# 使い方 (functions-framework が必要です: pip install -r cloud_function/requirements.txt):
+#   python3 bench/check_cloud_function.py --latency 0.5
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FUNCTION_SOURCE = os.path.join(BENCH_DIR, "..", "cloud_function", "main.py")
+
+PROMPT = "以下の投稿を要約してください。"
+TEXT = "\n".join(f"12:{minute:02d} user{minute}: 今日の話題その{minute}について話しています" for minute in range(40))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_function(port, latency):
+    """
+    偽のモデルを使う設定で functions-framework を起動し、リクエストを受け付けるまで待つ
+    """
+    env = dict(
+        os.environ,
+        PYTHONPATH=BENCH_DIR,
+        MODEL_FACTORY="fake_gemini:create_fake_model",
+        # なぜ？: 最初の初期化を失敗させ、次のリクエストで再試行されることを確かめます。
+        FAKE_MODEL_INIT_FAILURES="1",
+        FAKE_MODEL_LATENCY=str(latency),
+        MODEL_INIT_RETRY_SECONDS="1",
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'functions_framework', '--target', 'summarize_text_handler',
+         '--source', FUNCTION_SOURCE, '--host', '127.0.0.1', '--port', str(port)],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"functions-framework を起動できませんでした:\n{process.stdout.read()}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("functions-framework が30秒以内に起動しませんでした。")
+
+
+def timed_post(url, payload):
+    started = time.perf_counter()
+    response = requests.post(url, json=payload, timeout=60)
+    return response, time.perf_counter() - started
+
+
+def read_stream(response):
+    events = [json.loads(line) for line in response.iter_lines() if line]
+    return "".join(event.get('delta', '') for event in events), events[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cloud Function を偽のモデルでローカルに動かして確認します")
+    parser.add_argument('--latency', type=float, default=0.5, help="偽のモデルの1回の生成にかかる時間(秒)")
+    args = parser.parse_args()
+
+    port = free_port()
+    process = start_function(port, args.latency)
+    url = f"http://127.0.0.1:{port}/"
+    results = []
+
+    def check(name, ok, detail=""):
+        results.append(ok)
+        print(f"  {'OK' if ok else 'NG'}  {name} {detail}")
+
+    try:
+        # 1. モデルの初期化に失敗したら 503 を返し、少し待ってからのリクエストで再試行して回復する
+        response, _ = timed_post(url, {'prompt': PROMPT, 'text': TEXT})
+        check("初期化の失敗は 503", response.status_code == 503, f"({response.status_code})")
+        time.sleep(1.2)
+        first, first_seconds = timed_post(url, {'prompt': PROMPT, 'text': TEXT})
+        check("再試行で初期化して要約できる", first.status_code == 200 and bool(first.text),
+              f"({first.status_code}, {first_seconds:.2f}秒)")
+
+        # 2. 同じリクエストはモデルを呼ばずにキャッシュから返す
+        second, second_seconds = timed_post(url, {'prompt': PROMPT, 'text': TEXT})
+        check("同じリクエストはキャッシュから返す", second.text == first.text and second_seconds < args.latency / 2,
+              f"({second_seconds:.2f}秒)")
+
+        # 3. generation_config の max_output_tokens がモデルまで届く (偽のモデルは1文字1トークンとして切り詰めます)
+        short, _ = timed_post(url, {'prompt': PROMPT, 'text': TEXT, 'generation_config': {'max_output_tokens': 50}})
+        check("generation_config の指定が効く", short.status_code == 200 and 0 < len(short.text) <= 50,
+              f"({len(first.text)}文字 -> {len(short.text)}文字)")
+        for invalid in ({'max_output_tokens': 100000}, {'seed': 1}, "fast",
+                        {'top_k': 1.5}, {'max_output_tokens': 10.9}, {'max_output_tokens': True}):
+            response, _ = timed_post(url, {'prompt': PROMPT, 'text': TEXT, 'generation_config': invalid})
+            check(f"不正な generation_config {invalid!r} は 400", response.status_code == 400, f"({response.status_code})")
+
+        # 4. ストリーミングも、2回目はキャッシュから同じ内容を返す
+        stream_payload = {'prompt': PROMPT, 'text': TEXT + "\nストリーミング", 'stream': True}
+        streams = []
+        for _ in range(2):
+            started = time.perf_counter()
+            with requests.post(url, json=stream_payload, stream=True, timeout=60) as response:
+                streams.append((*read_stream(response), time.perf_counter() - started))
+        (text1, last1, _), (text2, last2, seconds2) = streams
+        check("ストリーミングの2回目はキャッシュから返す",
+              text1 and text1 == text2 and last1.get('done') and last2.get('done') and seconds2 < args.latency / 2,
+              f"({seconds2:.2f}秒)")
+
+        # 5. バッチも generation_config に従う
+        response, _ = timed_post(url, {'prompt': PROMPT, 'texts': [TEXT, TEXT + "\n別のチャンク"],
+                                       'generation_config': {'max_output_tokens': 30}})
+        batch = response.json()['results'] if response.status_code == 200 else []
+        check("バッチも generation_config に従う",
+              len(batch) == 2 and all(r['ok'] and len(r['summary']) <= 30 for r in batch))
+
+        # 6. Bot側は Map の呼び出しに GCP_GENERATION_CONFIGS['map'] を付けて送る
+        sys.modules['config'] = types.SimpleNamespace(
+            GCP_FUNCTION_URL=url,
+            DATA_DIR=tempfile.mkdtemp(prefix="misskey_summarizer_function_"),
+            CHUNK_SIZE=50000,
+            GCP_GENERATION_CONFIGS={'map': {'max_output_tokens': 40}},
+        )
+        sys.path.insert(0, os.path.join(BENCH_DIR, "..", "bot"))
+        import summarize
+
+        summary = summarize.get_summary_from_gcp(TEXT + "\nBotから", summarize.MAP_PROMPT)
+        check("Bot の Map 呼び出しに生成設定が付く", summary is not None and len(summary) <= 40,
+              f"({len(summary or '')}文字)")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    print("==============================================")
+    ok = all(results)
+    print("OK" if ok else "NG")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# 【ファイル名: bench/check_import_time.py】
+# (python3 -m bot <ジョブ> の起動時に読み込まれるモジュールとその時間を -X importtime で測り、
+#  収集のように頻繁に起動するジョブが重いモジュールを読み込んでいないこと・上限時間以内であることを確認する)
+#
+# 使い方:
+#   python3 bench/check_import_time.py --job collect --budget-ms 250
+#   -> 上限を超えた・読み込んではいけないモジュールを読み込んだ場合は終了コード 1 を返します。
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT_DIR)
+
+from bot.__main__ import JOBS
+
+# ジョブごとの、読み込んではいけないモジュール (要約・ストリーミング・数値計算など、そのジョブに不要なもの)
+FORBIDDEN_MODULES = {
+    'collect': ['summarize', 'note_ranker', 'note_clusterer', 'note_archive', 'numpy', 'websockets', 'misskey',
+                'vertexai', 'google'],
+    'post': ['summarize', 'numpy', 'websockets', 'misskey', 'vertexai', 'google'],
+    'renote': ['summarize', 'numpy', 'websockets', 'misskey', 'vertexai', 'google'],
+}
+
+
+def measure(code, config_dir):
+    """
+    -X importtime 付きで code を実行し、(モジュール名, 自身の時間(µs), 累計の時間(µs), 階層の深さ) のリストを返す
+    """
+    env = dict(os.environ, PYTHONPATH=config_dir)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=ROOT_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ジョブの起動時のモジュール読み込み時間を確認します")
+    parser.add_argument('--job', default='collect', choices=JOBS)
+    parser.add_argument('--budget-ms', type=float, default=250.0, help="インタプリタ自体の起動を除いた読み込み時間の上限")
+    parser.add_argument('--repeat', type=int, default=5, help="測定回数 (ばらつきを除くため最小値を使います)")
+    args = parser.parse_args()
+
+    # なぜ？: 各モジュールは読み込み時に config を参照するため、テンプレートをそのまま config.py として使います。
+    config_dir = tempfile.mkdtemp(prefix="misskey_summarizer_importtime_")
+    shutil.copy(os.path.join(ROOT_DIR, "bot", "config.py.template"), os.path.join(config_dir, "config.py"))
+
+    # なぜ？: インタプリタの起動時に読み込まれるモジュール (site など) はジョブと関係ないため除きます。
+    startup = {name for name, *_ in measure("pass", config_dir)}
+    # なぜ？: importlib.import_module での読み込みは -X importtime に記録されないため、先に import 文で読み込みます
+    # (load_job() は読み込み済みのモジュールから関数を取り出すだけになります)。
+    code = f"import bot.__main__ as cli; import {JOBS[args.job][0]}; cli.load_job({args.job!r})"
+    runs = []
+    for _ in range(args.repeat):
+        imports = [entry for entry in measure(code, config_dir) if entry[0] not in startup]
+        runs.append((sum(self_us for _, self_us, _, _ in imports) / 1000, imports))
+    total_ms, imports = min(runs, key=lambda run: run[0])
+    shutil.rmtree(config_dir, ignore_errors=True)
+
+    names = {name for name, *_ in imports}
+    forbidden = sorted(name for name in names
+                       if name.split('.')[0] in FORBIDDEN_MODULES.get(args.job, []))
+    # ジョブのモジュールと、それが直接読み込んだモジュールのうち重いもの
+    heaviest = sorted((entry for entry in imports if entry[3] <= 1), key=lambda entry: -entry[2])
+
+    print("==============================================")
+    print(f"python3 -m bot {args.job}: {len(names)}個のモジュール / 読み込み {total_ms:.1f}ms (上限 {args.budget_ms:.0f}ms, "
+          f"{args.repeat}回の最小)")
+    for name, _, cumulative_us, depth in heaviest[:8]:
+        print(f"  {cumulative_us / 1000:>8.1f}ms  {'  ' * depth}{name}")
+    if forbidden:
+        print(f"  読み込んではいけないモジュール: {', '.join(forbidden)}")
+    ok = total_ms <= args.budget_ms and not forbidden
+    print("OK" if ok else "NG")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
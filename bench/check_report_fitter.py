@@ -0,0 +1,125 @@
+# 【ファイル名: bench/check_report_fitter.py】
+# (投稿の上限を超える最終要約を作り、ローカルで縮める・スレッドに分ける・AIに短くし直してもらう の各経路で
+#  投稿が中止されず、どのノートも上限以内に収まることを確認する)
+#
+# 使い方:
+#   python3 bench/check_report_fitter.py --sections 12 --lines 12
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_gemini import FakeGemini
+from fake_misskey import FakeMisskey
+
+
+def make_report(sections, lines, seed=0):
+    """
+    見出し・箇条書き・引用からなる、それらしい MFM のレポートを作る
+    """
+    rng = random.Random(seed)
+    words = ["新機能", "サーバー", "絵文字", "イベント", "ラーメン", "天気", "ゲーム", "アニメ", "電車", "猫"]
+    report = ["今日もいろいろな話題で盛り上がりました。"]
+    for number in range(1, sections + 1):
+        report.append("")
+        report.append(f"$[tada.speed=0s 話題{number}: {rng.choice(words)}について]")
+        for _ in range(lines):
+            text = "、".join(rng.choice(words) for _ in range(rng.randint(4, 12)))
+            if rng.random() < 0.3:
+                report.append(f">[user{rng.randint(1, 99)}]さん　{text}の話でした")
+            else:
+                report.append(f"・{text}が話題になりました。")
+    return "\n".join(report)
+
+
+def post_with(post_note, report_fitter, target, misskey, summary, overflow):
+    """
+    要約ファイルを置いて投稿し、投稿されたノートを返す
+    """
+    report_fitter.REPORT_OVERFLOW = overflow
+    with open(target.summary_data_file_path, 'w', encoding='utf-8') as f:
+        f.write(summary)
+    misskey.created.clear()
+    posted = post_note.execute_post()
+    return posted, list(misskey.created)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上限を超える最終要約を縮める・分ける処理を確認します")
+    parser.add_argument('--sections', type=int, default=12)
+    parser.add_argument('--lines', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    misskey = FakeMisskey()
+    rest = misskey.start_rest()
+    gemini = FakeGemini(0.0, output_chars=1500)
+    function = gemini.start()
+    data_dir = tempfile.mkdtemp(prefix="misskey_summarizer_report_")
+    sys.modules['config'] = types.SimpleNamespace(
+        MISSKEY_URL=f"http://127.0.0.1:{rest.server_address[1]}",
+        MISSKEY_TOKEN="token",
+        GCP_FUNCTION_URL=f"http://127.0.0.1:{function.server_address[1]}/",
+        DATA_DIR=data_dir,
+        CHUNK_SIZE=50000,
+        GCP_RETRY_WAIT_SECONDS=0,
+    )
+    sys.path.insert(0, os.path.join(BENCH_DIR, "..", "bot"))
+    import post_note
+    import report_fitter
+    import summarize
+    import targets
+
+    target = targets.current()
+    limit = report_fitter.REPORT_MAX_CHARS
+    report = make_report(args.sections, args.lines, args.seed)
+    headings = len([s for s in report_fitter.parse_sections(report) if s.heading])
+    print(f"レポート: {len(report)}文字 / 見出し {headings}個 (投稿の上限 {limit}文字)")
+    checks = []
+
+    # 1. ローカルで縮める: 上限以内で、見出しは REPORT_MIN_SECTIONS 個以上残る
+    fitted = report_fitter.fit_report(report, report_fitter.body_limit())
+    kept = len([s for s in report_fitter.parse_sections(fitted or "") if s.heading])
+    print(f"  fit: {len(fitted or '')}文字 / 見出し {kept}個")
+    checks.append(fitted is not None and len(fitted) <= report_fitter.body_limit()
+                  and kept >= report_fitter.REPORT_MIN_SECTIONS and fitted.startswith("今日も"))
+
+    # 2. "fit" で投稿: 1件のノートに縮めて投稿する
+    posted, created = post_with(post_note, report_fitter, target, misskey, report, 'fit')
+    print(f"  投稿 (fit): {'成功' if posted else '失敗'} / {len(created)}件 {[len(note['text']) for note in created]}")
+    checks.append(posted and len(created) == 1 and len(created[0]['text']) <= limit)
+
+    # 3. "thread" で投稿: リプライでつないだ REPORT_THREAD_MAX_NOTES 件以内のノートに分ける
+    posted, created = post_with(post_note, report_fitter, target, misskey, report, 'thread')
+    chained = all(note.get('replyId') == previous['id'] for previous, note in zip(created, created[1:]))
+    print(f"  投稿 (thread): {'成功' if posted else '失敗'} / {len(created)}件 {[len(note['text']) for note in created]} "
+          f"/ リプライのつながり {'OK' if chained else 'NG'}")
+    with open(target.last_post_id_file_path, encoding='utf-8') as f:
+        last_post_id = f.read()
+    checks.append(posted and 1 < len(created) <= report_fitter.REPORT_THREAD_MAX_NOTES and chained
+                  and all(len(note['text']) <= limit for note in created) and last_post_id == created[0]['id'])
+
+    # 4. ローカルで縮められない (見出しが少なく、1行が長い) 場合だけ AI に1回短くし直してもらう
+    report_fitter.REPORT_OVERFLOW = 'fit'
+    long_report = "\n".join(f"$[tada.speed=0s 話題{n}]\n・{'とても長い話題です。' * 150}" for n in range(1, 4))
+    finalized = summarize.finalize_report(long_report)
+    print(f"  再要約: {len(long_report)}文字 -> {len(finalized)}文字 (GCPリクエスト {gemini.stats['requests']}件)")
+    checks.append(len(finalized) <= report_fitter.body_limit() and gemini.stats['requests'] == 1)
+    summarize.finalize_report(fitted)
+    checks.append(gemini.stats['requests'] == 1)
+
+    print("==============================================")
+    ok = all(checks)
+    print("OK" if ok else f"NG {checks}")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# 【ファイル名: bench/check_scheduler.py】
+# (偽の Misskey と偽の AI要約サーバーに対して scheduler.py のジョブを動かし、重複実行の防止と実行順を確認する)
+#
+# 使い方:
+#   python3 bench/check_scheduler.py --notes 5000 --latency 0.3
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_pipeline import install_fake_config, serve_fakes
+
+
+async def run_check(scheduler, fake_stats):
+    """
+    ジョブを同時に起動し、どれが実行され、どれが見送られたかを返す
+    """
+    ran = []
+    for job in scheduler.jobs.values():
+        function = job.function
+
+        def recorded(function=function, name=job.name):
+            ran.append(name)
+            return function()
+
+        job.function = recorded
+
+    async def drain():
+        # なぜ？: 'after' のジョブは前のジョブの完了時に追加されるため、追加されたタスクも終わるまで待ちます。
+        while scheduler.tasks:
+            await asyncio.gather(*scheduler.tasks)
+
+    # 1. 収集の実行中に次の収集が来ても、重ねて実行しない (収集の後には逐次要約が続く)
+    scheduler.trigger('collect', "1回目")
+    scheduler.trigger('collect', "2回目")
+    await drain()
+
+    # 2. 要約の実行中の投稿は要約が終わるまで待ち、逐次要約は見送る
+    scheduler.trigger('summarize', "要約")
+    await asyncio.sleep(0.1)
+    scheduler.trigger('post', "投稿")
+    scheduler.trigger('rolling_summarize', "逐次要約")
+    await drain()
+    return ran, fake_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="スケジューラーの重複実行の防止と実行順を確認します")
+    parser.add_argument('--notes', type=int, default=5000)
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--latency', type=float, default=0.3)
+    args = parser.parse_args()
+    # なぜ？: bench_pipeline.py の偽サーバーと config をそのまま使うため、足りない引数を既定値で補います。
+    args.latency_per_kchar = 0.0
+    args.error_rate = args.stall_rate = 0.0
+    args.stall_seconds = 2.0
+    args.output_chars = 400
+    args.workers = 4
+    args.seed = 0
+    args.set = []
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    fakes = multiprocessing.Process(target=serve_fakes, args=(args, child_conn), daemon=True)
+    fakes.start()
+    misskey_url, function_url = parent_conn.recv()
+    settings = install_fake_config(args, misskey_url, function_url)
+
+    def fake_stats():
+        parent_conn.send('stats')
+        return parent_conn.recv()
+
+    sys.path.insert(0, os.path.join(BENCH_DIR, "..", "bot"))
+    import collect_notes
+    import scheduler
+    from note_store import NoteStore
+
+    with NoteStore(settings['NOTE_STORE_PATH']) as store:
+        store.set_meta(collect_notes.CURSOR_ID_KEY, '0')
+    state_path = os.path.join(tempfile.mkdtemp(prefix="misskey_summarizer_scheduler_"), "state.json")
+    daemon = scheduler.Scheduler(scheduler.JOBS, scheduler.SCHEDULER_JOBS, state_path)
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        ran, stats = asyncio.run(run_check(daemon, fake_stats))
+    parent_conn.send('stop')
+    with open(state_path, encoding='utf-8') as f:
+        state = json.load(f)
+
+    skipped = [line.strip() for line in log.getvalue().splitlines() if "[scheduler]" in line and "見送" in line]
+    waited = [line.strip() for line in log.getvalue().splitlines() if "[scheduler]" in line and "待ちます" in line]
+    print("==============================================")
+    print(f"実行したジョブ: {ran}")
+    print(f"見送り: {len(skipped)}件 / 待機: {len(waited)}件 / 投稿数: {stats['posted']}")
+    for line in skipped + waited:
+        print(f"  {line}")
+    print(f"状態ファイル: {sorted(state)}")
+    ok = (ran == ['collect', 'rolling_summarize', 'summarize', 'post'] and len(skipped) == 2 and len(waited) == 1
+          and stats['posted'] == 1 and all(state[name]['last_succeeded'] for name in ran))
+    print("OK" if ok else "NG")
+    if not ok:
+        print("\n".join(log.getvalue().splitlines()[-40:]))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
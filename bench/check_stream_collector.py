@@ -0,0 +1,89 @@
+# 【ファイル名: bench/check_stream_collector.py】
+# (偽の Misskey サーバーに対してストリーミング収集を動かし、切断を挟んでも取りこぼし・重複が無いかを確認する)
+#
+# 使い方:
+#   python3 bench/check_stream_collector.py --seconds 10 --rate 20 --drop-every 2
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_misskey import FakeMisskey
+
+
+def install_fake_config(rest_url, data_dir):
+    sys.modules['config'] = types.SimpleNamespace(
+        MISSKEY_URL=rest_url,
+        MISSKEY_TOKEN="fake-token",
+        EXCLUDE_USER_ID="user1",
+        DATA_DIR=data_dir,
+        NOTE_STORE_PATH=os.path.join(data_dir, "notes.sqlite3"),
+        STREAM_FLUSH_INTERVAL_SECONDS=0.5,
+        RETRY_BASE_WAIT_SECONDS=0.2,
+        PAGE_INTERVAL_SECONDS=0,
+    )
+
+
+async def run_check(args, data_dir):
+    fake = FakeMisskey(rate=args.rate, drop_every=args.drop_every)
+    rest = fake.start_rest()
+    stream = await fake.serve_stream()
+    stream_port = next(iter(stream.sockets)).getsockname()[1]
+    install_fake_config(f"http://127.0.0.1:{rest.server_address[1]}", data_dir)
+
+    sys.path.insert(0, os.path.join(BENCH_DIR, "..", "bot"))
+    from note_store import NoteStore
+    from stream_collector import StreamCollector
+    from collect_notes import is_collectable
+
+    # なぜ？: 収集開始前の投稿も REST の補完で取り込まれることを確認するため、先に少し投稿しておきます。
+    for _ in range(30):
+        fake.post_note()
+
+    store = NoteStore(os.path.join(data_dir, "notes.sqlite3"))
+    collector = StreamCollector(store)
+    producer = asyncio.create_task(fake.produce())
+    runner = asyncio.create_task(collector.run(f"ws://127.0.0.1:{stream_port}/streaming?i=fake-token"))
+    await asyncio.sleep(args.seconds)
+    producer.cancel()
+    runner.cancel()
+    await asyncio.gather(producer, runner, return_exceptions=True)
+    # なぜ？: 停止直前の投稿はまだ書き込まれていない可能性があるため、最後に1回だけ補完します。
+    await collector.flush()
+    collector.backfill()
+
+    expected = {note['id'] for note in fake.notes if is_collectable(note)}
+    stored = [row['id'] for row in store.iter_notes()]
+    reactions = sum(row['reaction_count'] for row in store.iter_notes())
+    store.close()
+    stream.close()
+    rest.shutdown()
+
+    missing = expected - set(stored)
+    duplicates = len(stored) - len(set(stored))
+    print("==============================================")
+    print(f"投稿数: {len(fake.notes)} / 収集対象: {len(expected)} / 保存: {len(stored)}")
+    print(f"取りこぼし: {len(missing)} / 重複: {duplicates} / REST呼び出し: {fake.rest_requests} / リアクション合計: {reactions}")
+    return not missing and duplicates == 0 and set(stored) == expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ストリーミング収集の取りこぼし・重複を確認します")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rate', type=float, default=20)
+    parser.add_argument('--drop-every', type=float, default=2)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as data_dir:
+        ok = asyncio.run(run_check(args, data_dir))
+    print("OK" if ok else "NG")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
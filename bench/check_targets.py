@@ -0,0 +1,98 @@
+# 【ファイル名: bench/check_targets.py】
+# (複数の偽 Misskey サーバーをターゲットにして収集 -> 要約 -> 投稿 を実行し、ターゲットごとにノート・要約・投稿が
+#  分かれていることと、GCP への同時リクエスト数が全ターゲット合わせて上限以内であることを確認する)
+#
+# 使い方:
+#   python3 bench/check_targets.py --targets 5 --notes 2000 --workers 3
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_gemini import FakeGemini
+from fake_misskey import FakeMisskey
+from synthetic_notes import generate_notes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数ターゲットの収集・要約・投稿を確認します")
+    parser.add_argument('--targets', type=int, default=4)
+    parser.add_argument('--notes', type=int, default=2000, help="ターゲットごとのノート数")
+    parser.add_argument('--workers', type=int, default=3, help="GCPへの同時リクエスト数の上限 (全ターゲット共通)")
+    parser.add_argument('--latency', type=float, default=0.2)
+    args = parser.parse_args()
+
+    end = datetime.now(timezone.utc) - timedelta(minutes=20)
+    servers = []
+    for i in range(args.targets):
+        misskey = FakeMisskey(seed=i)
+        misskey.add_notes(list(generate_notes(args.notes, start=end - timedelta(hours=24),
+                                              interval_seconds=24 * 3600 / args.notes, seed=i)))
+        servers.append((misskey, misskey.start_rest()))
+    gemini = FakeGemini(args.latency, output_chars=300)
+    function = gemini.start()
+
+    data_dir = tempfile.mkdtemp(prefix="misskey_summarizer_targets_")
+    sys.modules['config'] = types.SimpleNamespace(
+        GCP_FUNCTION_URL=f"http://127.0.0.1:{function.server_address[1]}/",
+        DATA_DIR=data_dir,
+        TARGETS=[
+            {'name': f"server{i}", 'misskey_url': f"http://127.0.0.1:{rest.server_address[1]}",
+             'misskey_token': f"token{i}", 'exclude_user_id': "user1"}
+            for i, (_, rest) in enumerate(servers)
+        ],
+        # なぜ？: ターゲットごとに複数のチャンクができるよう、チャンクを小さくします。
+        CHUNK_SIZE=20000,
+        MAX_CONCURRENT_REQUESTS=args.workers,
+        GCP_RETRY_WAIT_SECONDS=0,
+        RETRY_BASE_WAIT_SECONDS=0,
+        PAGE_INTERVAL_SECONDS=0,
+        MAX_PAGES_PER_RUN=args.notes // 100 + 10,
+    )
+    sys.path.insert(0, os.path.join(BENCH_DIR, "..", "bot"))
+    import collect_notes
+    import post_note
+    import summarize
+    import targets
+    from note_store import NoteStore
+
+    # なぜ？: 初回の収集は30分前からしか取得しないため、1日分を取り込めるようカーソルを先頭にしておきます。
+    for target in targets.TARGETS:
+        os.makedirs(target.data_dir, exist_ok=True)
+        with NoteStore(target.note_store_path) as store:
+            store.set_meta(collect_notes.CURSOR_ID_KEY, '0')
+
+    started = time.perf_counter()
+    collect_notes.execute_periodic_collection()
+    collected_at = time.perf_counter()
+    summarized = summarize.execute_summarize()
+    summarized_at = time.perf_counter()
+    posted = post_note.execute_post()
+
+    print("==============================================")
+    ok = summarized and posted
+    for target, (misskey, _) in zip(targets.TARGETS, servers):
+        with targets.use(target):
+            expected = sum(1 for note in misskey.notes if collect_notes.is_collectable(note))
+        with NoteStore(target.note_store_path) as store:
+            stored = store.count_notes()
+            pending = store.count_notes(pending_only=True)
+        print(f"  {target.name}: ストア {stored}/{expected}件 (未要約 {pending}件) / 投稿 {len(misskey.created)}件")
+        ok = ok and stored == expected and pending == 0 and len(misskey.created) == 1
+    print(f"収集: {collected_at - started:.1f}秒 / 要約: {summarized_at - collected_at:.1f}秒 "
+          f"(GCPリクエスト {gemini.stats['requests']}件, 同時実行の最大 {gemini.max_in_flight}/{args.workers})")
+    ok = ok and gemini.max_in_flight <= args.workers
+    print("OK" if ok else "NG")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
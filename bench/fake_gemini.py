@@ -0,0 +1,248 @@
+# 【ファイル名: bench/fake_gemini.py】
+# (ローカルで動く偽の AI要約サーバー: cloud_function/main.py の summarize_text_handler と同じリクエスト形式に応答する)
+#
+# 使い方:
+#   python3 bench/fake_gemini.py --latency 2 --error-rate 0.05
+#   -> 表示された URL を config.GCP_FUNCTION_URL に設定して bot を動かします。
+
+import argparse
+import gzip
+import json
+import os
+import random
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeGemini:
+    """
+    Cloud Function の代わりに、指定した遅延・エラー率で要約 (らしきもの) を返す
+    対応するリクエスト: 1件 ({"text"}), ストリーミング ({"stream": true}), バッチ ({"texts"}), count_tokens
+    """
+
+    def __init__(self, latency=0.5, latency_per_kchar=0.0, error_rate=0.0, stall_rate=0.0,
+                 output_chars=400, seed=0):
+        self.latency = latency
+        self.latency_per_kchar = latency_per_kchar
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.output_chars = output_chars
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'items': 0, 'errors': 0, 'stalls': 0, 'bytes_in': 0, 'chars_in': 0}
+        self.in_flight = 0
+        self.max_in_flight = 0  # 同時に処理していたリクエスト数の最大 (クライアント側の同時実行数の上限の確認用)
+
+    # --- 応答の生成 ---
+
+    def _roll(self, rate):
+        with self.lock:
+            return self.rng.random() < rate
+
+    def _count(self, **values):
+        with self.lock:
+            for key, value in values.items():
+                self.stats[key] += value
+
+    def generation_seconds(self, text):
+        # なぜ？: 本物のモデルは入力が長いほど時間がかかるため、固定の遅延 + 入力1000文字あたりの遅延で近似します。
+        return self.latency + self.latency_per_kchar * len(text) / 1000
+
+    def make_summary(self, prompt, text):
+        """
+        入力の先頭の行を使って、それらしい箇条書きを output_chars 文字ほど作る
+        """
+        lines = [line.strip() for line in text.splitlines() if line.strip() and not line.startswith("=")]
+        # なぜ？: 最終要約は投稿の文字数制限 (2900文字) の確認に使われるため、それより短い長さにします。
+        limit = min(self.output_chars, 2000)
+        summary = "$[tada.speed=0s 今日の話題]\n" if "最終的なレポート" in prompt else ""
+        for line in lines:
+            if len(summary) >= limit:
+                break
+            summary += f"・{line[:60]}\n"
+        return summary or "・特に話題はありませんでした\n"
+
+    def summarize_one(self, prompt, text):
+        """
+        1件を要約する。エラーを注入する場合は None を返す
+        """
+        self._count(items=1, chars_in=len(text))
+        time.sleep(self.generation_seconds(text))
+        if self._roll(self.error_rate):
+            self._count(errors=1)
+            return None
+        return self.make_summary(prompt, text)
+
+    # --- HTTP ---
+
+    def make_http_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                with fake.lock:
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                try:
+                    return self.handle_request()
+                finally:
+                    with fake.lock:
+                        fake.in_flight -= 1
+
+            def handle_request(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                fake._count(requests=1, bytes_in=len(body))
+                if self.headers.get('Content-Encoding', '').lower() == 'gzip':
+                    body = gzip.decompress(body)
+                payload = json.loads(body or b'{}')
+                prompt = payload.get('prompt') or ''
+
+                if payload.get('count_tokens'):
+                    return self.send_json({'tokens': [max(1, len(text) // 2) for text in payload['texts']]})
+                if 'texts' in payload:
+                    results = []
+                    for text in payload['texts']:
+                        summary = fake.summarize_one(prompt, text)
+                        results.append({'ok': True, 'summary': summary} if summary else
+                                       {'ok': False, 'error': 'injected error'})
+                    return self.send_json({'results': results})
+
+                text = payload.get('text') or ''
+                if payload.get('stream'):
+                    return self.send_stream(prompt, text)
+                summary = fake.summarize_one(prompt, text)
+                if summary is None:
+                    return self.send_text(500, "要約の生成に失敗しました。")
+                return self.send_text(200, summary)
+
+            def send_json(self, result):
+                data = json.dumps(result, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_text(self, status, text):
+                data = text.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_stream(self, prompt, text):
+                """
+                cloud_function/main.py と同じ NDJSON 形式で、要約を数回に分けて送る
+                """
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                self.write_event({'event': 'start'})
+                summary = fake.summarize_one(prompt, text)
+                if summary is None:
+                    self.write_event({'error': 'injected error'})
+                elif fake._roll(fake.stall_rate):
+                    # なぜ？: 出力が途中で止まった生成を、クライアントが打ち切れるか確かめるため、送信を止めたまま待ちます。
+                    fake._count(stalls=1)
+                    self.write_event({'delta': summary[:len(summary) // 2]})
+                    time.sleep(3600)
+                    return
+                else:
+                    pieces = 4
+                    step = max(1, len(summary) // pieces)
+                    for start in range(0, len(summary), step):
+                        self.write_event({'delta': summary[start:start + step]})
+                    self.write_event({'done': True})
+                self.wfile.write(b"0\r\n\r\n")
+
+            def write_event(self, event):
+                data = (json.dumps(event, ensure_ascii=False) + "\n").encode('utf-8')
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, host='127.0.0.1', port=0):
+        server = ThreadingHTTPServer((host, port), self.make_http_handler())
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """
+    vertexai の GenerativeModel の代わりに、FakeGemini と同じ要約 (らしきもの) を返す
+    (cloud_function/main.py を functions-framework でローカルに動かすときに MODEL_FACTORY で指定します)
+    """
+
+    def __init__(self, fake):
+        self.fake = fake
+
+    def generate_content(self, contents, generation_config=None, stream=False):
+        summary = self.fake.summarize_one(contents, contents)
+        if summary is None:
+            raise RuntimeError("injected error")
+        # なぜ？: 生成設定が Cloud Function からモデルまで届いているか確かめられるよう、出力を1文字1トークンとみなして切り詰めます。
+        max_output_tokens = (generation_config or {}).get('max_output_tokens')
+        if max_output_tokens:
+            summary = summary[:max_output_tokens]
+        if not stream:
+            return _FakeResponse(summary)
+        step = max(1, len(summary) // 4)
+        return iter([_FakeResponse(summary[start:start + step]) for start in range(0, len(summary), step)])
+
+    def count_tokens(self, contents):
+        return types.SimpleNamespace(total_tokens=max(1, len(contents) // 2))
+
+
+# 初期化に失敗させる残り回数 (Cloud Function のモデル初期化の再試行を確認するため)
+_init_failures = int(os.environ.get('FAKE_MODEL_INIT_FAILURES', '0'))
+
+
+def create_fake_model():
+    """
+    cloud_function/main.py の MODEL_FACTORY に "fake_gemini:create_fake_model" として指定する
+    """
+    global _init_failures
+    if _init_failures > 0:
+        _init_failures -= 1
+        raise RuntimeError("偽のモデルの初期化に失敗しました (FAKE_MODEL_INIT_FAILURES)")
+    return FakeGenerativeModel(FakeGemini(latency=float(os.environ.get('FAKE_MODEL_LATENCY', '0.5'))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="偽の AI要約サーバーを起動します")
+    parser.add_argument('--latency', type=float, default=0.5, help="1回の要約にかかる固定の時間(秒)")
+    parser.add_argument('--latency-per-kchar', type=float, default=0.0, help="入力1000文字あたりに追加でかかる時間(秒)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="要約に失敗する確率")
+    parser.add_argument('--stall-rate', type=float, default=0.0, help="ストリーミング応答が途中で止まる確率")
+    parser.add_argument('--output-chars', type=int, default=400)
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+    fake = FakeGemini(args.latency, args.latency_per_kchar, args.error_rate, args.stall_rate, args.output_chars)
+    server = fake.start(port=args.port)
+    print(f"Function URL: http://127.0.0.1:{server.server_address[1]}/")
+    try:
+        while True:
+            time.sleep(60)
+            print(fake.stats)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# 【ファイル名: bench/fake_misskey.py】
+# (ローカルで動く偽の Misskey サーバー: REST の notes/local-timeline と ストリーミングAPI の localTimeline)
+#
+# 使い方:
+#   python3 bench/fake_misskey.py --rate 5 --drop-every 30
+#   -> 表示された URL を config.MISSKEY_URL に設定して bot を動かします。
+
+import argparse
+import asyncio
+import bisect
+import json
+import random
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from synthetic_notes import make_note
+
+
+class FakeMisskey:
+    """
+    合成ノートを一定のペースで「投稿」し、REST とストリーミングの両方で配信する
+    """
+
+    def __init__(self, rate=5.0, drop_every=None, reaction_rate=0.5, seed=0):
+        self.rate = rate
+        self.drop_every = drop_every
+        self.reaction_rate = reaction_rate
+        self.rng = random.Random(seed)
+        self.notes = []
+        self.ids = []           # self.notes と同じ順の ID (sinceId の位置を二分探索で探すため)
+        self.created = []       # notes/create で投稿されたノート
+        self.lock = threading.Lock()
+        self.stream_clients = set()
+        self.rest_requests = 0
+
+    # --- ノートの生成 ---
+
+    def post_note(self):
+        with self.lock:
+            note = make_note(len(self.notes), datetime.now(timezone.utc), self.rng)
+            self.notes.append(note)
+            self.ids.append(note['id'])
+        return note
+
+    def add_notes(self, notes):
+        with self.lock:
+            self.notes.extend(notes)
+            self.notes.sort(key=lambda note: note['id'])
+            self.ids = [note['id'] for note in self.notes]
+
+    # --- REST API ---
+
+    def local_timeline(self, payload):
+        """
+        Misskey のページング規則 (sinceId/sinceDate は古い順、untilId は新しい順) を真似て返す
+        """
+        limit = min(int(payload.get('limit', 10)), 100)
+        if 'sinceId' in payload:
+            # なぜ？: 1日分 (10万件以上) のノートを配信するベンチで、偽サーバーの方が遅くならないよう二分探索します。
+            with self.lock:
+                start = bisect.bisect_right(self.ids, payload['sinceId'])
+                selected = self.notes[start:start + limit]
+            return list(reversed(selected))
+        with self.lock:
+            notes = list(self.notes)
+        if 'sinceDate' in payload:
+            since = datetime.fromtimestamp(payload['sinceDate'] / 1000, timezone.utc)
+            selected = [n for n in notes if _parse(n['createdAt']) > since][:limit]
+        else:
+            if 'untilId' in payload:
+                notes = [n for n in notes if n['id'] < payload['untilId']]
+            selected = notes[-limit:]
+        # なぜ？: 本物の Misskey と同じく、レスポンスは新しい順で返します。
+        return list(reversed(selected))
+
+    def notes_create(self, payload):
+        with self.lock:
+            note_id = f"created{len(self.created):06d}"
+            self.created.append(dict(payload, id=note_id))
+        return {'createdNote': {'id': note_id, **payload}}
+
+    def make_http_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                fake.rest_requests += 1
+                if self.path == '/api/notes/local-timeline':
+                    result = fake.local_timeline(payload)
+                elif self.path == '/api/notes/create':
+                    result = fake.notes_create(payload)
+                else:
+                    self.send_error(404)
+                    return
+                body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start_rest(self, host='127.0.0.1', port=0):
+        server = ThreadingHTTPServer((host, port), self.make_http_handler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    # --- ストリーミングAPI ---
+
+    async def stream_handler(self, ws, *args):
+        channel_id = None
+        subscribed = set()
+        self.stream_clients.add(ws)
+        loop = asyncio.get_running_loop()
+        opened = loop.time()
+        try:
+            while True:
+                if self.drop_every and loop.time() - opened > self.drop_every:
+                    # なぜ？: 再接続と REST での補完を試すため、一定時間ごとにわざと切断します。
+                    await ws.close()
+                    return
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), timeout=0.2)
+                except asyncio.TimeoutError:
+                    raw = None
+                if raw is not None:
+                    message = json.loads(raw)
+                    body = message.get('body') or {}
+                    if message.get('type') == 'connect' and body.get('channel') == 'localTimeline':
+                        channel_id = body.get('id')
+                        ws.fake_channel_id = channel_id
+                    elif message.get('type') == 'subNote':
+                        subscribed.add(body.get('id'))
+                    elif message.get('type') == 'unsubNote':
+                        subscribed.discard(body.get('id'))
+                if subscribed and self.rng.random() < self.reaction_rate:
+                    note_id = self.rng.choice(sorted(subscribed))
+                    await ws.send(json.dumps({
+                        'type': 'noteUpdated',
+                        'body': {'id': note_id, 'type': 'reacted', 'body': {'reaction': '👍'}},
+                    }))
+        except Exception:
+            pass
+        finally:
+            self.stream_clients.discard(ws)
+
+    async def broadcast(self, note):
+        for ws in list(self.stream_clients):
+            channel_id = getattr(ws, 'fake_channel_id', None)
+            if channel_id is None:
+                continue
+            try:
+                await ws.send(json.dumps({
+                    'type': 'channel',
+                    'body': {'id': channel_id, 'type': 'note', 'body': note},
+                }, ensure_ascii=False))
+            except Exception:
+                pass
+
+    async def produce(self):
+        while True:
+            await asyncio.sleep(1.0 / self.rate)
+            await self.broadcast(self.post_note())
+
+    async def serve_stream(self, host='127.0.0.1', port=0):
+        import websockets
+        server = await websockets.serve(self.stream_handler, host, port)
+        return server
+
+
+def _parse(created_at):
+    return datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+
+
+async def _main(args):
+    fake = FakeMisskey(rate=args.rate, drop_every=args.drop_every)
+    rest = fake.start_rest(port=args.port)
+    stream = await fake.serve_stream(port=args.stream_port)
+    stream_port = next(iter(stream.sockets)).getsockname()[1]
+    print(f"REST:      http://127.0.0.1:{rest.server_address[1]}")
+    print(f"Streaming: ws://127.0.0.1:{stream_port}/streaming")
+    await fake.produce()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="偽の Misskey サーバーを起動します")
+    parser.add_argument('--rate', type=float, default=5.0, help="1秒あたりの投稿数")
+    parser.add_argument('--drop-every', type=float, default=None, help="ストリーミング接続をこの秒数ごとに切断する")
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--stream-port', type=int, default=0)
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# 【ファイル名: bench/synthetic_notes.py】
+# (ベンチマーク用の合成LTLノート生成)
+
+import random
+from datetime import datetime, timedelta, timezone
+
+_WORDS = [
+    "おはよう", "ねむい", "寿司", "ラーメン", "新刊", "イベント", "サーバー", "メンテ",
+    "絵文字", "リアクション", "雨", "晴れ", "電車", "遅延", "ゲーム", "アプデ", "猫", "犬",
+    "コーヒー", "締め切り", "配信", "ライブ", "Misskey", "ノート", "お知らせ", "深夜",
+]
+_SHORT_POSTS = ["草", "わかる", "それな", "おはようございます", "おやすみなさい", "ｗｗｗｗ", ":igyo:", "おはようございます！"]
+
+
+def make_note(index, created_at, rng):
+    """
+    Misskey の notes/local-timeline が返すノートに似た辞書を1件作る
+    """
+    roll = rng.random()
+    if roll < 0.08:
+        # なぜ？: 実際のLTLに多い、短い相づちや定型の挨拶（重複しやすい投稿）も混ぜておきます。
+        text = rng.choice(_SHORT_POSTS)
+    else:
+        text = "".join(rng.choice(_WORDS) for _ in range(rng.randint(3, 60)))
+    if rng.random() < 0.05:
+        # なぜ？: 本文中に区切り行や空行が含まれるノートでもチャンカーが壊れないことを確認するため。
+        text += "\n\n=========\n(区切りっぽい行)"
+    user_no = rng.randint(1, 300)
+    return {
+        'id': f"{int(created_at.timestamp() * 1000):x}{index:06x}",
+        'createdAt': created_at.strftime('%Y-%m-%dT%H:%M:%S.') + f"{created_at.microsecond // 1000:03d}Z",
+        'user': {'id': f"user{user_no}", 'username': f"user{user_no}", 'name': f"ユーザー{user_no}"},
+        'text': text,
+        'reactionCount': int(rng.expovariate(0.3)),
+        'repliesCount': int(rng.expovariate(1.5)),
+        'renoteCount': int(rng.expovariate(2.0)),
+        'files': [{}] if rng.random() < 0.1 else [],
+        'renote': None,
+    }
+
+
+def generate_notes(count, start=None, interval_seconds=1.0, seed=0):
+    """
+    count 件の合成ノートを古い順に生成する
+    """
+    rng = random.Random(seed)
+    if start is None:
+        start = datetime.now(timezone.utc) - timedelta(seconds=count * interval_seconds)
+    for i in range(count):
+        yield make_note(i, start + timedelta(seconds=i * interval_seconds), rng)
+
@@ -0,0 +1,65 @@
+# 【ファイル名: bot/__main__.py】
+# (python3 -m bot <ジョブ> で各ジョブを実行する共通の入り口)
+#
+# 使い方 (リポジトリのルートで):
+#   python3 -m bot collect          # 定期収集 (cron で15分ごと)
+#   python3 -m bot summarize
+#   python3 -m bot archive cat 20240101
+#
+# なぜ？: 収集は1日96回起動されるため、起動のたびに要約側のモジュール (numpy・websockets など) まで読み込むと
+# 小さなサーバーでは負担になります。ジョブのモジュールは実行するジョブのものだけを、選ばれてから読み込みます。
+# (収集の読み込み時間は bench/check_import_time.py で確認できます)
+
+import argparse
+import importlib
+import os
+import sys
+
+# ジョブ名 -> (モジュール, 関数, 説明)。モジュールはここでは読み込まず、load_job() で初めて読み込みます
+JOBS = {
+    'collect': ('collect_notes', 'execute_periodic_collection', "タイムラインのノートを収集する (15分ごと)"),
+    'stream': ('stream_collector', 'execute_stream_collection', "ストリーミングでノートを収集し続ける (常駐)"),
+    'rolling_summarize': ('rolling_summarize', 'execute_rolling_summarize', "埋まったチャンクから順に部分要約する"),
+    'summarize': ('summarize', 'execute_summarize', "1日分のノートを要約する"),
+    'post': ('post_note', 'execute_post', "要約を投稿する"),
+    'renote': ('renote', 'execute_renote', "朝の投稿をリノートする"),
+    'scheduler': ('scheduler', 'execute_scheduler', "全ジョブを内部のスケジュールで実行する (常駐)"),
+    'archive': ('note_archive', 'main', "要約済みノートのアーカイブを操作する (list / cat / restore / rotate)"),
+}
+# 引数をそのまま渡すジョブ
+JOBS_WITH_ARGS = {'archive'}
+
+# なぜ？: 各モジュールは bot/ 直下のモジュールを `import config` のように読み込むため、bot/ を検索パスに入れます。
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_job(name):
+    """
+    ジョブのモジュールを読み込み、実行する関数を返す
+    """
+    module_name, function_name, _ = JOBS[name]
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python3 -m bot",
+        description="Misskey要約ボットのジョブを実行します",
+        epilog="ジョブ:\n" + "\n".join(f"  {name:<18} {job[2]}" for name, job in JOBS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('job', choices=JOBS, metavar='job', help="実行するジョブ")
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="ジョブに渡す引数 (archive のみ)")
+    args = parser.parse_args(argv)
+    if args.args and args.job not in JOBS_WITH_ARGS:
+        parser.error(f"{args.job} は引数を取りません: {' '.join(args.args)}")
+
+    function = load_job(args.job)
+    if args.job in JOBS_WITH_ARGS:
+        return function(args.args)
+    return function()
+
+
+if __name__ == "__main__":
+    # なぜ？: cron や systemd から失敗を検知できるよう、ジョブが失敗 (False) したら終了コード 1 で終わります。
+    sys.exit(1 if main() is False else 0)
@@ -0,0 +1,89 @@
+# 【ファイル名: bot/checkpoint.py】
+# (要約パイプラインの途中経過を1ステップずつディスクに保存し、再実行時に再開するためのチェックポイント)
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+
+class SummarizeCheckpoint:
+    """
+    Mapの各チャンク・Reduceの各段の結果を、ステップ名ごとのファイルに保存する
+    """
+
+    def __init__(self, checkpoint_dir):
+        self.checkpoint_dir = checkpoint_dir
+        self.resumed = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _path(self, step):
+        return os.path.join(self.checkpoint_dir, f"{step}.json")
+
+    def load(self, step, input_text):
+        """
+        保存済みのステップ結果を返す。
+        入力が前回と異なる（ノートが追記された等）場合は、無効として None を返します。
+        """
+        try:
+            with open(self._path(step), 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if record.get('input_sha256') != self._digest(input_text):
+            return None
+        with self._lock:
+            self.resumed += 1
+        return record.get('output')
+
+    def save(self, step, input_text, output):
+        """
+        ステップ結果を保存する（一時ファイル経由で置き換え、書きかけのファイルを残しません）
+        """
+        path = self._path(step)
+        try:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'input_sha256': self._digest(input_text), 'output': output}, f, ensure_ascii=False)
+                f.flush()
+                # なぜ？: 電源断やプロセス強制終了でも、完了したステップの結果が失われないようにします。
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"  警告: チェックポイント '{step}' の保存に失敗しました: {e}")
+
+    def clear(self):
+        """
+        要約が最後まで完了した後、チェックポイントを削除する
+        """
+        if os.path.isdir(self.checkpoint_dir):
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+            print(f"  チェックポイント '{self.checkpoint_dir}' を削除しました。")
+
+
+@contextmanager
+def pipeline_lock(lock_path, blocking=True):
+    """
+    同じノートファイルに対する要約処理が同時に走らないようにするファイルロック
+    blocking=False の場合、他のプロセスが実行中なら取得できずに False を返します。
+    """
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    with open(lock_path, 'w') as lock_file:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
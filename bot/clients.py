@@ -0,0 +1,297 @@
+# 【ファイル名: bot/clients.py】
+# (Misskey API と GCP Cloud Function への通信をまとめた共通クライアント)
+
+import gzip
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+
+# --- タイムアウト・リトライ設定 ---
+MISSKEY_TIMEOUT_SECONDS = getattr(config, 'MISSKEY_TIMEOUT_SECONDS', 30)
+GCP_TIMEOUT_SECONDS = getattr(config, 'GCP_TIMEOUT_SECONDS', 540)
+# ストリーミング受信で、この秒数のあいだ何も届かなければ生成が止まったとみなして打ち切る
+GCP_STREAM_STALL_SECONDS = getattr(config, 'GCP_STREAM_STALL_SECONDS', 120)
+GCP_CONNECT_TIMEOUT_SECONDS = 10
+MAX_API_RETRIES = getattr(config, 'MAX_API_RETRIES', 5)
+RETRY_BASE_WAIT_SECONDS = getattr(config, 'RETRY_BASE_WAIT_SECONDS', 2)  # 1回目の再試行までの待ち時間 (以後倍々)
+RETRY_MAX_WAIT_SECONDS = getattr(config, 'RETRY_MAX_WAIT_SECONDS', 120)
+
+# なぜ？: 数KB未満の小さなリクエストは、圧縮しても通信量がほとんど減らないため無圧縮で送ります。
+GZIP_MIN_BYTES = getattr(config, 'GZIP_MIN_BYTES', 4096)
+# なぜ？: Mapステージの並列数ぶんの接続を使い回せるよう、プールを少し大きめに確保します。
+POOL_MAXSIZE = max(10, getattr(config, 'MAX_CONCURRENT_REQUESTS', 4) * 2)
+
+# GCP (AI要約) へのリクエスト数の上限 (1分あたり, 全ターゲット・全スレッドの合計)。None なら制限しない
+# なぜ？: 多数のターゲットを1台で要約すると、Gemini のクォータ (1分あたりのリクエスト数) を超えて 429 が続くためです。
+GCP_REQUESTS_PER_MINUTE = getattr(config, 'GCP_REQUESTS_PER_MINUTE', None)
+
+# なぜ？: これらはサーバー側の一時的な不調なので、待てば回復する見込みがあります。
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class GCPStreamError(requests.exceptions.RequestException):
+    """
+    ストリーミング応答の途中で Cloud Function 側がエラーを報告した、または応答が途中で終わった
+    """
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    プロセス内で共有する requests.Session を返す
+    （Keep-Alive で接続を使い回し、リクエストごとの TCP/TLS ハンドシェイクを省きます）
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+class RateLimiter:
+    """
+    1分あたりの回数を上限とするトークンバケット（複数スレッドから共有して使います）
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.lock = threading.Lock()
+        self.tokens = float(per_minute or 0)
+        self.updated = time.monotonic()
+
+    def acquire(self):
+        """
+        1回分の枠が空くまで待つ。戻り値は待った秒数
+        """
+        if not self.per_minute:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.per_minute / 60)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) * 60 / self.per_minute
+            # なぜ？: 待つ間はロックを手放し、他のスレッドが枠を確認できるようにします。
+            time.sleep(wait)
+            waited += wait
+
+
+gcp_rate_limiter = RateLimiter(GCP_REQUESTS_PER_MINUTE)
+
+
+def backoff_seconds(attempt):
+    """
+    指数バックオフ + ジッター (attempt 回目の失敗後に待つ秒数)
+    """
+    # なぜ？: 待ち時間をランダムにずらし、複数の再試行が同じ瞬間にサーバーへ集中しないようにします。
+    wait = min(RETRY_MAX_WAIT_SECONDS, RETRY_BASE_WAIT_SECONDS * (2 ** attempt))
+    return wait / 2 + random.uniform(0, wait / 2)
+
+
+def retry_after_seconds(response):
+    """
+    Retry-After ヘッダー (秒数 または HTTP日付) を秒数に変換する。無ければ None
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def encode_json_body(payload):
+    """
+    JSON のリクエストボディを作る。大きい場合は gzip で圧縮し、追加のヘッダーと一緒に返す
+    """
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    headers = {'Content-Type': 'application/json; charset=utf-8'}
+    if len(body) >= GZIP_MIN_BYTES:
+        # なぜ？: 日本語のノート本文は gzip でおおよそ数分の1になり、大きなチャンクのアップロード時間を減らせます。
+        body = gzip.compress(body, compresslevel=6)
+        headers['Content-Encoding'] = 'gzip'
+    return body, headers
+
+
+class MisskeyClient:
+    """
+    Misskey API を呼び出すクライアント（接続の使い回し・再試行・レート制限への対応を含む）
+    """
+
+    def __init__(self, base_url, token):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+
+    def api(self, endpoint, payload, max_retries=None, stats=None):
+        """
+        API を1回呼び出して JSON を返す。一時的なエラーは指数バックオフで再試行し、
+        429 (レート制限) の場合は Retry-After に従って待つ。最後まで失敗した場合は None を返す
+        """
+        if max_retries is None:
+            max_retries = MAX_API_RETRIES
+        if stats is None:
+            stats = {'api_seconds': 0.0, 'retries': 0, 'rate_limited': 0, 'bytes': 0}
+        url = f"{self.base_url}/api/{endpoint}"
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {self.token}',
+        }
+        for attempt in range(max_retries):
+            wait = None
+            started = time.perf_counter()
+            try:
+                response = get_session().post(url, headers=headers, json=payload, timeout=MISSKEY_TIMEOUT_SECONDS)
+                stats['api_seconds'] += time.perf_counter() - started
+                if response.status_code in RETRYABLE_STATUS_CODES:
+                    if response.status_code == 429:
+                        stats['rate_limited'] += 1
+                        wait = retry_after_seconds(response)
+                    print(f"    APIエラー ({endpoint}: HTTP {response.status_code})。")
+                else:
+                    # なぜ？: 認証エラー等の 4xx は再試行しても直らないため、そのまま例外にします。
+                    response.raise_for_status()
+                    stats['bytes'] = stats.get('bytes', 0) + len(response.content)
+                    return response.json() if response.content else None
+            except requests.exceptions.HTTPError:
+                raise
+            except requests.exceptions.RequestException as api_e:
+                stats['api_seconds'] += time.perf_counter() - started
+                print(f"    API通信エラー ({endpoint}): {api_e}")
+
+            if attempt == max_retries - 1:
+                break
+            stats['retries'] += 1
+            if wait is None:
+                wait = backoff_seconds(attempt)
+            print(f"    {wait:.1f}秒待ってから再試行します... ({attempt+1}/{max_retries})")
+            time.sleep(wait)
+
+        print(f"    最大リトライ回数 ({max_retries}) に達しました。")
+        return None
+
+    def notes_create(self, text=None, visibility=None, cw=None, renote_id=None, reply_id=None):
+        """
+        ノートを投稿する (notes/create)。戻り値は API のレスポンス ({'createdNote': {...}})
+        """
+        payload = {}
+        if text is not None:
+            payload['text'] = text
+        if visibility is not None:
+            payload['visibility'] = visibility
+        if cw is not None:
+            payload['cw'] = cw
+        if renote_id is not None:
+            payload['renoteId'] = renote_id
+        if reply_id is not None:
+            payload['replyId'] = reply_id
+        # なぜ？: 投稿は冪等ではなく、タイムアウト後に再送すると二重投稿になりうるため、自動では再試行しません。
+        result = self.api('notes/create', payload, max_retries=1)
+        if result is None:
+            raise RuntimeError("notes/create の呼び出しに失敗しました。")
+        return result
+
+
+def post_to_gcp(payload, timeout=None):
+    """
+    GCP Cloud Function に JSON を POST してレスポンスを返す（大きなボディは gzip 圧縮して送ります）
+    """
+    body, headers = encode_json_body(payload)
+    gcp_rate_limiter.acquire()
+    return get_session().post(
+        config.GCP_FUNCTION_URL,
+        data=body,
+        headers=headers,
+        timeout=timeout or GCP_TIMEOUT_SECONDS,
+    )
+
+
+def stream_from_gcp(payload, stall_timeout=None, total_timeout=None):
+    """
+    GCP Cloud Function にストリーミングでの要約を依頼し、届いた断片を順に受け取って結合する。
+    戻り値は (要約テキスト, 計測値 {'ttfb', 'seconds', 'streamed', 'bytes'})
+
+    応答は1行1イベントの JSON (NDJSON):
+      {"event": "start"} -> {"delta": "..."} の繰り返し -> {"done": true} または {"error": "..."}
+    """
+    stall_timeout = stall_timeout or GCP_STREAM_STALL_SECONDS
+    total_timeout = total_timeout or GCP_TIMEOUT_SECONDS
+    body, headers = encode_json_body(dict(payload, stream=True))
+    stats = {'ttfb': None, 'seconds': 0.0, 'streamed': True, 'bytes': 0}
+    gcp_rate_limiter.acquire()
+    started = time.perf_counter()
+    last_received = started
+    # なぜ？: 読み込みタイムアウトは「次のデータが届くまでの待ち時間」に効くため、
+    # 全体の上限 (9分) を待たずに、出力が止まった生成を早めに打ち切れます。
+    with get_session().post(
+        config.GCP_FUNCTION_URL,
+        data=body,
+        headers=headers,
+        stream=True,
+        timeout=(GCP_CONNECT_TIMEOUT_SECONDS, stall_timeout),
+    ) as response:
+        response.raise_for_status()
+        if 'application/x-ndjson' not in response.headers.get('Content-Type', ''):
+            # なぜ？: ストリーミング非対応の（古い）Cloud Function は全文をまとめて返すため、そのまま受け取ります。
+            stats['streamed'] = False
+            text = response.text
+            stats['bytes'] = len(response.content)
+            stats['seconds'] = time.perf_counter() - started
+            return text, stats
+
+        parts = []
+        done = False
+        try:
+            for line in response.iter_lines():
+                last_received = time.perf_counter()
+                stats['bytes'] += len(line)
+                if last_received - started > total_timeout:
+                    raise requests.exceptions.Timeout(f"全体の制限時間 ({total_timeout}秒) を超えました。")
+                if not line:
+                    continue
+                event = json.loads(line)
+                if 'delta' in event:
+                    if stats['ttfb'] is None:
+                        stats['ttfb'] = last_received - started
+                    parts.append(event['delta'])
+                elif 'error' in event:
+                    raise GCPStreamError(f"Cloud Function 側で生成に失敗しました: {event['error']}")
+                elif event.get('done'):
+                    done = True
+                    break
+        except requests.exceptions.ConnectionError as e:
+            if time.perf_counter() - last_received >= stall_timeout - 1:
+                raise requests.exceptions.Timeout(f"{stall_timeout}秒間出力が届かなかったため打ち切りました。") from e
+            raise
+        except ValueError as e:
+            raise GCPStreamError(f"ストリーミング応答を解釈できませんでした: {e}") from e
+
+    stats['seconds'] = time.perf_counter() - started
+    if not done:
+        # なぜ？: 終了イベントが無いまま切れた応答は途中までの要約なので、成功扱いにしません。
+        raise GCPStreamError("ストリーミング応答が終了イベントの前に切れました。")
+    return ''.join(parts), stats
+
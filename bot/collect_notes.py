@@ -2,181 +2,214 @@
 # (最終確定版 v13: 書き込みループ詳細ログ + requests + 時間指定 + ...)
 
 import os
-import requests
 from datetime import datetime, timedelta, timezone
 import config
 import sys
-from zoneinfo import ZoneInfo
 import time
 import traceback
+import metrics
+import targets
+from note_store import NoteStore, note_to_row, utc_timestamp
 # import json # 不要
 
-# --- (JST, convert_to_jst は変更なし) ---
-try:
-    JST = ZoneInfo("Asia/Tokyo")
-except Exception:
-    print("エラー: 'zoneinfo' ライブラリ...")
-    sys.exit(1)
-
-def convert_to_jst(utc_str):
-    if not utc_str: return None
-    try:
-        utc_dt = datetime.fromisoformat(utc_str.replace('Z', '+00:00'))
-        jst_dt = utc_dt.astimezone(JST)
-        return jst_dt.strftime('%Y/%m/%d %H:%M:%S')
-    except Exception as e:
-        print(f"  日付変換エラー: {e} (入力: {utc_str})")
-        return None
-
-# --- (リトライ関連の定数も変更なし) ---
-MAX_API_RETRIES = 3
-RETRY_WAIT_SECONDS = 5
+# --- ページング関連の定数 (再試行の設定は clients.py) ---
+PAGE_LIMIT = 100                                                         # 1ページの取得件数 (APIの上限)
+MAX_PAGES_PER_RUN = getattr(config, 'MAX_PAGES_PER_RUN', 1000)           # 万一の無限ループ防止用
+PAGE_INTERVAL_SECONDS = getattr(config, 'PAGE_INTERVAL_SECONDS', 0.2)    # ページ間の待ち時間 (サーバーへの配慮)
+
+# --- 収集カーソル (ストアの meta テーブルに保存するキー) ---
+CURSOR_ID_KEY = 'collect_cursor_id'
+CURSOR_CREATED_AT_KEY = 'collect_cursor_created_at'
+
+def save_collect_cursor(store, notes):
+    """
+    今回取得したノートのうち、最も新しいノートの位置を次回の収集開始位置として保存する
+    （除外したノートやリノートも含めて進めないと、次回また同じノートを取得してしまいます）
+    """
+    if not notes:
+        return
+    latest = max(notes, key=lambda note: note['id'])
+    store.set_meta(CURSOR_ID_KEY, latest['id'])
+    store.set_meta(CURSOR_CREATED_AT_KEY, latest.get('createdAt') or '')
+    print(f"  収集カーソルをノートID {latest['id']} まで進めました。")
+
+def fetch_notes_since(client, cursor_id, since_dt_utc=None, until_created_at=None):
+    """
+    ノートID cursor_id より新しいノートを、古い方から順にページングして全て取得する
+    （cursor_id が無い場合は since_dt_utc 以降。until_created_at より新しいノートは含めません）
+    取得するタイムラインは、今のターゲットの設定 (既定はローカルタイムライン) です。
+    """
+    endpoint = targets.current().timeline_endpoint
+    all_notes_raw = []
+    # (リトライ・ページネーションループ...)
+    # なぜ？: イベント中などは15分で数百件を超えるため、ページ数に上限を設けず、範囲を取り切るまで続けます。
+    stats = {'pages': 0, 'api_seconds': 0.0, 'retries': 0, 'rate_limited': 0, 'bytes': 0}
+    started = time.perf_counter()
+    reached_until = False
+    while stats['pages'] < MAX_PAGES_PER_RUN:
+        payload = {'limit': PAGE_LIMIT}
+        if cursor_id:
+            payload['sinceId'] = cursor_id
+        else:
+            payload['sinceDate'] = int(since_dt_utc.timestamp() * 1000)
+        if stats['pages'] > 0 and PAGE_INTERVAL_SECONDS:
+            time.sleep(PAGE_INTERVAL_SECONDS)
+        bytes_before = stats['bytes']
+        with metrics.span('api_page', requests=1) as page:
+            notes_data = client.api(endpoint, payload, stats=stats)
+            page.add(notes=len(notes_data) if isinstance(notes_data, list) else 0,
+                     bytes=stats['bytes'] - bytes_before)
+
+        if notes_data is None or not isinstance(notes_data, list) or len(notes_data) == 0:
+            if notes_data is None:
+                print("    このページではノートが取得できませんでした。残りは次回の収集で取得します。")
+            break
+        stats['pages'] += 1
+        # なぜ？: ページ内の並び順に依存しないよう、ID (時刻順に並ぶ) で並べ替えてから扱います。
+        notes_data.sort(key=lambda note: note['id'])
+        for note in notes_data:
+            if until_created_at and (note.get('createdAt') or '') > until_created_at:
+                reached_until = True
+                break
+            all_notes_raw.append(note)
+        if reached_until or len(notes_data) < PAGE_LIMIT:
+            break
+        cursor_id = notes_data[-1]['id']
+    else:
+        print(f"    警告: 1回の収集のページ数上限 ({MAX_PAGES_PER_RUN}) に達しました。残りは次回の収集で取得します。")
+
+    elapsed = time.perf_counter() - started
+    avg_latency = stats['api_seconds'] / stats['pages'] if stats['pages'] else 0.0
+    print(f"  API取得: {stats['pages']}ページ / {len(all_notes_raw)}件 / {elapsed:.1f}秒 "
+          f"(平均レイテンシ {avg_latency:.2f}秒/ページ, 再試行 {stats['retries']}回, レート制限 {stats['rate_limited']}回)")
+
+    return all_notes_raw
+
+def is_collectable(note):
+    """
+    ノートが収集対象かどうか（必要な情報があり、除外ユーザーでもリノートでもない）
+    """
+    user_info = note.get('user')
+    user_id = user_info.get('id') if user_info else None
+    created_at = note.get('createdAt')
+    note_id = note.get('id')
+    if not user_id or not created_at or not note_id: return False
+    if user_id == targets.current().exclude_user_id: return False
+    if note.get('renote'): return False
+    return True
 
 def execute_periodic_collection():
+    """
+    全ターゲットのノートを収集する（ターゲットが複数ある場合は同時に収集します）
+    """
+    # なぜ？: ターゲットごとに別のサーバーへ問い合わせるため、1つの遅いサーバーが他の収集を待たせないよう同時に進めます。
+    return targets.run_all(collect_target, concurrent=True)
+
+def collect_target():
+    """
+    今のターゲットのノートを、前回の続きから収集してストアに保存する
+    """
+    target = targets.current()
     print(f"[{datetime.now()}] 定期ノート収集処理を開始します...")
+    metrics.begin('collect')
 
+    store = None
     try:
-        os.makedirs(config.DATA_DIR, exist_ok=True)
+        os.makedirs(target.data_dir, exist_ok=True)
         # mk = Misskey(...) # 不要
 
-        # 1. 時間範囲計算 (変更なし)
+        store = NoteStore(target.note_store_path)
+
+        # 1. 収集範囲の決定
+        # なぜ？: 固定の「30分前〜15分前」だと、cron が遅れたり飛んだりしたときにノートの取りこぼしや重複が起きます。
+        # 前回どこまで取得したか (カーソル) をストアに保存しておき、その続きから取得します。
+        # リアクション数の集計を公平にするため、投稿から15分経っていないノートはまだ取り込みません。
         now_utc = datetime.now(timezone.utc)
-        since_dt_utc = now_utc - timedelta(minutes=30)
         until_dt_utc = now_utc - timedelta(minutes=15)
-        since_date_ms = int(since_dt_utc.timestamp() * 1000)
-        until_date_ms = int(until_dt_utc.timestamp() * 1000)
-        print(f"  収集範囲: {since_dt_utc.strftime('%Y/%m/%d %H:%M:%S')} UTC から {until_dt_utc.strftime('%Y/%m/%d %H:%M:%S')} UTC まで")
-
-        # 2. requests で API 呼び出し (変更なし)
-        print(f"  上記時間範囲のローカルタイムラインを取得します...")
-        all_notes_raw = []
-        current_until_id = None
-        api_url = f"{config.MISSKEY_URL}/api/notes/local-timeline"
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {config.MISSKEY_TOKEN}'
-        }
-        # (リトライ・ページネーションループ...)
-        for page in range(5):
-            notes_data = None
-            payload = {
-                'limit': 100,
-                'sinceDate': since_date_ms,
-                'untilDate': until_date_ms,
-            }
-            if current_until_id:
-                payload['untilId'] = current_until_id
-            for attempt in range(MAX_API_RETRIES):
-                try:
-                    # ...(API呼び出しログ)...
-                    response = requests.post(api_url, headers=headers, json=payload, timeout=30)
-                    response.raise_for_status()
-                    notes_data = response.json()
-                    # ...(API成功ログ)...
-                    break
-                except requests.exceptions.RequestException as api_e:
-                    # ...(APIエラー・リトライログ)...
-                    if attempt < MAX_API_RETRIES - 1:
-                        time.sleep(RETRY_WAIT_SECONDS)
-                    else:
-                        print(f"    最大リトライ回数 ({MAX_API_RETRIES}) に達しました。")
-
-            if notes_data is None or not isinstance(notes_data, list) or len(notes_data) == 0:
-                print("    このページではノートが取得できませんでした。")
-                break
-            all_notes_raw.extend(notes_data)
-            current_until_id = notes_data[-1]['id']
+        until_created_at = utc_timestamp(until_dt_utc)
+        cursor_id = store.get_meta(CURSOR_ID_KEY)
+        since_dt_utc = None
+        if cursor_id:
+            print(f"  収集範囲: 前回の続き (ノートID: {cursor_id}, {store.get_meta(CURSOR_CREATED_AT_KEY)}) から {until_dt_utc.strftime('%Y/%m/%d %H:%M:%S')} UTC まで")
+        else:
+            # なぜ？: 初回はカーソルが無いため、従来どおり30分前から取得を始めます。
+            since_dt_utc = now_utc - timedelta(minutes=30)
+            print(f"  収集範囲 (初回): {since_dt_utc.strftime('%Y/%m/%d %H:%M:%S')} UTC から {until_dt_utc.strftime('%Y/%m/%d %H:%M:%S')} UTC まで")
+
+        # 2. 共通クライアントで API 呼び出し (sinceId で古い方から順にページング)
+        print(f"  上記範囲のタイムライン ({target.timeline_endpoint}) を取得します...")
+        client = target.client()
+        all_notes_raw = fetch_notes_since(client, cursor_id, since_dt_utc, until_created_at)
 
         if not all_notes_raw:
             print(f"[{datetime.now()}] 指定時間範囲に新しいノートはありませんでした。")
             return
 
         print(f"  合計 {len(all_notes_raw)} 件のノートを指定時間範囲から取得しました。")
-        all_notes_raw.reverse()
 
-        # 3. フィルタリング (変更なし)
+        # 3. フィルタリング
         print("  必要な情報を持つノートをフィルタリングします...")
-        valid_notes = []
-        for note in all_notes_raw:
-            user_info = note.get('user')
-            user_id = user_info.get('id') if user_info else None
-            created_at = note.get('createdAt')
-            note_id = note.get('id')
-            if not user_id or not created_at or not note_id: continue
-            if user_id == config.EXCLUDE_USER_ID: continue
-            if note.get('renote'): continue
-            valid_notes.append(note)
+        with metrics.span('filter', notes=len(all_notes_raw)) as filtering:
+            valid_notes = [note for note in all_notes_raw if is_collectable(note)]
+            filtering.add(kept=len(valid_notes))
 
         if not valid_notes:
+            save_collect_cursor(store, all_notes_raw)
             print(f"[{datetime.now()}] フィルタリングの結果、追記するノートはありませんでした。")
             return
 
-        # --- ★★★ ここからが修正箇所 (詳細ログ出力) ★★★ ---
-        # 4. ファイルに追記 (詳細ログ付き)
-        print(f"  {len(valid_notes)} 件のノートのファイル追記処理を開始します...")
-
-        formatted_entries = []
-        processed_count = 0 # 実際に処理したノート数をカウント
-        for i, note in enumerate(valid_notes):
-            note_id_log = note.get('id', 'ID不明') # ログ用ID
-            print(f"\n    処理中ノート {i+1}/{len(valid_notes)} (ID: {note_id_log})") # ★ ループ開始ログ
-            try:
-                # (安全なデータ抽出...)
-                user_info = note.get('user', {})
-                user_name = user_info.get('name', user_info.get('username', '不明なユーザー'))
-                post_time_jst = convert_to_jst(note.get('createdAt'))
-                if not post_time_jst: post_time_jst = "不明な時間"
-                text_value = note.get('text')
-                post_content = text_value.strip() if isinstance(text_value, str) else ''
-                reaction_count = note.get('reactionCount', 0)
-                media_marker = ""
-                files_list = note.get('files', [])
-                if isinstance(files_list, list) and len(files_list) > 0:
-                     media_marker = "\n[メディア付きノート]"
-
-                # (entry 文字列作成...)
-                entry = (
-                    "=========\n"
-                    f"[{user_name}]\n"
-                    f"[{post_time_jst}]\n"
-                    f"[{post_content if post_content else '(本文なし)'}]\n"
-                    f"[リアクション数: {reaction_count}]"
-                    f"{media_marker}\n"
-                    "========="
-                )
-                print(f"      -> entry 作成成功。") # ★ entry 作成成功ログ
-                formatted_entries.append(entry)
-                processed_count += 1 # 処理成功カウント
-
-            except Exception as loop_e:
-                # ループ内で予期せぬエラーが発生した場合
-                print(f"    ★★★ エラー: ノート {note_id_log} の処理中にエラーが発生しました ★★★")
-                print(traceback.format_exc())
-                print(f"    ★★★ このノートをスキップして処理を続行します ★★★")
-                continue # 次のノートへ
-
-        # --- ★★★ 詳細ログ修正ここまで ★★★ ---
-
-        if not formatted_entries:
-             print(f"[{datetime.now()}] entry 文字列を作成できたノートがありませんでした。")
+        # 4. ストアに保存 (詳細ログ付き)
+        # なぜ？: 整形済みテキストではなく構造化したまま保存し、id での重複排除や時刻範囲での読み出しを可能にします。
+        # AIに渡すテキストへの整形は、要約時に note_store.format_note_entry で行います。
+        print(f"  {len(valid_notes)} 件のノートのストア保存処理を開始します...")
+
+        rows = []
+        # なぜ？: 繁忙日は数万件になり、ノートごとのログ出力だけで数秒かかるため、詳細ログは LOG_LEVEL = "debug" の時だけ出します。
+        with metrics.span('format', notes=len(valid_notes)) as formatting:
+            for i, note in enumerate(valid_notes):
+                note_id_log = note.get('id', 'ID不明') # ログ用ID
+                if metrics.DEBUG_LOG:
+                    print(f"\n    処理中ノート {i+1}/{len(valid_notes)} (ID: {note_id_log})") # ★ ループ開始ログ
+                try:
+                    rows.append(note_to_row(note))
+                    if metrics.DEBUG_LOG:
+                        print(f"      -> row 作成成功。") # ★ row 作成成功ログ
+
+                except Exception as loop_e:
+                    # ループ内で予期せぬエラーが発生した場合
+                    formatting.add(errors=1)
+                    print(f"    ★★★ エラー: ノート {note_id_log} の処理中にエラーが発生しました ★★★")
+                    print(traceback.format_exc())
+                    print(f"    ★★★ このノートをスキップして処理を続行します ★★★")
+                    continue # 次のノートへ
+            formatting.add(rows=len(rows))
+
+        if not rows:
+             save_collect_cursor(store, all_notes_raw)
+             print(f"[{datetime.now()}] 保存できるノートがありませんでした。")
              return
 
-        print(f"\n  {len(formatted_entries)} 件の entry 文字列を作成しました。ファイルに書き込みます...") # ★ 書き込み直前ログ
-        output_string = "\n\n".join(formatted_entries)
+        print(f"\n  {len(rows)} 件のノートをストアに書き込みます...") # ★ 書き込み直前ログ
+        # なぜ？: ノートIDが主キーなので、同じノートを再取得しても二重に追加されることはありません。
+        # 保存してからカーソルを進めるため、途中で落ちても次回は同じ位置から取り直すだけで済みます。
+        with metrics.span('write', rows=len(rows)) as writing:
+            inserted = store.upsert_notes(rows)
+            save_collect_cursor(store, all_notes_raw)
+            writing.add(inserted=inserted)
 
-        with open(config.NOTE_DATA_FILE_PATH, 'a', encoding='utf-8') as f:
-            f.seek(0, os.SEEK_END)
-            file_is_empty = f.tell() == 0
-            if not file_is_empty:
-                f.write("\n\n")
-            f.write(output_string)
-
-        # 実際に処理・追記できた件数をログに出力
-        print(f"[{datetime.now()}] {processed_count} 件のノートをファイルに追記しました。") # ★ processed_count を使用
+        # 実際に追加できた件数をログに出力（既に保存済みのノートは更新のみ）
+        print(f"[{datetime.now()}] {inserted} 件のノートをストアに追加しました。(更新: {len(rows) - inserted} 件)")
 
     except Exception as e:
         print(f"[{datetime.now()}] 定期収集中に予期せぬエラーが発生しました:")
         print(traceback.format_exc())
+        # なぜ？: None は成功として扱われるため、失敗を返して python3 -m bot collect を終了コード 1 で終わらせます。
+        return False
+
+    finally:
+        if store is not None:
+            store.close()
+        metrics.flush()
 
 if __name__ == "__main__":
     sys.path.append(os.path.dirname(os.path.abspath(__file__)))
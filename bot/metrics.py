@@ -0,0 +1,225 @@
+# 【ファイル名: bot/metrics.py】
+# (処理の段階ごとの計測 (スパン) を集計し、Prometheus の textfile 形式 または JSON Lines でファイルに書き出す)
+#
+# 使い方:
+#   metrics.begin('collect')                       # スクリプトの開始時
+#   with metrics.span('api_page') as page:         # 計測したい処理を囲む
+#       ...
+#       page.add(notes=100, bytes=51200)           # 件数・バイト数などを足し込む
+#   metrics.flush()                                # 終了時 (常駐プロセスは定期的に)
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import config
+import targets
+
+# 書き出し形式: None (書き出さない) / "prometheus" (node_exporter の textfile collector 用) / "jsonl" (スパン1件を1行で追記)
+METRICS_EXPORT = getattr(config, 'METRICS_EXPORT', None)
+METRICS_DIR = getattr(config, 'METRICS_DIR', os.path.join(config.DATA_DIR, "metrics"))
+# "debug" にすると、ノート1件ごとの処理ログなど詳細なログも表示します
+LOG_LEVEL = getattr(config, 'LOG_LEVEL', 'info')
+DEBUG_LOG = LOG_LEVEL == 'debug'
+
+METRIC_PREFIX = "misskey_summarizer"
+
+
+class _Run:
+    """
+    1回のスクリプト (ジョブ) の実行中に記録したスパンの集計
+    """
+
+    def __init__(self, script, target=None):
+        self.script = script
+        self.target = target
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.totals = {}    # スパン名 -> {'calls', 'seconds', 'max_seconds', 追加の値...}
+        self.events = []    # jsonl で書き出す前のスパン
+
+
+_default_run = _Run(None)
+# なぜ？: 常駐デーモン (scheduler.py) では収集と要約が同時に動くため、実行中のジョブごとに集計を分けます。
+# （asyncio のタスクや asyncio.to_thread のスレッドには、開始時点のコンテキストが引き継がれます）
+_current_run = contextvars.ContextVar('metrics_run', default=_default_run)
+
+
+def bind(function):
+    """
+    スレッドプールで実行する関数に、呼び出し元の計測のコンテキストを引き継がせる
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # なぜ？: 1つのコンテキストは同時に1つのスレッドでしか使えないため、呼び出しごとにコピーします。
+        return context.copy().run(function, *args, **kwargs)
+
+    return run
+
+
+class Span:
+    """
+    計測中のスパン。add() で件数・バイト数などの値を足し込む
+    """
+
+    def __init__(self, name, values):
+        self.name = name
+        self.values = dict(values)
+
+    def add(self, **values):
+        for key, value in values.items():
+            self.values[key] = self.values.get(key, 0) + value
+
+
+def begin(script):
+    """
+    スクリプト (ジョブ) の計測を開始する。以後このコンテキストで記録したスパンは、新しい集計に入ります
+    （今のターゲットごとに別の集計・別のファイルになります）
+    """
+    _current_run.set(_Run(script, targets.current().name))
+
+
+@contextmanager
+def span(name, **values):
+    """
+    囲んだ処理の時間を name のスパンとして記録する。例外で抜けた場合は errors を1増やします
+    """
+    current = Span(name, values)
+    started_at = time.time()
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        current.add(errors=1)
+        raise
+    finally:
+        record(name, time.perf_counter() - started, started_at, **current.values)
+
+
+def record(name, seconds, started_at=None, **values):
+    """
+    計測済みの時間と値を、name のスパンとして記録する
+    """
+    run = _current_run.get()
+    with run.lock:
+        total = run.totals.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+        total['calls'] += 1
+        total['seconds'] += seconds
+        total['max_seconds'] = max(total['max_seconds'], seconds)
+        for key, value in values.items():
+            total[key] = total.get(key, 0) + value
+        if METRICS_EXPORT == 'jsonl':
+            run.events.append({
+                'time': round(started_at or time.time() - seconds, 3),
+                'script': run.script,
+                'target': run.target,
+                'span': name,
+                'seconds': round(seconds, 6),
+                **values,
+            })
+
+
+def snapshot():
+    """
+    これまでの集計のコピー (スパン名 -> 値) を返す
+    """
+    run = _current_run.get()
+    with run.lock:
+        return {name: dict(total) for name, total in run.totals.items()}
+
+
+def flush(report=True):
+    """
+    集計をファイルに書き出す。report が True ならスパンごとの集計をログにも1行ずつ表示します
+    （常駐プロセスでは定期的に呼び、Prometheus 形式は累計を上書き、jsonl は未書き出しの分を追記します）
+    """
+    run = _current_run.get()
+    with run.lock:
+        totals = {name: dict(total) for name, total in run.totals.items()}
+        events = list(run.events)
+        run.events.clear()
+    if report:
+        for name, total in totals.items():
+            extra = ", ".join(f"{key}={_format_value(value)}" for key, value in total.items()
+                              if key not in ('calls', 'seconds', 'max_seconds'))
+            print(f"  計測 [{name}] {total['calls']}回 / 合計 {total['seconds']:.2f}秒 "
+                  f"(最大 {total['max_seconds']:.2f}秒){' ' + extra if extra else ''}")
+    if not METRICS_EXPORT:
+        return
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        if METRICS_EXPORT == 'prometheus':
+            _write_textfile(run, totals)
+        elif METRICS_EXPORT == 'jsonl':
+            _append_events(events)
+        else:
+            print(f"  警告: 不明な METRICS_EXPORT ({METRICS_EXPORT}) のため、計測結果は書き出しません。")
+    except OSError as e:
+        # なぜ？: 計測結果の書き出しに失敗しても、収集や要約そのものは失敗扱いにしません。
+        print(f"  警告: 計測結果の書き出しに失敗しました: {e}")
+
+
+def _format_value(value):
+    return f"{value:.2f}" if isinstance(value, float) else f"{value}"
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_textfile(run, totals):
+    """
+    node_exporter の textfile collector が読む形式で、スクリプトごとに1ファイルへ書き出す
+    """
+    # なぜ？: Prometheus がスクレイプ時に付ける job ラベルとぶつからないよう、スクリプト名は script ラベルにします。
+    script = _label(run.script or 'unknown')
+    target = _label(run.target or targets.DEFAULT_TARGET_NAME)
+    lines = []
+
+    def metric(name, help_text, samples):
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{_label(label)}"'
+                                  for key, label in [('script', script), ('target', target), *labels])
+            lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {value}")
+
+    metric('span_calls', "処理段階ごとの実行回数",
+           [([('span', name)], total['calls']) for name, total in totals.items()])
+    metric('span_seconds', "処理段階ごとの合計時間 (秒)",
+           [([('span', name)], f"{total['seconds']:.6f}") for name, total in totals.items()])
+    metric('span_max_seconds', "処理段階ごとの1回あたりの最大時間 (秒)",
+           [([('span', name)], f"{total['max_seconds']:.6f}") for name, total in totals.items()])
+    metric('span_sum', "処理段階ごとの件数・バイト数などの合計",
+           [([('span', name), ('field', key)], value)
+            for name, total in totals.items()
+            for key, value in total.items() if key not in ('calls', 'seconds', 'max_seconds')])
+    metric('last_run_timestamp_seconds', "最後に実行を開始した時刻 (UNIX時間)", [([], f"{run.started:.0f}")])
+    metric('last_run_seconds', "開始から最後に書き出すまでの時間 (秒)", [([], f"{time.time() - run.started:.3f}")])
+
+    # なぜ？: ターゲットごとに別のファイルにし、同時に動く他のターゲットの集計で上書きしないようにします。
+    # （従来の1ターゲットの構成では、今までと同じファイル名のままです）
+    suffix = "" if run.target in (None, targets.DEFAULT_TARGET_NAME) else f"_{run.target}"
+    path = os.path.join(METRICS_DIR, f"{METRIC_PREFIX}_{run.script or 'unknown'}{suffix}.prom")
+    # なぜ？: 書きかけのファイルを node_exporter が読まないよう、一時ファイルに書いてから置き換えます。
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+
+def _append_events(events):
+    """
+    スパンを1件1行の JSON で、日付ごとのファイルに追記する
+    """
+    if not events:
+        return
+    # なぜ？: 1つのファイルが際限なく大きくならず、古い日の分をファイルごと消せるよう、日付で分けます。
+    path = os.path.join(METRICS_DIR, f"spans_{datetime.now().strftime('%Y%m%d')}.jsonl")
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write("".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events))
@@ -0,0 +1,380 @@
+# 【ファイル名: bot/note_archive.py】
+# (要約済みの古い日のノートを、ストアから gzip 圧縮のアーカイブへ移し、保存期間・容量の上限で古い日から削除する)
+#
+# アーカイブは月ごとのファイル (notes_YYYYMM_*.jsonl.gz) に、1日分ずつ独立した gzip メンバーとして追記します。
+# index.json に「日 -> ファイル・バイト範囲・ノート数」を記録するので、過去の1日分だけを読み出せます。
+# (ファイル全体も普通の gzip として zcat 等で読めます)
+#
+# 使い方:
+#   python3 bot/note_archive.py list               # アーカイブ済みの日の一覧
+#   python3 bot/note_archive.py cat 20240101       # 1日分のノートを JSON Lines で表示
+#   python3 bot/note_archive.py restore 20240101   # 1日分を未要約ノートとしてストアに戻す (再要約用)
+#   python3 bot/note_archive.py rotate             # ストアからの移動と古い日の削除を今すぐ行う
+#   python3 bot/note_archive.py --target NAME list # TARGETS を使う場合は、操作するターゲットを指定します
+
+import argparse
+import glob
+import gzip
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import config
+import metrics
+import targets
+from checkpoint import pipeline_lock
+from note_store import NoteStore
+
+# 要約のたびにアーカイブの整理を行う
+ARCHIVE_ROTATION = getattr(config, 'ARCHIVE_ROTATION', False)
+# 要約済みでもストアに残しておく日数 (直近の日はストアから直接読み直せるように)
+ARCHIVE_STORE_KEEP_DAYS = getattr(config, 'ARCHIVE_STORE_KEEP_DAYS', 3)
+# アーカイブに残す日数と合計サイズ(バイト)の上限 (超えたら古い日から削除)
+ARCHIVE_MAX_DAYS = getattr(config, 'ARCHIVE_MAX_DAYS', 365)
+ARCHIVE_MAX_BYTES = getattr(config, 'ARCHIVE_MAX_BYTES', 2 * 1024 * 1024 * 1024)
+ARCHIVE_COMPRESSLEVEL = getattr(config, 'ARCHIVE_COMPRESSLEVEL', 6)
+
+INDEX_FILE_NAME = "index.json"
+_ARCHIVE_COLUMNS = (
+    "id", "user_id", "user_name", "created_at", "text",
+    "reaction_count", "replies_count", "renote_count", "file_count", "summary_batch",
+)
+_WRITE_BATCH_LINES = 1000
+_COPY_BUFFER_BYTES = 1024 * 1024
+
+
+class _RangeReader(io.RawIOBase):
+    """
+    ファイルの offset から length バイトだけを読めるファイルオブジェクト（1日分の gzip メンバーを読むため）
+    """
+
+    def __init__(self, f, offset, length):
+        self.f = f
+        self.remaining = length
+        f.seek(offset)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        data = self.f.read(size)
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+class NoteArchive:
+    """
+    1日分ずつ gzip メンバーとして追記するアーカイブと、その索引 (index.json)
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        os.makedirs(archive_dir, exist_ok=True)
+        self.index_path = os.path.join(archive_dir, INDEX_FILE_NAME)
+        self.index = self._load_index()
+
+    # --- 索引 ---
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {'version': 1, 'days': {}}
+        with open(self.index_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_index(self):
+        # なぜ？: 書き込み途中で落ちても索引が壊れないよう、一時ファイルに書いてから置き換えます。
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+
+    @property
+    def days(self):
+        return self.index['days']
+
+    def total_bytes(self):
+        return sum(part['length'] for day in self.days.values() for part in day['parts'])
+
+    # --- 書き込み ---
+
+    def _segment_for(self, day):
+        """
+        day を追記する月ごとのファイル名（その月のファイルが索引に無ければ新しく作ります）
+        """
+        month = day[:6]
+        for entry in self.days.values():
+            for part in entry['parts']:
+                if part['file'].startswith(f"notes_{month}_"):
+                    return part['file']
+        return f"notes_{month}_{int(time.time())}.jsonl.gz"
+
+    def append_day(self, day, lines, data_format='jsonl'):
+        """
+        1日分の行 (文字列のイテラブル) を gzip メンバーとして追記し、索引に記録する。戻り値は索引に追加した部分の情報
+        """
+        file_name = self._segment_for(day)
+        path = os.path.join(self.archive_dir, file_name)
+        raw_bytes = 0
+        line_count = 0
+        with open(path, 'ab') as f:
+            offset = f.tell()
+            # なぜ？: 1日分をメモリに溜めず、読み出した行から順に圧縮して書き込みます。
+            # mtime=0 にすると、同じ内容からは同じバイト列ができます。
+            with gzip.GzipFile(filename='', fileobj=f, mode='wb', compresslevel=ARCHIVE_COMPRESSLEVEL, mtime=0) as gz:
+                buffer = []
+                for line in lines:
+                    buffer.append(line)
+                    line_count += 1
+                    if len(buffer) >= _WRITE_BATCH_LINES:
+                        data = "".join(buffer).encode('utf-8')
+                        raw_bytes += len(data)
+                        gz.write(data)
+                        buffer = []
+                if buffer:
+                    data = "".join(buffer).encode('utf-8')
+                    raw_bytes += len(data)
+                    gz.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            length = f.tell() - offset
+
+        part = {'file': file_name, 'offset': offset, 'length': length, 'lines': line_count, 'raw_bytes': raw_bytes}
+        # なぜ？: 同じ日に要約を2回実行した場合など、同じ日のノートが後から増えることがあるため、日ごとに複数の部分を持てます。
+        entry = self.days.setdefault(day, {'format': data_format, 'parts': []})
+        entry['parts'].append(part)
+        self._save_index()
+        return part
+
+    # --- 読み出し ---
+
+    def iter_lines(self, day):
+        """
+        1日分の行を順に返す（その日の gzip メンバーだけを展開します）
+        """
+        for part in self.days[day]['parts']:
+            with open(os.path.join(self.archive_dir, part['file']), 'rb') as f:
+                reader = io.BufferedReader(_RangeReader(f, part['offset'], part['length']))
+                with gzip.GzipFile(fileobj=reader, mode='rb') as gz:
+                    yield from io.TextIOWrapper(gz, encoding='utf-8')
+
+    def iter_rows(self, day):
+        """
+        1日分のノートを、ストアの行と同じ形の辞書で返す (jsonl 形式の日のみ)
+        """
+        if self.days[day]['format'] != 'jsonl':
+            raise ValueError(f"{day} は旧形式のテキストのため、ノートの行としては読み出せません。")
+        # なぜ？: 索引の更新後・ストアからの削除前に落ちると、次回同じノートをもう一度追記するため、ID で重複を除きます。
+        seen = set()
+        for line in self.iter_lines(day):
+            row = json.loads(line)
+            if row['id'] not in seen:
+                seen.add(row['id'])
+                yield row
+
+    # --- 保存期間・容量の上限 ---
+
+    def enforce_retention(self, max_days, max_bytes):
+        """
+        日数・合計サイズの上限を超えた分を古い日から索引から外し、ファイルを詰め直す。戻り値は削除した日のリスト
+        """
+        removed = []
+        total = self.total_bytes()
+        for day in sorted(self.days):
+            if len(self.days) <= max_days and total <= max_bytes:
+                break
+            total -= sum(part['length'] for part in self.days[day]['parts'])
+            del self.days[day]
+            removed.append(day)
+        if removed:
+            self._save_index()
+        self._compact_segments()
+        return removed
+
+    def _compact_segments(self):
+        """
+        索引から参照されていない部分を含むファイルを、参照されている gzip メンバーだけのファイルに作り直す
+        """
+        parts_by_file = {}
+        for entry in self.days.values():
+            for part in entry['parts']:
+                parts_by_file.setdefault(part['file'], []).append(part)
+
+        for path in glob.glob(os.path.join(self.archive_dir, "notes_*.jsonl.gz")):
+            file_name = os.path.basename(path)
+            parts = parts_by_file.get(file_name)
+            if not parts:
+                # なぜ？: 全ての日が削除されたファイルや、追記の途中で落ちて索引に載らなかったファイルです。
+                os.remove(path)
+                continue
+            if sum(part['length'] for part in parts) == os.path.getsize(path):
+                continue
+            # なぜ？: 各日が独立した gzip メンバーなので、展開・再圧縮せずバイト列をコピーするだけで詰め直せます。
+            # 新しい名前で書いて索引を切り替えてから古いファイルを消すため、途中で落ちても索引とファイルは食い違いません。
+            new_name = f"{file_name.split('_')[0]}_{file_name.split('_')[1]}_{int(time.time() * 1000)}.jsonl.gz"
+            new_path = os.path.join(self.archive_dir, new_name)
+            with open(path, 'rb') as source, open(new_path, 'wb') as target:
+                for part in sorted(parts, key=lambda part: part['offset']):
+                    source.seek(part['offset'])
+                    new_offset = target.tell()
+                    remaining = part['length']
+                    while remaining > 0:
+                        data = source.read(min(_COPY_BUFFER_BYTES, remaining))
+                        if not data:
+                            raise IOError(f"{file_name} が索引より短くなっています。")
+                        target.write(data)
+                        remaining -= len(data)
+                    part['file'] = new_name
+                    part['offset'] = new_offset
+                target.flush()
+                os.fsync(target.fileno())
+            self._save_index()
+            os.remove(path)
+
+
+def _note_lines(store, batch):
+    for row in store.iter_notes(batch=batch):
+        yield json.dumps({column: row[column] for column in _ARCHIVE_COLUMNS}, ensure_ascii=False) + "\n"
+
+
+def archive_summarized_batches(store, archive, keep_days=None):
+    """
+    要約済みのノートのうち、新しい keep_days 日分を除いた古い日を、アーカイブへ移してストアから削除する
+    """
+    if keep_days is None:
+        keep_days = ARCHIVE_STORE_KEEP_DAYS
+    batches = store.summary_batches()
+    moved = batches[:-keep_days] if keep_days > 0 else batches
+    for batch, count in moved:
+        with metrics.span('archive', notes=count) as archiving:
+            part = archive.append_day(batch, _note_lines(store, batch))
+            archiving.add(raw_bytes=part['raw_bytes'], bytes=part['length'])
+            # なぜ？: アーカイブへの書き込みと索引の保存が終わってから削除するため、途中で落ちてもノートは失われません。
+            deleted = store.delete_batch(batch)
+        ratio = part['length'] / part['raw_bytes'] if part['raw_bytes'] else 0
+        print(f"  アーカイブ: {batch} の {deleted}件をストアから移しました "
+              f"({part['raw_bytes']:,} -> {part['length']:,}バイト, {ratio:.0%})")
+    return [batch for batch, _ in moved]
+
+
+def import_legacy_backups(archive, note_data_file_path=None):
+    """
+    旧バージョンが残した daily_notes.txt.bak_YYYYMMDD を、テキストのままアーカイブへ移す
+    """
+    note_data_file_path = note_data_file_path or targets.current().legacy_note_data_file_path
+    imported = []
+    for path in sorted(glob.glob(f"{note_data_file_path}.bak_*")):
+        day = path.rsplit(".bak_", 1)[1]
+        if not (len(day) == 8 and day.isdigit()):
+            continue
+        if day in archive.days:
+            print(f"  警告: {day} は既にアーカイブにあるため、'{path}' は移さずに残します。")
+            continue
+        with open(path, encoding='utf-8', errors='replace') as f:
+            part = archive.append_day(day, f, data_format='text')
+        os.remove(path)
+        imported.append(day)
+        print(f"  アーカイブ: 旧形式のバックアップ '{path}' を移しました ({part['raw_bytes']:,} -> {part['length']:,}バイト)")
+    return imported
+
+
+def rotate_archive(store):
+    """
+    今のターゲットのストアの古い要約済みノートと旧形式のバックアップをアーカイブへ移し、保存期間・容量の上限を適用する
+    """
+    target = targets.current()
+    try:
+        archive = NoteArchive(target.archive_dir)
+        if target.legacy_note_data_file_path:
+            # なぜ？: 旧形式のバックアップは複数ターゲットに対応する前のもので、従来の構成にしかありません。
+            import_legacy_backups(archive)
+        archive_summarized_batches(store, archive)
+        removed = archive.enforce_retention(ARCHIVE_MAX_DAYS, ARCHIVE_MAX_BYTES)
+        if removed:
+            print(f"  アーカイブ: 保存期間・容量の上限により {len(removed)}日分を削除しました ({removed[0]}〜{removed[-1]})")
+        print(f"  アーカイブ: {len(archive.days)}日分 / {archive.total_bytes() / 2**20:.1f}MB")
+    except Exception as e:
+        # なぜ？: アーカイブの整理に失敗しても、要約そのものは成功しているため失敗扱いにしません（ノートはストアに残ります）。
+        print(f"  アーカイブの整理中にエラー: {e}")
+
+
+def restore_day(store, archive, day):
+    """
+    アーカイブの1日分を、未要約のノートとしてストアに戻す（次回の要約に含まれます）。戻り値は戻したノートの件数
+    """
+    rows = []
+    restored = 0
+    for row in archive.iter_rows(day):
+        rows.append(row)
+        if len(rows) >= _WRITE_BATCH_LINES:
+            restored += _restore_rows(store, rows)
+            rows = []
+    if rows:
+        restored += _restore_rows(store, rows)
+    return restored
+
+
+def _restore_rows(store, rows):
+    # なぜ？: まだストアに残っている (要約済みの) ノートは upsert では要約済みのままなので、明示的に未要約へ戻します。
+    store.upsert_notes(rows)
+    return store.mark_pending(row['id'] for row in rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="要約済みノートのアーカイブを操作します")
+    parser.add_argument('--target', help="操作するターゲットの name (省略時は最初のターゲット)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="アーカイブ済みの日の一覧")
+    cat = commands.add_parser('cat', help="1日分を表示する")
+    cat.add_argument('day')
+    restore = commands.add_parser('restore', help="1日分を未要約ノートとしてストアに戻す")
+    restore.add_argument('day')
+    commands.add_parser('rotate', help="ストアからの移動と古い日の削除を今すぐ行う")
+    args = parser.parse_args(argv)
+
+    target = targets.find(args.target) if args.target else targets.current()
+    with targets.use(target):
+        return run_command(args, target)
+
+
+def run_command(args, target):
+    archive = NoteArchive(target.archive_dir)
+    if args.command in ('cat', 'restore') and args.day not in archive.days:
+        days = sorted(archive.days)
+        known = f"{days[0]}〜{days[-1]} の {len(days)}日分" if days else "アーカイブは空です"
+        print(f"エラー: {args.day} はアーカイブにありません。({known}。一覧は list で確認できます)")
+        return False
+    if args.command == 'list':
+        for day in sorted(archive.days):
+            entry = archive.days[day]
+            lines = sum(part['lines'] for part in entry['parts'])
+            size = sum(part['length'] for part in entry['parts'])
+            print(f"{day}  {entry['format']:>5}  {lines:>8}行  {size / 1024:>10.1f}KB  {entry['parts'][0]['file']}")
+        print(f"合計: {len(archive.days)}日分 / {archive.total_bytes() / 2**20:.1f}MB")
+    elif args.command == 'cat':
+        for line in archive.iter_lines(args.day):
+            sys.stdout.write(line)
+    elif args.command == 'restore':
+        # なぜ？: 要約処理と同時にストアを書き換えないよう、要約と同じロックを取ります。
+        if archive.days[args.day]['format'] != 'jsonl':
+            print(f"エラー: {args.day} は旧形式のテキストのため、ストアには戻せません。(cat で内容を表示できます)")
+            return False
+        with pipeline_lock(target.pipeline_lock_path), NoteStore(target.note_store_path) as store:
+            restored = restore_day(store, archive, args.day)
+        print(f"[{datetime.now()}] {args.day} の {restored}件を未要約ノートとしてストアに戻しました。")
+    elif args.command == 'rotate':
+        with pipeline_lock(target.pipeline_lock_path), NoteStore(target.note_store_path) as store:
+            rotate_archive(store)
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    main()
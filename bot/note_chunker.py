@@ -0,0 +1,66 @@
+# 【ファイル名: bot/note_chunker.py】
+# (整形したノートを「ノート単位」でチャンクに詰めるチャンカー)
+
+# なぜ？: 各ノートは "=========" の行で始まるため、ノート同士は改行だけでつなぎます。
+ENTRY_JOINER = "\n"
+
+
+def iter_chunks(entries, limit, measure=len, joiner=ENTRY_JOINER):
+    """
+    ノートを分割せずに、1チャンクの大きさが limit 以内になるよう詰めて返すジェネレータ
+    measure にはチャンクの大きさの測り方（既定は文字数）を渡せます。
+    （1件だけで limit を超えるノートは、分割せずに単独のチャンクにします）
+    """
+    return iter_sized_chunks(((entry, measure(entry)) for entry in entries), limit, measure(joiner), joiner)
+
+
+def iter_sized_chunks(sized_entries, limit, joiner_size, joiner=ENTRY_JOINER):
+    """
+    iter_chunks と同じ詰め方で、大きさを計算済みの (ノート, 大きさ) の組からチャンクを作るジェネレータ
+    （ノートごとの大きさをストアにキャッシュしておき、毎回計算し直さずに済ませるために使います）
+    """
+    current = []
+    current_size = 0
+    for entry, entry_size in sized_entries:
+        added_size = entry_size + (joiner_size if current else 0)
+        if current and current_size + added_size > limit:
+            yield joiner.join(current)
+            current = []
+            current_size = 0
+            added_size = entry_size
+        current.append(entry)
+        current_size += added_size
+    if current:
+        yield joiner.join(current)
+
+
+def iter_grouped_chunks(sized_groups, limit, joiner_size, joiner=ENTRY_JOINER):
+    """
+    話題ごとのグループ [(ノート, 大きさ), ...] を、グループを途中で分けずにチャンクへ詰めて返すジェネレータ
+    （小さなグループは同じチャンクにまとめ、1つで limit を超えるグループだけをノート単位で分けます）
+    """
+    current = []
+    current_size = 0
+    for group in sized_groups:
+        group = list(group)
+        if not group:
+            continue
+        group_size = sum(size for _, size in group) + joiner_size * (len(group) - 1)
+        if group_size > limit:
+            if current:
+                yield joiner.join(current)
+                current = []
+                current_size = 0
+            yield from iter_sized_chunks(group, limit, joiner_size, joiner)
+            continue
+        added_size = group_size + (joiner_size if current else 0)
+        if current and current_size + added_size > limit:
+            yield joiner.join(current)
+            current = []
+            current_size = 0
+            added_size = group_size
+        current.extend(entry for entry, _ in group)
+        current_size += added_size
+    if current:
+        yield joiner.join(current)
+
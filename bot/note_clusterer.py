@@ -0,0 +1,121 @@
+# 【ファイル名: bot/note_clusterer.py】
+# (ノートを話題ごとにまとめるローカルのクラスタリング: 文字2-gram のハッシュベクトル + ミニバッチ k-means)
+# (numpy が必要です。scikit-learn 等は使わず、CPU だけで数秒で終わるようにしています)
+
+import math
+import time
+
+import numpy as np
+
+import config
+from note_ranker import extract_terms
+
+# 1つの話題 (クラスタ) に入るおおよそのノート数。クラスタ数は「ノート数 / これ」で決めます
+TOPIC_CLUSTER_SIZE = getattr(config, 'TOPIC_CLUSTER_SIZE', 300)
+TOPIC_MAX_CLUSTERS = getattr(config, 'TOPIC_MAX_CLUSTERS', 200)
+# ハッシュベクトルの次元数 (大きいほど話題の区別が細かくなり、メモリも増えます)
+TOPIC_VECTOR_DIM = getattr(config, 'TOPIC_VECTOR_DIM', 256)
+TOPIC_KMEANS_ITERATIONS = 100
+TOPIC_KMEANS_BATCH_SIZE = 1024
+# なぜ？: 全ノート × 全クラスタの類似度を一度に計算するとメモリを使いすぎるため、この件数ずつ割り当てます。
+_ASSIGN_BLOCK = 8192
+
+
+def note_vectors(rows):
+    """
+    ノートを、文字2-gram の TF-IDF をハッシュで固定次元に畳み込んだ単位ベクトルにする (ノート数 × TOPIC_VECTOR_DIM)
+    """
+    note_count = len(rows)
+    note_index, terms = extract_terms([row['text'] for row in rows])
+    vectors = np.zeros((note_count, TOPIC_VECTOR_DIM), dtype=np.float32)
+    if not len(terms):
+        return vectors
+    # なぜ？: 多くのノートに出てくる並びほど話題の区別に役立たないため、IDF で重みを下げます。
+    note_term = np.unique(note_index * (int(terms.max()) + 1) + terms)
+    document_frequency = np.bincount(note_term % (int(terms.max()) + 1))
+    idf = np.log((note_count + 1.0) / (document_frequency[terms] + 1.0)) + 1.0
+    # なぜ？: ハッシュの衝突で無関係な並び同士が足し合わされても打ち消し合うよう、符号もハッシュで決めます。
+    dims = terms % TOPIC_VECTOR_DIM
+    signs = np.where((terms // TOPIC_VECTOR_DIM) % 2 == 0, 1.0, -1.0)
+    flat = np.bincount(note_index * TOPIC_VECTOR_DIM + dims, weights=signs * idf,
+                       minlength=note_count * TOPIC_VECTOR_DIM)
+    vectors[:] = flat.reshape(note_count, TOPIC_VECTOR_DIM)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def minibatch_kmeans(vectors, cluster_count, seed=0):
+    """
+    コサイン類似度のミニバッチ k-means。中心 (cluster_count × 次元数) を返す
+    """
+    rng = np.random.default_rng(seed)
+    centers = vectors[rng.choice(len(vectors), size=cluster_count, replace=False)].copy()
+    counts = np.zeros(cluster_count, dtype=np.float64)
+    batch_size = min(TOPIC_KMEANS_BATCH_SIZE, len(vectors))
+    for _ in range(TOPIC_KMEANS_ITERATIONS):
+        batch = vectors[rng.choice(len(vectors), size=batch_size, replace=False)]
+        labels = np.argmax(batch @ centers.T, axis=1)
+        # なぜ？: 中心ごとに「これまでに割り当てられた数」に応じて学習率を下げ、少しずつ安定させます。
+        batch_counts = np.bincount(labels, minlength=cluster_count)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, batch)
+        counts += batch_counts
+        updated = batch_counts > 0
+        rate = (batch_counts[updated] / counts[updated])[:, None].astype(np.float32)
+        centers[updated] = (1 - rate) * centers[updated] + rate * (sums[updated] / batch_counts[updated][:, None])
+        norms = np.linalg.norm(centers, axis=1, keepdims=True)
+        np.divide(centers, norms, out=centers, where=norms > 0)
+    return centers
+
+
+def assign_clusters(vectors, centers):
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _ASSIGN_BLOCK):
+        block = vectors[start:start + _ASSIGN_BLOCK]
+        labels[start:start + _ASSIGN_BLOCK] = np.argmax(block @ centers.T, axis=1)
+    return labels
+
+
+def cluster_notes(rows):
+    """
+    ノートごとの話題番号 (クラスタ番号) を返す。本文から話題を判断できないノートは -1
+    """
+    cluster_count = min(TOPIC_MAX_CLUSTERS, math.ceil(len(rows) / TOPIC_CLUSTER_SIZE))
+    labels = np.full(len(rows), -1, dtype=np.int64)
+    if cluster_count < 2:
+        labels[:] = 0
+        return labels
+    vectors = note_vectors(rows)
+    has_text = np.linalg.norm(vectors, axis=1) > 0
+    if has_text.sum() <= cluster_count:
+        labels[has_text] = 0
+        return labels
+    centers = minibatch_kmeans(vectors[has_text], cluster_count)
+    labels[has_text] = assign_clusters(vectors[has_text], centers)
+    return labels
+
+
+def group_by_topic(rows):
+    """
+    ノートを話題ごとのグループに分けて返す。
+    グループは最初の投稿が早い順、グループ内のノートは時刻順に並びます。
+    """
+    if not rows:
+        return []
+    started = time.perf_counter()
+    labels = cluster_notes(rows)
+    # なぜ？: rows は時刻順なので、安定ソートすれば各グループ内の時刻順が保たれます。
+    order = np.argsort(labels, kind='stable')
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    groups = [
+        [rows[i] for i in indices]
+        for indices in np.split(order, starts[1:])
+    ]
+    # なぜ？: 要約の断片を読む順番が1日の流れに近くなるよう、話題が最初に現れた時刻順に並べます。
+    groups.sort(key=lambda group: group[0]['created_at'])
+    sizes = sorted((len(group) for group in groups), reverse=True)
+    print(f"  ノートを話題ごとに分けました: {len(rows)}件 -> {len(groups)}グループ "
+          f"(最大: {sizes[0]}件 / 中央値: {sizes[len(sizes) // 2]}件 / {time.perf_counter() - started:.2f}秒)")
+    return groups
@@ -0,0 +1,134 @@
+# 【ファイル名: bot/note_compactor.py】
+# (要約の前に、ノートを重複除去・連投の結合・短い1行形式への変換で圧縮し、AIへ送る入力を減らす)
+
+import re
+import unicodedata
+from datetime import datetime
+
+import config
+from note_chunker import ENTRY_JOINER
+from note_store import convert_to_jst, format_note_entry
+
+# --- 圧縮の設定 ---
+# 本文 (URL・メンションを除く) がこの文字数未満のノートは、反応が少なければ捨てる
+COMPACT_MIN_TEXT_LENGTH = getattr(config, 'COMPACT_MIN_TEXT_LENGTH', 4)
+# リアクションがこの数以上のノートは、短くても残す
+COMPACT_KEEP_REACTIONS = getattr(config, 'COMPACT_KEEP_REACTIONS', 3)
+# 同じユーザーの連続した投稿を、この分数以内の間隔なら1行にまとめる
+COMPACT_MERGE_MINUTES = getattr(config, 'COMPACT_MERGE_MINUTES', 10)
+
+COMPACT_JOINER = "\n"
+MERGED_POST_SEPARATOR = " / "
+
+_URL = re.compile(r'https?://\S+')
+_MENTION = re.compile(r'@[\w.-]+(?:@[\w.-]+)?')
+_CUSTOM_EMOJI = re.compile(r':[\w+-]+:')
+_REPEATED_CHAR = re.compile(r'(.)\1{2,}')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """
+    重複判定用に本文を正規化する（全角/半角・大文字/小文字・URL・メンション・同じ文字の連続の違いを無視します）
+    """
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = _URL.sub(' ', text)
+    text = _MENTION.sub(' ', text)
+    # なぜ？: 「草ｗｗｗｗ」と「草www」のような、伸ばし方だけ違う投稿を同じものとみなします。
+    text = _REPEATED_CHAR.sub(r'\1\1', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def is_low_signal(row, normalized):
+    """
+    短くて反応も少ない（要約にほとんど寄与しない）ノートかどうか
+    """
+    if row['reaction_count'] >= COMPACT_KEEP_REACTIONS:
+        return False
+    return len(_CUSTOM_EMOJI.sub('', normalized).strip()) < COMPACT_MIN_TEXT_LENGTH
+
+
+def _created_at(row):
+    return datetime.fromisoformat(row['created_at'].replace('Z', '+00:00'))
+
+
+def _format_post(row):
+    text = _WHITESPACE.sub(' ', row['text']).strip() if row['text'] else "(本文なし)"
+    if row['file_count'] > 0:
+        text += " [メディア]"
+    if row['reaction_count'] > 0:
+        text += f" ♥{row['reaction_count']}"
+    return text
+
+
+def format_compact_entry(rows):
+    """
+    同じユーザーの連続した投稿 (1件以上) を「時刻 ユーザー名: 本文 / 本文 ♥リアクション数」の1行にする
+    """
+    post_time = (convert_to_jst(rows[0]['created_at']) or "不明な時間 --:--")[11:16]
+    posts = MERGED_POST_SEPARATOR.join(_format_post(row) for row in rows)
+    return f"{post_time} {rows[0]['user_name']}: {posts}"
+
+
+class NoteCompactor:
+    """
+    時刻順のノートを受け取り、圧縮した1行形式のエントリーを時刻順に返す。
+    処理したノート数や削減できた文字数は stats に集計します。
+    """
+
+    def __init__(self):
+        self.seen = set()
+        self.stats = {
+            'notes': 0, 'entries': 0, 'low_signal': 0, 'duplicates': 0, 'merged': 0,
+            'input_chars': 0, 'output_chars': 0,
+        }
+
+    def iter_entries(self, rows):
+        group = []
+        for row in rows:
+            self.stats['notes'] += 1
+            # なぜ？: 削減量を「従来の ========= 形式で送った場合」と比べてログに出すため、元の大きさも数えます。
+            self.stats['input_chars'] += len(format_note_entry(row)) + len(ENTRY_JOINER)
+            normalized = normalize_text(row['text'] or '')
+            if is_low_signal(row, normalized):
+                self.stats['low_signal'] += 1
+                continue
+            if normalized:
+                # なぜ？: 同じ定型文（挨拶・bot の定期投稿など）は、1日の中で最初の1件だけ残せば話題は分かります。
+                # 後から来た重複は数を前の行に書き足さず捨てるため、前のチャンクの内容は変わりません (逐次要約のため)。
+                key = hash(normalized)
+                if key in self.seen:
+                    self.stats['duplicates'] += 1
+                    continue
+                self.seen.add(key)
+
+            if group and self._continues(group[-1], row):
+                self.stats['merged'] += 1
+                group.append(row)
+                continue
+            if group:
+                yield self._emit(group)
+            group = [row]
+        if group:
+            yield self._emit(group)
+
+    def _continues(self, previous, row):
+        # なぜ？: 同じ人の連投は1つの話題であることが多いので、名前と時刻を繰り返さず1行にまとめます。
+        if previous['user_id'] != row['user_id']:
+            return False
+        return (_created_at(row) - _created_at(previous)).total_seconds() <= COMPACT_MERGE_MINUTES * 60
+
+    def _emit(self, group):
+        entry = format_compact_entry(group)
+        self.stats['entries'] += 1
+        self.stats['output_chars'] += len(entry) + len(COMPACT_JOINER)
+        return entry
+
+    def report(self):
+        stats = self.stats
+        if not stats['notes']:
+            return
+        ratio = stats['output_chars'] / stats['input_chars'] if stats['input_chars'] else 0
+        print(f"  ノートの圧縮: {stats['notes']}件 -> {stats['entries']}行 "
+              f"(短い・反応なし: {stats['low_signal']}件 / 重複: {stats['duplicates']}件 / 連投の結合: {stats['merged']}件)")
+        print(f"  入力の大きさ: {stats['input_chars']:,}文字 -> {stats['output_chars']:,}文字 ({ratio:.0%})")
@@ -0,0 +1,165 @@
+# 【ファイル名: bot/note_ranker.py】
+# (ノートが多すぎる日に、注目度の高いノートだけを選んで要約に回すための採点・抽出)
+# (numpy が必要です。10万件以上のノートでも数秒で終わるよう、ノートごとのループを避けてベクトル化しています)
+
+import re
+import time
+import unicodedata
+from datetime import datetime
+
+import numpy as np
+
+import config
+
+# 抽出の方式: "top" (注目度の高い順) または "diverse" (話題ごとの注目度の合計に比例して選び、同じ話題ばかりにならないようにする)
+# なぜ？: 既定は "top" です。その日いちばんの出来事 (急上昇した話題) は、要約から外れてはいけないためです。
+SALIENCE_SAMPLING = getattr(config, 'SALIENCE_SAMPLING', 'top')
+# 各特徴の重み (それぞれ 0〜1 に正規化してから掛けます)
+SALIENCE_WEIGHTS = getattr(config, 'SALIENCE_WEIGHTS', {
+    'reactions': 3.0,
+    'replies': 1.5,
+    'renotes': 1.5,
+    'length': 0.5,
+    'burst': 2.0,
+})
+# キーワードの「急上昇」を測る時間の区切り (分)
+SALIENCE_BUCKET_MINUTES = getattr(config, 'SALIENCE_BUCKET_MINUTES', 60)
+
+# なぜ？: 日本語は単語の区切りが無いため、形態素解析の代わりに「2文字の並び」をハッシュしてキーワードとして扱います。
+TERM_HASH_BITS = 18
+_TERM_SPACE = 1 << TERM_HASH_BITS
+_URL = re.compile(r'https?://[^\s\0]+')
+
+
+def extract_terms(texts):
+    """
+    テキストのリストから、全ノートの文字2-gram (ハッシュ値) をまとめて取り出す。
+    戻り値は (各2-gramが属するノートの番号, 2-gramのハッシュ値) の配列の組
+    """
+    # なぜ？: 全ノートを区切り文字 (\0) でつないだ1本の文字列にして、小文字化・URL除去とコードポイントへの変換、
+    # 2-gram の計算を一度に行います。（NFKC だけは、正規化済みのノートを素早く読み飛ばせるようノートごとに行います）
+    joined = "\0".join(unicodedata.normalize('NFKC', (text or '').replace("\0", "")) for text in texts)
+    joined = _URL.sub(' ', joined.lower())
+    code_points = np.frombuffer(joined.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if len(code_points) < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    note_of_char = np.cumsum(code_points == 0)
+    left = code_points[:-1]
+    right = code_points[1:]
+    # なぜ？: ノートの区切り (\0) や空白をまたぐ並びは、キーワードとして意味が無いので除きます。
+    valid = (left != 0) & (right != 0) & (left != 32) & (right != 32)
+    terms = ((left * np.uint64(1000003) + right) % np.uint64(_TERM_SPACE)).astype(np.int64)
+    return note_of_char[:-1][valid], terms[valid]
+
+
+def time_buckets(rows):
+    """
+    各ノートが、1日の中の何番目の時間帯 (SALIENCE_BUCKET_MINUTES 分ごと) に投稿されたか
+    """
+    timestamps = np.array(
+        [datetime.fromisoformat(row['created_at'].replace('Z', '+00:00')).timestamp() for row in rows],
+        dtype=np.float64,
+    )
+    return ((timestamps - timestamps.min()) // (SALIENCE_BUCKET_MINUTES * 60)).astype(np.int64)
+
+
+def term_weights(note_index, terms, buckets):
+    """
+    2-gram の出現ごとに「その時間帯での急上昇度 × 珍しさ (IDF)」を計算する
+    """
+    bucket_of_term = buckets[note_index]
+    bucket_count = int(buckets.max()) + 1
+    # なぜ？: ソートせず、(2-gram, 時間帯) の組ごとの出現数を bincount の1回で数えます。
+    # (ハッシュの種類を 2^18 に抑えているので、1日を24区切りにしても表は数十MBに収まります)
+    pair = terms * bucket_count + bucket_of_term
+    observed = np.bincount(pair, minlength=_TERM_SPACE * bucket_count)[pair].astype(np.float64)
+    term_total = np.bincount(terms, minlength=_TERM_SPACE).astype(np.float64)
+    bucket_share = np.bincount(bucket_of_term, minlength=bucket_count) / max(len(terms), 1)
+    expected = term_total[terms] * bucket_share[bucket_of_term]
+    # なぜ？: 1日を通して均等に出る言葉 (挨拶など) ではなく、特定の時間帯に集中して出た言葉を「話題」とみなします。
+    burst = np.maximum(np.log((observed + 1.0) / (expected + 1.0)), 0.0)
+    # なぜ？: どのノートにも出てくるありふれた並びの重みを下げます（文書頻度の代わりに、全体での出現数で近似します）。
+    idf = np.log((len(terms) + 1.0) / (term_total[terms] + 1.0))
+    return burst * idf
+
+
+def _normalized(values):
+    values = np.log1p(np.asarray(values, dtype=np.float64))
+    peak = values.max() if len(values) else 0.0
+    return values / peak if peak > 0 else values
+
+
+def score_notes(rows):
+    """
+    ノートごとの注目度と、各ノートの代表的なキーワード (話題の目印) を計算する。
+    戻り値は (注目度の配列, 話題番号の配列)
+    """
+    note_count = len(rows)
+    note_index, terms = extract_terms([row['text'] for row in rows])
+    weights = term_weights(note_index, terms, time_buckets(rows)) if len(terms) else np.zeros(0)
+
+    term_count = np.bincount(note_index, minlength=note_count)
+    burst = np.bincount(note_index, weights=weights, minlength=note_count) / np.maximum(term_count, 1)
+    peak_burst = burst.max() if note_count else 0.0
+
+    features = {
+        'reactions': _normalized([row['reaction_count'] for row in rows]),
+        'replies': _normalized([row['replies_count'] for row in rows]),
+        'renotes': _normalized([row['renote_count'] for row in rows]),
+        'length': _normalized([len(row['text'] or '') for row in rows]),
+        'burst': burst / peak_burst if peak_burst > 0 else burst,
+    }
+    scores = np.zeros(note_count, dtype=np.float64)
+    for name, values in features.items():
+        scores += SALIENCE_WEIGHTS.get(name, 0.0) * values
+
+    # なぜ？: 各ノートで最も「急上昇度 × 珍しさ」が高い2-gramを、そのノートの話題の目印にします。
+    # キーワードの無いノートは、それぞれ単独の話題として扱います。
+    topics = _TERM_SPACE + np.arange(note_count, dtype=np.int64)
+    if len(terms):
+        # なぜ？: note_index は先頭から順に並んでいるため、ソートせずにノートごとの最大値の位置を求められます。
+        starts = np.flatnonzero(np.r_[True, note_index[1:] != note_index[:-1]])
+        peak = np.maximum.reduceat(weights, starts)
+        note_ids = note_index[starts]
+        is_peak = weights == np.repeat(peak, np.diff(np.r_[starts, len(weights)]))
+        peak_positions = np.flatnonzero(is_peak)
+        first = np.r_[True, note_index[peak_positions][1:] != note_index[peak_positions][:-1]]
+        topics[note_ids] = terms[peak_positions[first]]
+    return scores, topics
+
+
+def diverse_order(scores, topics):
+    """
+    話題ごとに注目度の高い順に並べ、各話題から「その話題の注目度の合計」に比例した件数ずつ選ぶ並び順を返す
+    """
+    by_topic = np.lexsort((-scores, topics))
+    sorted_topics = topics[by_topic]
+    starts = np.flatnonzero(np.r_[True, sorted_topics[1:] != sorted_topics[:-1]])
+    group_sizes = np.diff(np.r_[starts, len(by_topic)])
+    rank_in_topic = np.arange(len(by_topic)) - np.repeat(starts, group_sizes)
+    # なぜ？: 各話題から1件ずつ順番に選ぶと、ノートの多い話題 (その日の大きな出来事) ほど選ばれる割合が下がります。
+    # 話題の注目度の合計 (ノート数と反応の多さ) で割った順位で並べると、各話題の件数がその合計に比例します (ドント方式)。
+    topic_weight = np.add.reduceat(scores[by_topic], starts) + 1e-9
+    priority = (rank_in_topic + 1) / np.repeat(topic_weight, group_sizes)
+    return by_topic[np.lexsort((-scores[by_topic], priority))]
+
+
+def select_salient_rows(rows, max_notes, sampling=None, topics=None):
+    """
+    ノートを注目度で採点し、max_notes 件だけを（元の時刻順のまま）返す。
+    topics を渡すと、diverse の抽出でその話題番号を使います（例: クラスタリングの結果）。
+    """
+    sampling = sampling or SALIENCE_SAMPLING
+    if len(rows) <= max_notes:
+        return rows
+    started = time.perf_counter()
+    scores, keyword_topics = score_notes(rows)
+    if sampling == 'diverse':
+        order = diverse_order(scores, keyword_topics if topics is None else np.asarray(topics, dtype=np.int64))
+    else:
+        order = np.argsort(-scores, kind='stable')
+    # なぜ？: 要約では時刻の流れも大事なので、選んだノートは元の時刻順に戻してから渡します。
+    selected = np.sort(order[:max_notes])
+    print(f"  注目度でノートを絞り込みました: {len(rows)}件 -> {len(selected)}件 "
+          f"(方式: {sampling} / {time.perf_counter() - started:.2f}秒)")
+    return [rows[i] for i in selected]
@@ -0,0 +1,341 @@
+# 【ファイル名: bot/note_store.py】
+# (収集したノートを構造化して保存するローカルストア: SQLite)
+
+import hashlib
+import os
+import re
+import sqlite3
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+JST = ZoneInfo("Asia/Tokyo")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    id              TEXT PRIMARY KEY,
+    user_id         TEXT NOT NULL,
+    user_name       TEXT NOT NULL,
+    created_at      TEXT NOT NULL,
+    text            TEXT NOT NULL DEFAULT '',
+    reaction_count  INTEGER NOT NULL DEFAULT 0,
+    replies_count   INTEGER NOT NULL DEFAULT 0,
+    renote_count    INTEGER NOT NULL DEFAULT 0,
+    file_count      INTEGER NOT NULL DEFAULT 0,
+    summary_batch   TEXT,
+    token_count     INTEGER
+);
+CREATE INDEX IF NOT EXISTS notes_created_at ON notes (created_at, id);
+CREATE INDEX IF NOT EXISTS notes_summary_batch ON notes (summary_batch, created_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_COLUMNS = (
+    "id", "user_id", "user_name", "created_at", "text",
+    "reaction_count", "replies_count", "renote_count", "file_count", "summary_batch", "token_count",
+)
+
+# なぜ？: 同じノートを再取得した場合は、後から変わりうる値（リアクション数など）だけを最新に更新します。
+_UPSERT = """
+INSERT INTO notes (id, user_id, user_name, created_at, text,
+                   reaction_count, replies_count, renote_count, file_count)
+VALUES (:id, :user_id, :user_name, :created_at, :text,
+        :reaction_count, :replies_count, :renote_count, :file_count)
+ON CONFLICT(id) DO UPDATE SET
+    user_name = excluded.user_name,
+    text = excluded.text,
+    reaction_count = excluded.reaction_count,
+    replies_count = excluded.replies_count,
+    renote_count = excluded.renote_count,
+    file_count = excluded.file_count,
+    token_count = NULL
+"""
+
+# 1回の IN (...) に渡す ID の数 (SQLite の変数の上限 999 より小さく)
+_ID_BATCH_SIZE = 500
+
+
+def utc_timestamp(dt=None):
+    """
+    Misskey の createdAt と同じ形式 (例: 2024-01-01T00:00:00.000Z) の文字列を作る
+    （この形式は文字列のまま比較しても時刻順になります）
+    """
+    if dt is None:
+        dt = datetime.now(timezone.utc)
+    dt = dt.astimezone(timezone.utc)
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + f"{dt.microsecond // 1000:03d}Z"
+
+
+def convert_to_jst(utc_str):
+    if not utc_str: return None
+    try:
+        utc_dt = datetime.fromisoformat(utc_str.replace('Z', '+00:00'))
+        jst_dt = utc_dt.astimezone(JST)
+        return jst_dt.strftime('%Y/%m/%d %H:%M:%S')
+    except Exception as e:
+        print(f"  日付変換エラー: {e} (入力: {utc_str})")
+        return None
+
+
+def note_to_row(note):
+    """
+    Misskey API のノート（辞書）を、ストアに保存する行に変換する
+    """
+    user_info = note.get('user') or {}
+    text_value = note.get('text')
+    files_list = note.get('files')
+    return {
+        'id': note['id'],
+        'user_id': user_info['id'],
+        'user_name': user_info.get('name') or user_info.get('username') or '不明なユーザー',
+        'created_at': note['createdAt'],
+        'text': text_value.strip() if isinstance(text_value, str) else '',
+        'reaction_count': note.get('reactionCount') or 0,
+        'replies_count': note.get('repliesCount') or 0,
+        'renote_count': note.get('renoteCount') or 0,
+        'file_count': len(files_list) if isinstance(files_list, list) else 0,
+    }
+
+
+def format_note_entry(row):
+    """
+    ストアの1行を、AIに渡すテキストに整形する（"=========" の行から次のノートの "=========" の前までが1件です）
+    """
+    post_time_jst = convert_to_jst(row['created_at']) or "不明な時間"
+    media_marker = "\n[メディア付きノート]" if row['file_count'] > 0 else ""
+    # なぜ？: 以前の「閉じの ========= と空行」は開きの区切りと同じ役目で、1件あたり約11文字を使っていました。
+    # 省いた分だけ1チャンクに多くのノートが入るため、ノート単位で詰めてもチャンク数は固定幅で切っていた頃以下になります。
+    return (
+        "=========\n"
+        f"[{row['user_name']}]\n"
+        f"[{post_time_jst}]\n"
+        f"[{row['text'] if row['text'] else '(本文なし)'}]\n"
+        f"[リアクション数: {row['reaction_count']}]"
+        f"{media_marker}"
+    )
+
+
+# 旧バージョンの daily_notes.txt に追記されていた1ノート分 (閉じの "=========" があり、空行で区切られています)
+_LEGACY_ENTRY = re.compile(
+    r"=========\n\[(?P<user_name>[^\n]*)\]\n\[(?P<created_at>[^\n]*)\]\n\[(?P<text>.*?)\]\n"
+    r"\[リアクション数: (?P<reaction_count>\d+)\](?P<media>\n\[メディア付きノート\])?\n=========",
+    re.DOTALL,
+)
+
+
+def parse_legacy_note_file(text, fallback_created_at):
+    """
+    旧バージョンの daily_notes.txt の内容を、ストアに保存する行のリストに変換する
+    （ノートIDやユーザーIDは残っていないため、内容から作った値を使います）
+    """
+    rows = []
+    for number, match in enumerate(_LEGACY_ENTRY.finditer(text)):
+        try:
+            created_at = utc_timestamp(datetime.strptime(match['created_at'], '%Y/%m/%d %H:%M:%S').replace(tzinfo=JST))
+        except ValueError:
+            created_at = fallback_created_at
+        # なぜ？: 取り込みが途中で失敗して次回やり直しても重複しないよう、ファイル内の位置と内容から決まる ID にします。
+        digest = hashlib.sha1(f"{number}\n{match[0]}".encode('utf-8')).hexdigest()[:16]
+        text_value = match['text']
+        rows.append({
+            'id': f"legacy_{digest}",
+            'user_id': f"legacy:{match['user_name']}",
+            'user_name': match['user_name'],
+            'created_at': created_at,
+            'text': '' if text_value == '(本文なし)' else text_value,
+            'reaction_count': int(match['reaction_count']),
+            'replies_count': 0,
+            'renote_count': 0,
+            'file_count': 1 if match['media'] else 0,
+        })
+    return rows
+
+
+def import_legacy_note_file(store, path):
+    """
+    旧バージョンの daily_notes.txt (まだ要約していないノート) を未要約のノートとしてストアに取り込み、
+    取り込んだファイルは path + ".imported" に名前を変える。戻り値は取り込んだノートの件数 (ファイルが無ければ None)
+    """
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    fallback_created_at = utc_timestamp(datetime.fromtimestamp(os.path.getmtime(path), timezone.utc))
+    rows = parse_legacy_note_file(text, fallback_created_at)
+    if rows:
+        store.upsert_notes(rows)
+    # なぜ？: 保存してから名前を変えるため、途中で落ちても次回もう一度取り込むだけで済みます (ID が同じなので重複しません)。
+    os.replace(path, path + ".imported")
+    return len(rows)
+
+
+class NoteStore:
+    """
+    ノートを id で一意に保存し、時刻順に読み出せる SQLite ストア
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # なぜ？: ストリーミング収集では補完処理を別スレッドで行うため、スレッドをまたいだ利用を許可します。
+        # （同時に使うことはなく、利用は常に1スレッドずつです）
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        # なぜ？: WAL モードにすると、収集（書き込み）中でも要約（読み出し）がブロックされません。
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """
+        古いバージョンで作ったストアに、後から追加した列を足す
+        """
+        columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(notes)")}
+        if 'token_count' not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE notes ADD COLUMN token_count INTEGER")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def upsert_notes(self, rows):
+        """
+        ノートを保存する。同じ id のノートは重複させずに更新します。
+        戻り値は、新しく追加されたノートの件数
+        """
+        # なぜ？: 各行を1回だけ書き込むよう、新規の件数は書き込む前に既存の ID を数えて求めます（読み出しは索引だけで済みます）。
+        ids = list({row['id'] for row in rows})
+        with self.conn:
+            existing = 0
+            for start in range(0, len(ids), _ID_BATCH_SIZE):
+                batch = ids[start:start + _ID_BATCH_SIZE]
+                existing += self.conn.execute(
+                    f"SELECT COUNT(*) FROM notes WHERE id IN ({', '.join('?' * len(batch))})", batch
+                ).fetchone()[0]
+            self.conn.executemany(_UPSERT, rows)
+        return len(ids) - existing
+
+    def iter_notes(self, since=None, until=None, pending_only=False, batch=None, max_rowid=None, fetch_size=1000):
+        """
+        ノートを時刻順に1件ずつ返すジェネレータ（全件をメモリに載せずに読み出します）
+        since < created_at <= until の範囲と、max_rowid までに保存されたノートに絞り込めます。
+        """
+        where, params = self._where(since, until, pending_only, batch, max_rowid)
+        cursor = self.conn.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM notes {where} ORDER BY created_at, id", params
+        )
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+
+    def count_notes(self, since=None, until=None, pending_only=False, batch=None, max_rowid=None):
+        """
+        iter_notes と同じ条件に当てはまるノートの件数
+        """
+        where, params = self._where(since, until, pending_only, batch, max_rowid)
+        return self.conn.execute(f"SELECT COUNT(*) FROM notes {where}", params).fetchone()[0]
+
+    @staticmethod
+    def _where(since, until, pending_only, batch, max_rowid=None):
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append("created_at > ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("created_at <= ?")
+            params.append(until)
+        if pending_only:
+            conditions.append("summary_batch IS NULL")
+        if batch is not None:
+            conditions.append("summary_batch = ?")
+            params.append(batch)
+        if max_rowid is not None:
+            conditions.append("rowid <= ?")
+            params.append(max_rowid)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return where, params
+
+    def max_rowid(self):
+        """
+        今までに保存されたノートの rowid の最大値（この後に追加されるノートは、これより大きい rowid になります）
+        """
+        return self.conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM notes").fetchone()[0]
+
+    def mark_summarized(self, batch, until, max_rowid=None):
+        """
+        until 以前の未要約ノート (max_rowid を指定した場合は、それまでに保存されたものだけ) を、要約済み（batch 名付き）にする
+        """
+        where, params = self._where(None, until, True, None, max_rowid)
+        with self.conn:
+            cursor = self.conn.execute(f"UPDATE notes SET summary_batch = ? {where}", [batch, *params])
+        return cursor.rowcount
+
+    def mark_pending(self, ids):
+        """
+        ids のノートを未要約に戻す。戻り値は、ストアにあって未要約にしたノートの件数
+        """
+        ids = list(ids)
+        marked = 0
+        with self.conn:
+            for start in range(0, len(ids), _ID_BATCH_SIZE):
+                batch = ids[start:start + _ID_BATCH_SIZE]
+                marked += self.conn.execute(
+                    f"UPDATE notes SET summary_batch = NULL WHERE id IN ({', '.join('?' * len(batch))})", batch
+                ).rowcount
+        return marked
+
+    def summary_batches(self):
+        """
+        要約済みノートの batch 名と件数の一覧 [(batch, 件数), ...] (batch 名の順)
+        """
+        return [
+            (row['summary_batch'], row['notes'])
+            for row in self.conn.execute(
+                "SELECT summary_batch, COUNT(*) AS notes FROM notes"
+                " WHERE summary_batch IS NOT NULL GROUP BY summary_batch ORDER BY summary_batch"
+            )
+        ]
+
+    def delete_batch(self, batch):
+        """
+        batch 名の要約済みノートをストアから削除する（アーカイブへ移した後に使います）
+        """
+        with self.conn:
+            cursor = self.conn.execute("DELETE FROM notes WHERE summary_batch = ?", (batch,))
+        return cursor.rowcount
+
+    def set_token_counts(self, counts):
+        """
+        ノートごとのトークン数の見積もり [(ノートID, トークン数), ...] を保存する
+        （ノートの内容が更新されると、見積もりは消えて次回に作り直されます）
+        """
+        with self.conn:
+            self.conn.executemany("UPDATE notes SET token_count = ? WHERE id = ?",
+                                  [(tokens, note_id) for note_id, tokens in counts])
+
+    def reset_token_counts(self):
+        with self.conn:
+            self.conn.execute("UPDATE notes SET token_count = NULL WHERE token_count IS NOT NULL")
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else default
+
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
@@ -1,8 +1,9 @@
 
 import os
-from misskey import Misskey
 from datetime import datetime, timedelta
-import config # config.py から秘密情報を読み込む
+import metrics
+import targets
+from report_fitter import REPORT_MAX_CHARS, plan_post
 import sys
 
 def save_last_post_id(note_id):
@@ -10,11 +11,12 @@ def save_last_post_id(note_id):
     投稿したNote IDを、夜のリノート用にファイルに保存する
     """
     print(f"  リノート用: Note ID ({note_id}) をファイルに保存します...")
+    last_post_id_file_path = targets.current().last_post_id_file_path
     try:
-        if os.path.exists(config.LAST_POST_ID_FILE_PATH):
-            os.remove(config.LAST_POST_ID_FILE_PATH)
+        if os.path.exists(last_post_id_file_path):
+            os.remove(last_post_id_file_path)
             
-        with open(config.LAST_POST_ID_FILE_PATH, 'w', encoding='utf-8') as f:
+        with open(last_post_id_file_path, 'w', encoding='utf-8') as f:
             f.write(str(note_id))
         print(f"  Note IDの保存に成功しました。")
         
@@ -26,31 +28,61 @@ def cleanup_summary_file():
     投稿が完了した後、使用済みの要約ファイルを削除する
     """
     print(f"  クリーンアップ: 要約ファイルを削除します...")
+    summary_data_file_path = targets.current().summary_data_file_path
     try:
-        if os.path.exists(config.SUMMARY_DATA_FILE_PATH):
-            os.remove(config.SUMMARY_DATA_FILE_PATH)
-            print(f"  '{config.SUMMARY_DATA_FILE_PATH}' を削除しました。")
+        if os.path.exists(summary_data_file_path):
+            os.remove(summary_data_file_path)
+            print(f"  '{summary_data_file_path}' を削除しました。")
     except Exception as e:
         print(f"  要約ファイルのクリーンアップ中にエラー: {e}")
 
+def post_replies(mk, note_id, texts, cw_title):
+    """
+    分けた要約の続きを、直前のノートへのリプライとして順に投稿する
+    """
+    total = len(texts) + 1
+    reply_id = note_id
+    for number, text in enumerate(texts, start=2):
+        try:
+            response = mk.notes_create(
+                text=text,
+                visibility='public',
+                cw=f"{cw_title} ({number}/{total})",
+                reply_id=reply_id
+            )
+            reply_id = response['createdNote']['id']
+            print(f"  続き ({number}/{total}) を投稿しました。 (Note ID: {reply_id})")
+        except Exception as e:
+            # なぜ？: 1件目は投稿済みのため、続きに失敗しても投稿自体は成功として扱います（リノートは1件目を対象にします）。
+            print(f"  警告: 続き ({number}/{total}) の投稿に失敗しました: {e}")
+            return
+
 def execute_post():
     """
-    要約ファイル読み込み、MisskeyにCWでローカル投稿するメイン関数
+    全ターゲットについて、要約をそれぞれのアカウントで投稿する
+    """
+    return targets.run_all(post_target, concurrent=True)
+
+def post_target():
+    """
+    今のターゲットの要約ファイル読み込み、MisskeyにCWでローカル投稿するメイン関数
     """
+    target = targets.current()
     print("==============================================")
     print(f"Misskey要約ボット【投稿バッチ】開始: {datetime.now()}")
     print("==============================================")
     
     post_success = False
     new_note_id = None
+    metrics.begin('post')
     
     try:
         # 1. 要約ファイルを読み込む
-        if not os.path.exists(config.SUMMARY_DATA_FILE_PATH):
-            print(f"  エラー: 要約ファイル '{config.SUMMARY_DATA_FILE_PATH}' が見つかりません。")
+        if not os.path.exists(target.summary_data_file_path):
+            print(f"  エラー: 要約ファイル '{target.summary_data_file_path}' が見つかりません。")
             return False
 
-        with open(config.SUMMARY_DATA_FILE_PATH, 'r', encoding='utf-8') as f:
+        with open(target.summary_data_file_path, 'r', encoding='utf-8') as f:
             summary_text = f.read()
 
         if not summary_text or not summary_text.strip():
@@ -60,28 +92,33 @@ def execute_post():
         print("  要約ファイルの読み込みに成功しました。")
 
         # 2. Misskeyに投稿する
-        mk = Misskey(config.MISSKEY_URL, i=config.MISSKEY_TOKEN)
+        mk = target.client()
         
         yesterday = datetime.now() - timedelta(days=1)
         date_str = yesterday.strftime('%Y/%m/%d')
         
-        post_text = f"昨日のタイムライン ({date_str}) のまとめです。\n\n{summary_text}"
         cw_title = "$[tada.speed=0s :sushiski_news_sokuhou:]"
 
-        if len(post_text) > 2900: 
-             print(f"  エラー: 生成された投稿が長すぎます ({len(post_text)}文字)。投稿を中止しました。")
-             return False
+        # なぜ？: 要約が上限 (REPORT_MAX_CHARS) を超えていても投稿を中止せず、縮める・分けるなどして投稿します。
+        # (通常は要約の時点で収めてあるため、ここでは手で編集された要約ファイルなどへの備えです)
+        post_texts = plan_post(summary_text, date_str)
+        post_text = post_texts[0]
+        if len(post_texts) > 1:
+            print(f"  要約が長いため、{len(post_texts)}件のノートに分けてスレッドで投稿します。")
+        elif not post_text.endswith(summary_text):
+            print(f"  要約が長いため、{REPORT_MAX_CHARS}文字に収まるよう縮めて投稿します。")
 
         print("  Misskeyに要約をCW（LTL/Public）投稿します...")
         
-        created_note_response = mk.notes_create(
-            text=post_text,
-            visibility='public',
-            cw=cw_title
-        )
-        
-        
-        new_note_id = created_note_response['createdNote']['id']
+        with metrics.span('post', notes=len(post_texts), chars=sum(len(text) for text in post_texts),
+                          bytes=sum(len(text.encode('utf-8')) for text in post_texts)):
+            created_note_response = mk.notes_create(
+                text=post_text,
+                visibility='public',
+                cw=cw_title
+            )
+            new_note_id = created_note_response['createdNote']['id']
+            post_replies(mk, new_note_id, post_texts[1:], cw_title)
         
         
         print(f"[{datetime.now()}] 投稿に成功しました！ (Note ID: {new_note_id})")
@@ -100,6 +137,7 @@ def execute_post():
             print(f"[{datetime.now()}] 投稿処理がすべて完了しました。")
         else:
             print(f"[{datetime.now()}] 投稿処理は失敗しました。")
+        metrics.flush()
         
         print("==============================================")
 
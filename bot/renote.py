@@ -3,9 +3,8 @@
 # (朝8時に投稿したノートを自己リノートする)
 
 import os
-from misskey import Misskey
 from datetime import datetime
-import config # config.py から秘密情報を読み込む
+import targets
 import sys
 
 def cleanup_id_file():
@@ -13,17 +12,25 @@ def cleanup_id_file():
     リノートが完了した後、使用済みのIDファイルを削除する
     """
     print(f"  クリーンアップ: Note ID ファイルを削除します...")
+    last_post_id_file_path = targets.current().last_post_id_file_path
     try:
-        if os.path.exists(config.LAST_POST_ID_FILE_PATH):
-            os.remove(config.LAST_POST_ID_FILE_PATH)
-            print(f"  '{config.LAST_POST_ID_FILE_PATH}' を削除しました。")
+        if os.path.exists(last_post_id_file_path):
+            os.remove(last_post_id_file_path)
+            print(f"  '{last_post_id_file_path}' を削除しました。")
     except Exception as e:
         print(f"  Note ID ファイルのクリーンアップ中にエラー: {e}")
 
 def execute_renote():
     """
-    IDファイルを読み込み、Misskeyにリノートするメイン関数
+    全ターゲットについて、朝の投稿をそれぞれのアカウントでリノートする
     """
+    return targets.run_all(renote_target, concurrent=True)
+
+def renote_target():
+    """
+    今のターゲットのIDファイルを読み込み、Misskeyにリノートするメイン関数
+    """
+    target = targets.current()
     print("==============================================")
     print(f"Misskey要約ボット【リノートバッチ】開始: {datetime.now()}")
     print("==============================================")
@@ -31,11 +38,11 @@ def execute_renote():
     renote_success = False
     try:
         # 1. 朝8時に保存されたIDファイルを読み込む
-        if not os.path.exists(config.LAST_POST_ID_FILE_PATH):
-            print(f"  エラー: リノート対象のIDファイル '{config.LAST_POST_ID_FILE_PATH}' が見つかりません。")
+        if not os.path.exists(target.last_post_id_file_path):
+            print(f"  エラー: リノート対象のIDファイル '{target.last_post_id_file_path}' が見つかりません。")
             return False
 
-        with open(config.LAST_POST_ID_FILE_PATH, 'r', encoding='utf-8') as f:
+        with open(target.last_post_id_file_path, 'r', encoding='utf-8') as f:
             note_id = f.read().strip()
 
         if not note_id:
@@ -45,7 +52,7 @@ def execute_renote():
         print(f"  リノート対象の Note ID ({note_id}) を読み込みました。")
 
         # 2. Misskeyにリノート（RN）する
-        mk = Misskey(config.MISSKEY_URL, i=config.MISSKEY_TOKEN)
+        mk = target.client()
         
         print("  Misskeyに自己リノートを投稿します...")
         
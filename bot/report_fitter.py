@@ -0,0 +1,234 @@
+# 【ファイル名: bot/report_fitter.py】
+# (最終要約 (MFM のレポート) を見出しごとのセクションに分け、投稿の文字数制限に収まるように縮める・分割する)
+#
+# なぜ？: 文字数は PROMPT_FOR_FINAL で指示していますが、AI が守るとは限りません。
+# 制限を超えた日に投稿をまるごと中止すると1日分の要約が無駄になるため、ローカルで縮めて必ず投稿できるようにします。
+#
+# 縮め方 (優先度の低い後ろのセクションから):
+#   1. 引用 (>) の行を削る -> 2. 箇条書きなどの行を削る (各セクションの見出しと最初の1行は残す)
+#   3. 後ろのセクションを見出しだけにして「その他の話題」にまとめる
+
+import re
+
+import config
+
+# 1回の投稿の上限文字数 (冒頭の「昨日のタイムライン (...) のまとめです。」を含む)
+REPORT_MAX_CHARS = getattr(config, 'REPORT_MAX_CHARS', 2900)
+# 上限を超えた場合: "fit" (1つの投稿に収まるよう縮める) / "thread" (リプライでつないだ複数の投稿に分ける)
+REPORT_OVERFLOW = getattr(config, 'REPORT_OVERFLOW', 'fit')
+REPORT_THREAD_MAX_NOTES = getattr(config, 'REPORT_THREAD_MAX_NOTES', 3)
+# 縮めるときに、見出しと本文を残すセクション数の最小 (これより減らさないと収まらない場合は「縮められなかった」とします)
+REPORT_MIN_SECTIONS = getattr(config, 'REPORT_MIN_SECTIONS', 3)
+
+POST_HEADER = "昨日のタイムライン ({date}) のまとめです。\n\n"
+OTHER_TOPICS_HEADING = "$[tada.speed=0s その他の話題]"
+SECTION_SEPARATOR = "\n\n"
+
+# 見出しとみなす行: $[tada.speed=0s 見出し] などの MFM 関数1つだけの行 / **太字** だけの行 / # 見出し / 【見出し】
+_HEADING = re.compile(r"^(\$\[[\w.=,]+ (?P<mfm>.+)\]|\*\*(?P<bold>[^*]+)\*\*|#{1,6} (?P<md>.+)|【(?P<bracket>[^】]+)】)$")
+
+
+class Section:
+    """
+    レポートの見出し1つ分（見出しの無い前置きは heading が None）
+    """
+
+    def __init__(self, heading=None):
+        self.heading = heading
+        self.lines = []     # 見出し以外の空でない行
+
+    @property
+    def title(self):
+        match = _HEADING.match(self.heading or "")
+        if not match:
+            return self.heading or ""
+        return next(value for value in match.group('mfm', 'bold', 'md', 'bracket') if value).strip()
+
+    def render(self):
+        return "\n".join(([self.heading] if self.heading else []) + self.lines)
+
+
+def parse_sections(report):
+    """
+    レポートを見出しごとのセクションのリストに分ける（空行は捨てます）
+    """
+    sections = [Section()]
+    for raw_line in report.splitlines():
+        line = raw_line.rstrip()
+        if not line.strip():
+            continue
+        if _HEADING.match(line.strip()):
+            sections.append(Section(line.strip()))
+        else:
+            sections[-1].lines.append(line)
+    if not sections[0].lines:
+        sections.pop(0)
+    return sections
+
+
+def render_sections(sections):
+    return SECTION_SEPARATOR.join(section.render() for section in sections if section.heading or section.lines)
+
+
+def _is_quote(line):
+    return line.lstrip().startswith('>')
+
+
+def _is_any(line):
+    return True
+
+
+def _last_removable(section, predicate):
+    # なぜ？: 見出しだけが残っても内容が分からないため、各セクションの最初の1行は残します。
+    for index in range(len(section.lines) - 1, 0, -1):
+        if predicate(section.lines[index]):
+            return index
+    return None
+
+
+def _other_topics(merged, room):
+    """
+    まとめたセクションの見出しを1行に並べた「その他の話題」セクション (room 文字に収まらなければ None)
+    """
+    room -= len(OTHER_TOPICS_HEADING) + 1 + len(SECTION_SEPARATOR)
+    titles = [section.title for section in merged if section.title]
+    while titles:
+        line = "・" + "、".join(titles) + ("" if len(titles) == len(merged) else " など")
+        if len(line) <= room:
+            other = Section(OTHER_TOPICS_HEADING)
+            other.lines.append(line)
+            return other
+        titles.pop()
+    return None
+
+
+def fit_report(report, limit, min_sections=None):
+    """
+    レポートを limit 文字以内に縮めて返す。見出しを残すセクションを min_sections 個より減らさないと収まらなければ None
+    """
+    if len(report) <= limit:
+        return report
+    if min_sections is None:
+        min_sections = REPORT_MIN_SECTIONS
+    sections = parse_sections(report)
+    text = render_sections(sections)
+    if len(text) <= limit:
+        return text
+
+    # 1・2. 後ろのセクションから、引用 -> その他の行 の順に1行ずつ削る
+    for predicate in (_is_quote, _is_any):
+        for section in reversed(sections):
+            while (index := _last_removable(section, predicate)) is not None:
+                del section.lines[index]
+                text = render_sections(sections)
+                if len(text) <= limit:
+                    return text
+
+    # 3. 後ろのセクションを見出しだけにして「その他の話題」にまとめる
+    merged = []
+    while sum(1 for section in sections if section.heading) > min_sections and sections[-1].heading:
+        merged.insert(0, sections.pop())
+        text = render_sections(sections)
+        other = _other_topics(merged, limit - len(text))
+        if other is not None:
+            return render_sections(sections + [other])
+        if len(text) <= limit:
+            return text
+    return None
+
+
+def hard_fit(report, limit):
+    """
+    レポートを必ず limit 文字以内にする（fit_report で収まらなければ、行の区切りで切り詰めます）
+    """
+    text = fit_report(report, limit, min_sections=1)
+    if text is not None:
+        return text
+    text = render_sections(parse_sections(report))
+    if len(text) <= limit:
+        return text
+    cut = text.rfind("\n", 0, limit - 1)
+    if cut < limit // 2:
+        cut = limit - 1
+    return text[:cut].rstrip() + "…"
+
+
+def _split_block(block, limit):
+    """
+    limit を超えるセクションを、行の区切りで limit 以内の塊に分ける (1行で超える行は途中で切ります)
+    """
+    if len(block) <= limit:
+        return [block]
+    pieces = []
+    current = ""
+    for line in block.split("\n"):
+        while len(line) > limit:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) <= limit:
+            current = candidate
+        else:
+            pieces.append(current)
+            current = line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_report(report, limit):
+    """
+    レポートを、なるべくセクションの区切りで limit 文字以内の複数の投稿に分ける
+    """
+    parts = []
+    current = ""
+    for section in parse_sections(report):
+        for piece in _split_block(section.render(), limit):
+            candidate = f"{current}{SECTION_SEPARATOR}{piece}" if current else piece
+            if len(candidate) <= limit:
+                current = candidate
+            else:
+                parts.append(current)
+                current = piece
+    if current:
+        parts.append(current)
+    return parts
+
+
+def body_limit():
+    """
+    1回の投稿のうち、要約の本文に使える文字数
+    """
+    return REPORT_MAX_CHARS - len(POST_HEADER.format(date="0000/00/00"))
+
+
+def report_budget():
+    """
+    要約の本文全体の上限文字数 ("thread" の場合は、分けた投稿の合計)
+    """
+    if REPORT_OVERFLOW == 'thread':
+        return body_limit() * REPORT_THREAD_MAX_NOTES
+    return body_limit()
+
+
+def plan_post(summary, date_str):
+    """
+    要約から、投稿するノートの本文のリストを作る（1件目に冒頭の一文を付けます）。
+    各ノートは必ず REPORT_MAX_CHARS 以内で、"thread" でも REPORT_THREAD_MAX_NOTES 件以内です
+    """
+    header = POST_HEADER.format(date=date_str)
+    limit = REPORT_MAX_CHARS - len(header)
+    if len(summary) <= limit:
+        return [header + summary]
+    if REPORT_OVERFLOW != 'thread':
+        return [header + hard_fit(summary, limit)]
+    budget = limit * REPORT_THREAD_MAX_NOTES
+    while True:
+        parts = split_report(hard_fit(summary, budget), limit)
+        # なぜ？: セクションの区切りで分けると各投稿に余りが出るため、件数を超えたら全体を少しずつ縮めて分け直します。
+        if len(parts) <= REPORT_THREAD_MAX_NOTES:
+            return [header + parts[0], *parts[1:]]
+        budget = int(budget * 0.9)
@@ -0,0 +1,77 @@
+# 【ファイル名: bot/rolling_summarize.py】
+# (cron で 15分ごと, collect_notes.py の直後に実行することを想定)
+# (日中に「埋まったチャンク」から順に部分要約しておき、朝4時の summarize.py を Reduce だけにする)
+
+import os
+import sys
+from datetime import datetime
+import metrics
+import targets
+from checkpoint import SummarizeCheckpoint, pipeline_lock
+from note_store import NoteStore
+from summarize import MAP_PROMPT, chunks_depend_on_whole_day, iter_pending_chunks, summarize_chunks
+
+
+def execute_rolling_summarize():
+    """
+    全ターゲットについて逐次要約を実行する（GCPへのリクエストは summarize.py の共有キューで抑えます）
+    """
+    return targets.run_all(rolling_summarize_target, concurrent=True)
+
+
+def rolling_summarize_target():
+    """
+    今のターゲットの未要約ノートのうち、これ以上ノートが追加されない「完成したチャンク」だけを要約し、
+    結果を summarize.py と同じチェックポイントに保存するメイン関数
+    """
+    print(f"[{datetime.now()}] 逐次要約処理を開始します...")
+    metrics.begin('rolling_summarize')
+    try:
+        return _execute_rolling_summarize()
+    finally:
+        metrics.flush()
+
+
+def _execute_rolling_summarize():
+    target = targets.current()
+    with pipeline_lock(target.pipeline_lock_path, blocking=False) as locked:
+        # なぜ？: 前回の逐次要約や朝の要約バッチがまだ実行中なら、今回は何もせずに終わります。
+        if not locked:
+            print(f"[{datetime.now()}] 別の要約処理が実行中のため、今回の逐次要約はスキップします。")
+            return False
+
+        if not os.path.exists(target.note_store_path):
+            print(f"[{datetime.now()}] ノートストアがまだ無いため、逐次要約はスキップします。")
+            return False
+
+        # なぜ？: チャンカーは先頭から貪欲にノートを詰めるため、ノートが追記されても変わるのは最後のチャンクだけです。
+        # 最後のチャンクはまだ埋まりきっていないので、それより前のチャンクだけを要約します。
+        with NoteStore(target.note_store_path) as store:
+            if chunks_depend_on_whole_day(store):
+                # なぜ？: 注目度による絞り込みや話題ごとのチャンク分けは1日分のノート全体で決まるため、
+                # 日中に作ったチャンクは朝には変わってしまい無駄になります。
+                print(f"[{datetime.now()}] 朝の要約で絞り込み・話題ごとのチャンク分けを行うため、逐次要約はスキップします。")
+                return True
+            with metrics.span('chunk') as chunking:
+                chunks = list(iter_pending_chunks(store))
+                chunking.add(chunks=len(chunks), bytes=sum(len(chunk.encode('utf-8')) for chunk in chunks))
+        completed_chunks = chunks[:-1]
+        if not completed_chunks:
+            print(f"[{datetime.now()}] 完成したチャンクはまだありません。(チャンク数: {len(chunks)})")
+            return True
+
+        # なぜ？: summarize.py と同じステップ名で保存するため、朝の要約バッチはこの結果をそのまま再利用します。
+        checkpoint = SummarizeCheckpoint(target.checkpoint_dir)
+        with metrics.span('map', chunks=len(completed_chunks)) as mapping:
+            summaries = summarize_chunks(completed_chunks, MAP_PROMPT, checkpoint=checkpoint)
+            mapping.add(summarized=sum(1 for summary in summaries if summary))
+        newly_summarized = sum(1 for summary in summaries if summary) - checkpoint.resumed
+        failed = sum(1 for summary in summaries if not summary)
+        print(f"[{datetime.now()}] 逐次要約が完了しました。"
+              f"(新規: {newly_summarized}件 / 要約済み: {checkpoint.resumed}件 / 失敗: {failed}件 / 未完成: 1件)")
+        return failed == 0
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    execute_rolling_summarize()
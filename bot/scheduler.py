@@ -0,0 +1,249 @@
+# 【ファイル名: bot/scheduler.py】
+# (cron の代わりに常駐し、収集・要約・投稿・リノートを内部のスケジュールで実行するデーモン)
+# (systemd 等で常駐させることを想定。cron の4つのジョブは不要になります)
+#
+# なぜ？: cron では実行のたびに Python の起動・ライブラリの読み込み・DNS 解決・TLS 接続をやり直します。
+# 常駐すれば一度読み込んだモジュールと、接続を使い回す共通クライアント (clients.py) がそのまま使えます。
+# ジョブの受け渡しは従来どおりファイル (要約ファイル・投稿IDファイル) なので、個別のスクリプトも今まで通り使えます。
+
+import asyncio
+import json
+import os
+import signal
+import sys
+import traceback
+from datetime import datetime, timedelta
+
+import config
+import collect_notes
+import post_note
+import renote
+import rolling_summarize
+import summarize
+
+# ジョブごとのスケジュール:
+#   {'every_minutes': N}  毎時0分から N 分ごと (cron の */N と同じ)
+#   {'at': 'HH:MM'}       毎日その時刻 (サーバーのローカル時刻)
+#   {'after': 'ジョブ名'}  そのジョブが成功した直後
+# なぜ？: 逐次要約を収集の直後に実行しておくと、朝の要約は残りのチャンクと Reduce だけで済みます
+# (絞り込み・話題ごとのチャンク分けを使う設定では、逐次要約は何もせずに終わります)。
+SCHEDULER_JOBS = getattr(config, 'SCHEDULER_JOBS', {
+    'collect': {'every_minutes': 15},
+    'rolling_summarize': {'after': 'collect'},
+    'summarize': {'at': '04:00'},
+    'post': {'at': '08:00'},
+    'renote': {'at': '20:00'},
+})
+# True なら、定期収集 (collect) の代わりにストリーミング収集をデーモン内で動かす
+SCHEDULER_STREAM_COLLECTOR = getattr(config, 'SCHEDULER_STREAM_COLLECTOR', False)
+# 各ジョブの最終実行の記録 (再起動をまたいで、止まっていた間に逃した毎日のジョブを実行するため)
+SCHEDULER_STATE_PATH = getattr(config, 'SCHEDULER_STATE_PATH', os.path.join(config.DATA_DIR, "scheduler_state.json"))
+# 毎日のジョブの予定時刻に止まっていた場合、起動時にこの分数以内の遅れなら実行する
+SCHEDULER_CATCHUP_MINUTES = getattr(config, 'SCHEDULER_CATCHUP_MINUTES', 120)
+
+
+class Job:
+    """
+    デーモンで実行するジョブ。同じ lane のジョブは同時に実行しません。
+    lane が使用中のとき、if_busy が "skip" なら今回の実行を見送り、"wait" なら空くのを待ちます。
+    """
+
+    def __init__(self, name, function, lane, if_busy):
+        self.name = name
+        self.function = function
+        self.lane = lane
+        self.if_busy = if_busy
+        self.running = False
+
+
+# なぜ？: 要約・投稿・リノートは「要約ファイル -> 投稿ID」の順に受け渡すため、同じ lane で順番に実行します。
+# 投稿の時刻に要約がまだ終わっていなければ、終わるのを待ってから投稿します。
+# 収集はストアの WAL モードにより要約と同時に実行できるため、別の lane にします。
+# (各ジョブは全ターゲット分をまとめて実行します。ターゲットごとの並行処理は targets.run_all が行います)
+JOBS = {
+    'collect': Job('collect', collect_notes.execute_periodic_collection, lane='collect', if_busy='skip'),
+    'rolling_summarize': Job('rolling_summarize', rolling_summarize.execute_rolling_summarize,
+                             lane='pipeline', if_busy='skip'),
+    'summarize': Job('summarize', summarize.execute_summarize, lane='pipeline', if_busy='wait'),
+    'post': Job('post', post_note.execute_post, lane='pipeline', if_busy='wait'),
+    'renote': Job('renote', renote.execute_renote, lane='pipeline', if_busy='wait'),
+}
+
+
+def next_run_time(schedule, now):
+    """
+    スケジュールの次の実行時刻 ('after' のジョブは None)
+    """
+    if 'every_minutes' in schedule:
+        step = schedule['every_minutes']
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        minutes = (now.hour * 60 + now.minute) // step * step + step
+        return midnight + timedelta(minutes=minutes)
+    if 'at' in schedule:
+        hour, minute = (int(value) for value in schedule['at'].split(':'))
+        scheduled = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return scheduled if scheduled > now else scheduled + timedelta(days=1)
+    return None
+
+
+def previous_run_time(schedule, now):
+    """
+    毎日のジョブの、直近の (過ぎた) 予定時刻
+    """
+    return next_run_time(schedule, now) - timedelta(days=1)
+
+
+class Scheduler:
+    def __init__(self, jobs, schedules, state_path):
+        self.jobs = jobs
+        self.schedules = schedules
+        self.state_path = state_path
+        self.state = self._load_state()
+        self.lanes = {}
+        self.tasks = set()
+        self.stopping = None
+
+    # --- 状態の保存 ---
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"  警告: スケジューラーの状態ファイルを読み込めませんでした: {e}")
+            return {}
+
+    def _save_state(self):
+        # なぜ？: 書き込み途中で落ちても状態ファイルが壊れないよう、一時ファイルに書いてから置き換えます。
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.state_path)
+
+    # --- ジョブの実行 ---
+
+    def trigger(self, name, reason):
+        task = asyncio.create_task(self.run_job(self.jobs[name], reason))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run_job(self, job, reason):
+        if job.running:
+            # なぜ？: 前回の実行が長引いている場合 (例: 繁忙日の収集)、同じジョブを重ねて実行しません。
+            print(f"[{datetime.now()}] [scheduler] {job.name} は前回の実行がまだ終わっていないため、今回 ({reason}) は見送ります。")
+            return
+        lane = self.lanes.setdefault(job.lane, asyncio.Lock())
+        if lane.locked() and job.if_busy == 'skip':
+            print(f"[{datetime.now()}] [scheduler] {job.lane} の別のジョブが実行中のため、{job.name} ({reason}) は見送ります。")
+            return
+        job.running = True
+        try:
+            if lane.locked():
+                print(f"[{datetime.now()}] [scheduler] {job.name} ({reason}) は {job.lane} の別のジョブが終わるのを待ちます...")
+            async with lane:
+                await self._run_locked(job, reason)
+        finally:
+            job.running = False
+
+    async def _run_locked(self, job, reason):
+        print(f"[{datetime.now()}] [scheduler] {job.name} を開始します ({reason})")
+        record = self.state.setdefault(job.name, {})
+        record['last_started'] = datetime.now().isoformat(timespec='seconds')
+        self._save_state()
+        started = asyncio.get_running_loop().time()
+        try:
+            # なぜ？: 各ジョブは同期処理 (requests・SQLite) なので別スレッドで実行し、その間もスケジュールを進めます。
+            result = await asyncio.to_thread(job.function)
+            succeeded = result is not False
+        except Exception:
+            print(f"[{datetime.now()}] [scheduler] {job.name} で予期せぬエラーが発生しました:")
+            print(traceback.format_exc())
+            succeeded = False
+        seconds = asyncio.get_running_loop().time() - started
+        record['last_finished'] = datetime.now().isoformat(timespec='seconds')
+        record['last_seconds'] = round(seconds, 1)
+        record['last_succeeded'] = succeeded
+        self._save_state()
+        print(f"[{datetime.now()}] [scheduler] {job.name} が{'完了' if succeeded else '失敗'}しました ({seconds:.1f}秒)")
+        if succeeded:
+            for name, schedule in self.schedules.items():
+                if schedule.get('after') == job.name:
+                    self.trigger(name, f"{job.name} の後")
+
+    # --- スケジュール ---
+
+    async def timer(self, name, schedule):
+        while True:
+            now = datetime.now()
+            run_at = next_run_time(schedule, now)
+            # なぜ？: スリープ中に時計が変わっても (NTP の補正など) ずれが溜まらないよう、毎回「次の予定時刻」から計算します。
+            await asyncio.sleep(max(0.0, (run_at - now).total_seconds()))
+            self.trigger(name, run_at.strftime('%H:%M の定期実行'))
+
+    def catch_up(self):
+        """
+        デーモンが止まっていて逃した毎日のジョブを、遅れが SCHEDULER_CATCHUP_MINUTES 以内なら今すぐ実行する
+        """
+        now = datetime.now()
+        for name, schedule in sorted(self.schedules.items(), key=lambda item: item[1].get('at', '')):
+            if 'at' not in schedule or name not in self.state:
+                continue
+            scheduled = previous_run_time(schedule, now)
+            last_started = datetime.fromisoformat(self.state[name].get('last_started', '1970-01-01T00:00:00'))
+            if last_started < scheduled and now - scheduled <= timedelta(minutes=SCHEDULER_CATCHUP_MINUTES):
+                self.trigger(name, f"{scheduled.strftime('%H:%M')} の実行を逃したため")
+
+    async def run(self, stream_collector=False):
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, self.stopping.set)
+
+        background = []
+        for name, schedule in self.schedules.items():
+            if name not in self.jobs:
+                print(f"  警告: 不明なジョブ '{name}' のスケジュールは無視します。")
+                continue
+            if stream_collector and name == 'collect':
+                continue
+            if 'every_minutes' in schedule or 'at' in schedule:
+                background.append(asyncio.create_task(self.timer(name, schedule)))
+        if stream_collector:
+            background.append(asyncio.create_task(self.run_stream_collector()))
+        self.catch_up()
+        for name, schedule in self.schedules.items():
+            run_at = next_run_time(schedule, datetime.now())
+            print(f"  {name}: {'(' + schedule['after'] + ' の後)' if run_at is None else run_at.strftime('次回 %m/%d %H:%M')}")
+
+        await self.stopping.wait()
+        print(f"[{datetime.now()}] [scheduler] 停止します。実行中のジョブが終わるのを待ちます...")
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        # なぜ？: スレッドで実行中のジョブは途中で止められないため、終わるまで待ってから終了します
+        # (チェックポイントがあるので要約は途中で止めても再開できますが、投稿の二重実行を避けるため)。
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def run_stream_collector(self):
+        """
+        ストリーミング収集をデーモンのイベントループ内で動かす
+        """
+        from stream_collector import run_stream_collectors
+
+        await run_stream_collectors()
+
+
+def execute_scheduler():
+    print(f"[{datetime.now()}] スケジューラーを開始します...")
+    os.makedirs(config.DATA_DIR, exist_ok=True)
+    scheduler = Scheduler(JOBS, SCHEDULER_JOBS, SCHEDULER_STATE_PATH)
+    asyncio.run(scheduler.run(stream_collector=SCHEDULER_STREAM_COLLECTOR))
+    print(f"[{datetime.now()}] スケジューラーを終了しました。")
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    execute_scheduler()
@@ -0,0 +1,242 @@
+# 【ファイル名: bot/stream_collector.py】
+# (cron の collect_notes.py の代わりに、常駐してストリーミングAPIでLTLを収集するモード)
+# (systemd 等で常駐させることを想定。websockets ライブラリが必要です)
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+import config
+import metrics
+import targets
+from clients import backoff_seconds
+from collect_notes import fetch_notes_since, is_collectable, save_collect_cursor, CURSOR_ID_KEY
+from note_store import NoteStore, note_to_row
+
+# --- ストリーミング収集の設定 ---
+STREAM_FLUSH_INTERVAL_SECONDS = getattr(config, 'STREAM_FLUSH_INTERVAL_SECONDS', 10)  # ストアへ書き込む間隔
+STREAM_FLUSH_MAX_NOTES = getattr(config, 'STREAM_FLUSH_MAX_NOTES', 200)              # これだけ溜まったら間隔を待たずに書き込む
+STREAM_REACTION_TRACK_MINUTES = getattr(config, 'STREAM_REACTION_TRACK_MINUTES', 15) # リアクション数を追跡する時間
+STREAM_PING_INTERVAL_SECONDS = 30
+
+CHANNEL_ID = 'ltl'
+
+
+def streaming_url(target=None):
+    """
+    ターゲットの MISSKEY_URL から、ストリーミングAPIの WebSocket URL を作る
+    """
+    target = target or targets.current()
+    base_url = target.misskey_url.rstrip('/')
+    if base_url.startswith('https://'):
+        base_url = 'wss://' + base_url[len('https://'):]
+    elif base_url.startswith('http://'):
+        base_url = 'ws://' + base_url[len('http://'):]
+    return f"{base_url}/streaming?i={target.misskey_token}"
+
+
+class StreamCollector:
+    """
+    タイムラインのチャンネル (既定は localTimeline) を購読し、受け取ったノートをまとめてストアに書き込む
+    """
+
+    def __init__(self, store, target=None):
+        self.store = store
+        self.target = target or targets.current()
+        self.client = self.target.client()
+        self.pending = {}       # ストアへ未書き込みの行 (ノートID -> 行)
+        self.tracked = {}       # リアクション数を追跡中のノート (ノートID -> (行, 追跡開始時刻))
+        self.seen_notes = []    # カーソルを進めるため、前回の書き込み以降に受け取った全ノート (除外分も含む)
+        self.last_flush = time.monotonic()
+        # なぜ？: ストアへの書き込みは別スレッドで行うため、取り消し後の書き込みなどが同じ接続で重ならないようにします。
+        self.store_lock = threading.Lock()
+
+    def backfill(self):
+        """
+        切断していた間（または起動前）のノートを REST API で取得して取り込む
+        """
+        cursor_id = self.store.get_meta(CURSOR_ID_KEY)
+        since_dt_utc = None
+        if not cursor_id:
+            since_dt_utc = datetime.now(timezone.utc) - timedelta(minutes=30)
+        print(f"[{datetime.now()}] 欠けている期間を REST API で補完します... (カーソル: {cursor_id or '初回'})")
+        notes = fetch_notes_since(self.client, cursor_id, since_dt_utc)
+        rows = [note_to_row(note) for note in notes if is_collectable(note)]
+        with self.store_lock:
+            if rows:
+                inserted = self.store.upsert_notes(rows)
+                print(f"  補完: {inserted} 件のノートを追加しました。(更新: {len(rows) - inserted} 件)")
+            save_collect_cursor(self.store, notes)
+
+    def handle_message(self, message):
+        """
+        ストリーミングAPIのメッセージを1件処理する。購読を追加すべきノートIDを返す
+        """
+        msg_type = message.get('type')
+        body = message.get('body') or {}
+        if msg_type == 'channel' and body.get('id') == CHANNEL_ID and body.get('type') == 'note':
+            note = body.get('body') or {}
+            if not note.get('id'):
+                return None
+            self.seen_notes.append(note)
+            if not is_collectable(note):
+                return None
+            row = note_to_row(note)
+            self.pending[row['id']] = row
+            self.tracked[row['id']] = (row, time.monotonic())
+            return row['id']
+
+        if msg_type == 'noteUpdated':
+            tracked = self.tracked.get(body.get('id'))
+            if tracked is None:
+                return None
+            row = tracked[0]
+            # なぜ？: 投稿直後はリアクション数が0のため、一定時間はリアクションを数えて最新の値に保ちます。
+            if body.get('type') == 'reacted':
+                row['reaction_count'] += 1
+            elif body.get('type') == 'unreacted':
+                row['reaction_count'] = max(0, row['reaction_count'] - 1)
+            else:
+                return None
+            self.pending[row['id']] = row
+        return None
+
+    def flush_due(self):
+        return (len(self.pending) >= STREAM_FLUSH_MAX_NOTES
+                or time.monotonic() - self.last_flush >= STREAM_FLUSH_INTERVAL_SECONDS)
+
+    async def flush(self):
+        """
+        溜まったノートをまとめてストアに書き込み、カーソルを進める
+        （SQLite のコミットでディスクへ同期されるため、1件ずつではなく定期的にまとめて書き込みます）
+        """
+        self.last_flush = time.monotonic()
+        # なぜ？: 追跡中の行はこの後もリアクションで書き換わるため、書き込む時点の値を写しておきます。
+        rows = [dict(row) for row in self.pending.values()]
+        self.pending.clear()
+        seen_notes, self.seen_notes = self.seen_notes, []
+        # なぜ？: スケジューラー内で動かす場合はスケジューラーと同じイベントループなので、WAL のチェックポイントや
+        # ロック待ちで他のタイマー・接続を止めないよう、書き込みは別スレッドで行います。
+        await asyncio.to_thread(self._write, rows, seen_notes)
+
+    def _write(self, rows, seen_notes):
+        with self.store_lock:
+            if rows:
+                with metrics.span('write', rows=len(rows)) as writing:
+                    inserted = self.store.upsert_notes(rows)
+                    writing.add(inserted=inserted)
+                print(f"[{datetime.now()}] {inserted} 件のノートを追加しました。(更新: {len(rows) - inserted} 件)")
+            if seen_notes:
+                save_collect_cursor(self.store, seen_notes)
+        # なぜ？: 常駐プロセスは終了時まで待たず、書き込みのたびに累計を書き出します（ログには出しません）。
+        metrics.flush(report=False)
+
+    def expired_note_ids(self):
+        """
+        リアクション数の追跡期間が過ぎたノートIDを、追跡対象から外して返す
+        """
+        deadline = time.monotonic() - STREAM_REACTION_TRACK_MINUTES * 60
+        expired = [note_id for note_id, (_, since) in self.tracked.items() if since < deadline]
+        for note_id in expired:
+            del self.tracked[note_id]
+        return expired
+
+    async def consume(self, ws):
+        """
+        1本の WebSocket 接続からメッセージを受け取り続ける（切断されたら例外で抜けます）
+        """
+        await ws.send(json.dumps({
+            'type': 'connect',
+            'body': {'channel': self.target.streaming_channel, 'id': CHANNEL_ID},
+        }))
+        print(f"[{datetime.now()}] {self.target.streaming_channel} チャンネルの購読を開始しました。")
+        # なぜ？: 購読を始めてから補完することで、「補完の後・購読の前」に投稿されたノートの取りこぼしを防ぎます。
+        # 補完中に届いたノートは接続内で待たされ、後から処理されます（重複はストアの主キーで排除されます）。
+        # 補完の間も接続の死活監視 (ping) を止めないよう、別スレッドで実行します。
+        await asyncio.to_thread(self.backfill)
+        while True:
+            try:
+                raw = await asyncio.wait_for(ws.recv(), timeout=STREAM_FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                raw = None
+            if raw is not None:
+                try:
+                    sub_note_id = self.handle_message(json.loads(raw))
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"  警告: 解釈できないメッセージをスキップしました: {e}")
+                    sub_note_id = None
+                if sub_note_id:
+                    await ws.send(json.dumps({'type': 'subNote', 'body': {'id': sub_note_id}}))
+            if self.flush_due():
+                await self.flush()
+                for note_id in self.expired_note_ids():
+                    await ws.send(json.dumps({'type': 'unsubNote', 'body': {'id': note_id}}))
+
+    async def run(self, url):
+        """
+        接続が切れても指数バックオフで再接続し続けるメインループ
+        """
+        # なぜ？: 重いライブラリなので、ストリーミングモードを使うときだけ読み込みます。
+        import websockets
+
+        attempt = 0
+        while True:
+            try:
+                # なぜ？: 切断中に投稿されたノートは流れてこないため、接続のたびに REST API で隙間を埋めます (consume 内)。
+                async with websockets.connect(url, ping_interval=STREAM_PING_INTERVAL_SECONDS) as ws:
+                    attempt = 0
+                    await self.consume(ws)
+            except (OSError, websockets.exceptions.WebSocketException) as e:
+                print(f"[{datetime.now()}] ストリーミング接続が切断されました: {e}")
+            except Exception:
+                print(f"[{datetime.now()}] ストリーミング収集中に予期せぬエラーが発生しました:")
+                print(traceback.format_exc())
+            finally:
+                await self.flush()
+                # なぜ？: 再接続後は購読し直せないため、追跡中のノートはここで手放します。
+                self.tracked.clear()
+
+            wait = backoff_seconds(attempt)
+            attempt += 1
+            print(f"  {wait:.1f}秒後に再接続します... ({attempt}回目)")
+            await asyncio.sleep(wait)
+
+
+async def collect_target_stream(target):
+    """
+    1つのターゲットのストリーミング収集（ターゲットごとのタスクで動かします）
+    """
+    # なぜ？: asyncio のタスクはそれぞれコンテキストを持つため、ターゲットの切り替えと計測の集計はタスクごとに分かれます。
+    with targets.use(target):
+        metrics.begin('stream_collector')
+        os.makedirs(target.data_dir, exist_ok=True)
+        with NoteStore(target.note_store_path) as store:
+            await StreamCollector(store, target).run(streaming_url(target))
+
+
+async def run_stream_collectors():
+    """
+    全ターゲットのストリーミング収集を、1つのイベントループで同時に動かす
+    """
+    # なぜ？: 接続の大半は受信待ちなので、ターゲットごとにプロセスやスレッドを分けなくても1つのループで足ります。
+    if len(targets.TARGETS) > 1:
+        targets.prefix_output()
+    await asyncio.gather(*(collect_target_stream(target) for target in targets.TARGETS))
+
+
+def execute_stream_collection():
+    print(f"[{datetime.now()}] ストリーミング収集を開始します...")
+    try:
+        asyncio.run(run_stream_collectors())
+    except KeyboardInterrupt:
+        # なぜ？: 中断時は各タスクが取り消され、受信済みのノートは StreamCollector.run の finally で書き込まれます。
+        print(f"[{datetime.now()}] ストリーミング収集を終了しました。")
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    execute_stream_collection()
@@ -3,9 +3,107 @@
 
 import os
 import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import config # config.py から秘密情報を読み込む
 import sys # sys.path のために追加
+import metrics
+import targets
+from clients import post_to_gcp, stream_from_gcp
+from note_archive import ARCHIVE_ROTATION, rotate_archive
+from note_chunker import ENTRY_JOINER, iter_grouped_chunks, iter_sized_chunks
+from note_compactor import COMPACT_JOINER, NoteCompactor
+from note_store import NoteStore, format_note_entry, import_legacy_note_file, utc_timestamp
+from report_fitter import fit_report, hard_fit, report_budget
+from summary_cache import SummaryCache
+from checkpoint import SummarizeCheckpoint, pipeline_lock
+from token_budget import ensure_estimator_version, estimate_tokens, report_plan
+
+# --- Mapステージの並列度・リトライ設定 ---
+# なぜ？: 古い config.py にも項目が無くても動くよう、既定値を用意しておきます。
+MAX_CONCURRENT_REQUESTS = getattr(config, 'MAX_CONCURRENT_REQUESTS', 4)
+GCP_MAX_RETRIES = getattr(config, 'GCP_MAX_RETRIES', 3)
+GCP_RETRY_WAIT_SECONDS = getattr(config, 'GCP_RETRY_WAIT_SECONDS', 10)
+# 1回のリクエストでまとめて送るチャンク数 (1 の場合はバッチを使わず1件ずつ送ります)
+GCP_BATCH_SIZE = getattr(config, 'GCP_BATCH_SIZE', 1)
+# Cloud Function が1回のバッチで受け付ける最大件数 (関数側の環境変数 BATCH_MAX_ITEMS と同じ値にします)
+GCP_BATCH_MAX_ITEMS = getattr(config, 'GCP_BATCH_MAX_ITEMS', 32)
+if GCP_BATCH_SIZE > GCP_BATCH_MAX_ITEMS:
+    # なぜ？: 上限を超えるバッチは毎回 400 で拒否され、黙って1件ずつの送信に戻るだけになるためです。
+    print(f"警告: GCP_BATCH_SIZE ({GCP_BATCH_SIZE}) が Cloud Function の上限を超えているため、"
+          f"{GCP_BATCH_MAX_ITEMS} 件ずつ送ります。")
+    GCP_BATCH_SIZE = GCP_BATCH_MAX_ITEMS
+# 呼び出しの種類 ("map" / "reduce" / "final" / "shorten") ごとに Cloud Function へ渡す生成設定 (指定しない項目は関数側の既定値)
+# なぜ？: 部分要約 (Map) は最終要約ほど長くならないため、出力トークンの上限を小さくして生成の暴走と費用を抑えます。
+# (gemini-2.5-flash では思考 (thinking) のトークンも max_output_tokens に含まれるため、小さくしすぎないでください)
+GCP_GENERATION_CONFIGS = getattr(config, 'GCP_GENERATION_CONFIGS', {'map': {'max_output_tokens': 4096}})
+# 要約を少しずつ受け取るストリーミング方式を使うか (非対応の Cloud Function でもそのまま動きます)
+GCP_STREAMING = getattr(config, 'GCP_STREAMING', True)
+
+# --- 階層Reduceの設定 ---
+# 1回のReduce呼び出しに渡す、結合済み部分要約のおおよその上限文字数
+REDUCE_INPUT_LIMIT = getattr(config, 'REDUCE_INPUT_LIMIT', config.CHUNK_SIZE)
+# Reduceの最大段数。これを超えたら、上限を超えていても最終要約を試みます。
+REDUCE_MAX_DEPTH = getattr(config, 'REDUCE_MAX_DEPTH', 4)
+
+# --- トークン数での上限 (設定した場合は、上の文字数での上限の代わりに使います) ---
+# なぜ？: Gemini の制限と課金はトークン単位で、日本語とASCIIでは1文字あたりのトークン数が大きく違うためです。
+CHUNK_TOKEN_BUDGET = getattr(config, 'CHUNK_TOKEN_BUDGET', None)
+REDUCE_TOKEN_BUDGET = getattr(config, 'REDUCE_TOKEN_BUDGET', None)
+
+# --- 要約前の圧縮 (bot/note_compactor.py) ---
+# なぜ？: 1ノートごとの ========= 枠やユーザー名・時刻の繰り返しが入力トークンの多くを占めるため、
+# 重複・短いノートを除き、連投をまとめた1行形式にしてから送ります。
+NOTE_COMPACTION = getattr(config, 'NOTE_COMPACTION', False)
+
+# --- 注目度による絞り込み (bot/note_ranker.py) ---
+# 未要約ノートがこの件数を超える日は、注目度の高いノートだけをこの件数まで選んで要約します (0 なら絞り込まない)
+SALIENCE_MAX_NOTES = getattr(config, 'SALIENCE_MAX_NOTES', 0)
+
+# --- 話題ごとのチャンク分け (bot/note_clusterer.py) ---
+# True にすると、ノートを話題ごとにまとめてからチャンクに詰めます (numpy が必要)
+TOPIC_CLUSTERING = getattr(config, 'TOPIC_CLUSTERING', False)
+
+SUMMARY_SEPARATOR = "\n\n--- (次の断片の要約) ---\n\n"
+
+# --- 要約キャッシュの設定 ---
+# なぜ？: 失敗後の再実行で、要約済みのチャンクをもう一度AIに送らずに済むようにします。
+summary_cache = SummaryCache(
+    getattr(config, 'SUMMARY_CACHE_DIR', os.path.join(config.DATA_DIR, "summary_cache")),
+    max_age_seconds=getattr(config, 'SUMMARY_CACHE_MAX_AGE_DAYS', 7) * 24 * 60 * 60,
+    max_bytes=getattr(config, 'SUMMARY_CACHE_MAX_BYTES', 50 * 1024 * 1024),
+)
+
+# --- GCPへの要約リクエストの共有キュー ---
+# なぜ？: 複数のターゲットを同時に要約しても、GCPへの同時リクエスト数が全体で MAX_CONCURRENT_REQUESTS を超えないよう、
+# Map・Reduce のリクエストはすべてプロセスで1つのスレッドプールに投入します。（1分あたりの回数は clients.py で制限します）
+_gcp_queue = None
+_gcp_queue_lock = threading.Lock()
+
+def gcp_queue():
+    """
+    プロセス内で共有する、GCPへの要約リクエスト用のスレッドプールを返す
+    """
+    global _gcp_queue
+    with _gcp_queue_lock:
+        if _gcp_queue is None:
+            _gcp_queue = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS, thread_name_prefix='gcp')
+        return _gcp_queue
+
+def _run_parallel(function, items, max_workers=None):
+    """
+    items の各要素に function を並列に適用し、同じ順番の結果リストを返す
+    （max_workers を指定しない場合は、全ターゲットで共有するキューに投入します）
+    """
+    # なぜ？: 各スレッドでの GCP 呼び出しの計測・ログが、呼び出し元のジョブ (ターゲット) の集計に入るようにします。
+    function = metrics.bind(function)
+    if max_workers is None:
+        # なぜ？: executor.map は投入順に結果を返すため、Reduce に渡す部分要約の順番が保たれます。
+        return list(gcp_queue().map(function, items))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(function, items))
 
 # --- AIに指示するプロンプト（変更なし） ---
 PROMPT_FOR_CHUNK = """
@@ -18,6 +116,19 @@ PROMPT_FOR_CHUNK = """
 [テキスト]
 """
 
+# 圧縮した1行形式のノートを送る場合の、Mapステージのプロンプト
+PROMPT_FOR_CHUNK_COMPACT = """
+あなたはMisskeyタイムラインの分析アシスタントです。
+以下は、あるコミュニティの1日の投稿の一部（断片）です。
+各行は「時刻 ユーザー名: 投稿」の形式で、同じユーザーの連続した投稿は「 / 」でつないでいます。
+「♥数字」はその投稿へのリアクション数、「[メディア]」は画像などが添付された投稿を表します。
+この断片から、特に重要と思われるトピックや会話を箇条書きで簡潔に抽出してください。
+後で他の断片と結合されることを意識してください。
+特に引用すべきと判断した場合は「>[ユーザー名]さん 引用内容」として引用を行うこと。
+---
+[テキスト]
+"""
+
 PROMPT_FOR_FINAL = """
 あなたはMisskeyタイムラインの分析アシスタントです。
 以下に、あるコミュニティの1日の投稿を分割して要約した「要約の断片」が複数あります。
@@ -46,7 +157,67 @@ Misskeyの投稿制限（約3000文字）を考慮し、
 
 """
 
-# --- 関数群（get_summary_from_gcp, split_text は変更なし） ---
+PROMPT_FOR_REDUCE = """
+あなたはMisskeyタイムラインの分析アシスタントです。
+以下は、あるコミュニティの1日の投稿を分割して要約した「要約の断片」の一部です。
+これらの断片を統合し、重要なトピックや会話を箇条書きで簡潔にまとめ直してください。
+後で他のまとめと再度結合されることを意識し、重複する話題は一つにまとめてください。
+引用「>[ユーザー名]さん 引用内容」は、特に重要なものだけ残してください。
+---
+[テキスト]
+"""
+
+PROMPT_FOR_SHORTEN = """
+あなたはMisskeyタイムラインの分析アシスタントです。
+以下は、あるコミュニティの1日の出来事をまとめたレポートですが、Misskeyの投稿の文字数制限を超えています。
+レポートの**全文（見出しやMFMタグ含む）が、必ず[文字数]文字以内**に収まるように短くしてください。
+見出しとMFMの書式はそのまま残し、マイナーなトピックや引用から削ってください。
+---
+[テキスト]
+"""
+
+# Mapステージで実際に使うプロンプト (逐次要約 rolling_summarize.py とも共有します)
+MAP_PROMPT = PROMPT_FOR_CHUNK_COMPACT if NOTE_COMPACTION else PROMPT_FOR_CHUNK
+
+# プロンプト -> 呼び出しの種類 (GCP_GENERATION_CONFIGS のキー)
+PROMPT_KINDS = {
+    PROMPT_FOR_CHUNK: 'map',
+    PROMPT_FOR_CHUNK_COMPACT: 'map',
+    PROMPT_FOR_REDUCE: 'reduce',
+    PROMPT_FOR_FINAL: 'final',
+}
+
+# --- 関数群 ---
+
+def generation_config_for(prompt):
+    """
+    プロンプトの種類に応じた生成設定 (設定が無ければ None)
+    """
+    # なぜ？: 短縮のプロンプトは文字数を埋め込んで毎回変わるため、先頭の一致で判定します。
+    if prompt.startswith(PROMPT_FOR_SHORTEN.split("[文字数]")[0]):
+        return GCP_GENERATION_CONFIGS.get('shorten')
+    return GCP_GENERATION_CONFIGS.get(PROMPT_KINDS.get(prompt))
+
+def gcp_payload(prompt, **fields):
+    """
+    GCPへのリクエストのボディ (プロンプトと、呼び出しの種類に応じた生成設定を付けます)
+    """
+    payload = dict(fields, prompt=prompt)
+    generation_config = generation_config_for(prompt)
+    if generation_config:
+        payload['generation_config'] = generation_config
+    return payload
+
+def cache_key_for(prompt, text):
+    """
+    要約キャッシュのキー (送信先と、生成設定を指定した場合はその設定も含めます)
+    """
+    params = {'function_url': config.GCP_FUNCTION_URL}
+    generation_config = generation_config_for(prompt)
+    if generation_config:
+        # なぜ？: 生成設定 (出力の上限など) を変えたら、以前の設定での要約は使わないようにします。
+        params['generation_config'] = generation_config
+    return SummaryCache.make_key(prompt, text, params)
 
 def get_summary_from_gcp(text, prompt):
     """
@@ -57,89 +228,455 @@ def get_summary_from_gcp(text, prompt):
         print("  GCPリクエスト: テキストが空のためスキップします。")
         return None
     
+    # なぜ？: 同じプロンプト・テキスト・送信先への要約は結果も同じとみなし、キャッシュから返します。
+    cache_key = cache_key_for(prompt, text)
+    cached_summary = summary_cache.get(cache_key)
+    if cached_summary:
+        print(f"  要約キャッシュにヒットしました。GCPへのリクエストを省略します。(文字数: {len(text)})")
+        return cached_summary
+
     print(f"  GCPのAIにリクエストを送信します... (文字数: {len(text)})")
-    headers = {'Content-Type': 'application/json'}
-    data = {'text': text, 'prompt': prompt} 
-    
+    data = gcp_payload(prompt, text=text)
+
+    with metrics.span('gcp_call', requests=1, bytes_out=len(text.encode('utf-8'))) as call:
+        summary = _request_summary(data, call)
+    if summary:
+        summary_cache.put(cache_key, summary)
+    return summary
+
+def _request_summary(data, call):
+    """
+    get_summary_from_gcp の本体: 1回だけ要約を依頼し、失敗したら None を返す（計測値は call に足し込みます）
+    """
     try:
-        # config.py で設定したURLとタイムアウト値でリクエスト
-        response = requests.post(config.GCP_FUNCTION_URL, json=data, timeout=540)
-        # なぜ？: 4xx (認証エラー等) や 5xx (AIサーバーエラー) が発生したら、エラーとして扱います。
-        response.raise_for_status() 
-        print("  GCPからの要約取得に成功しました。")
-        return response.text
-    
-    except requests.exceptions.Timeout:
-        print(f"  エラー: GCPへのリクエストがタイムアウトしました（9分以上かかりました）。")
+        if GCP_STREAMING:
+            # なぜ？: 生成された分から順に受け取ることで、最初の出力までの時間が分かり、
+            # 途中で止まった生成も9分のタイムアウトを待たずに打ち切れます。
+            summary, stats = stream_from_gcp(data)
+            call.add(bytes_in=stats['bytes'])
+            if stats['ttfb'] is not None:
+                call.add(ttfb_seconds=stats['ttfb'])
+            if stats['streamed']:
+                ttfb = f"{stats['ttfb']:.1f}秒" if stats['ttfb'] is not None else "出力なし"
+                print(f"  GCPからの要約取得に成功しました。(最初の出力まで: {ttfb} / 合計: {stats['seconds']:.1f}秒)")
+            else:
+                print(f"  GCPからの要約取得に成功しました。(ストリーミング非対応の応答 / 合計: {stats['seconds']:.1f}秒)")
+        else:
+            # なぜ？: 共通クライアント経由で送り、接続の使い回しと大きなボディの gzip 圧縮を行います。
+            response = post_to_gcp(data)
+            # なぜ？: 4xx (認証エラー等) や 5xx (AIサーバーエラー) が発生したら、エラーとして扱います。
+            response.raise_for_status()
+            print("  GCPからの要約取得に成功しました。")
+            call.add(bytes_in=len(response.content))
+            summary = response.text
+        return summary
+
+    except requests.exceptions.Timeout as e:
+        call.add(errors=1, timeouts=1)
+        print(f"  エラー: GCPへのリクエストがタイムアウトしました: {e}")
         return None
     except requests.exceptions.RequestException as e:
+        call.add(errors=1)
         print(f"  エラー: GCPへのリクエスト中にエラーが発生しました: {e}")
         return None
 
-def split_text(text, limit):
+def get_summaries_batch_from_gcp(texts, prompt):
     """
-    長いテキストを、だいたいlimit文字ずつの「断片（チャンク）」に分割する関数
+    複数のテキストを1回のリクエストでGCPに送り、同じ順番の要約リストをもらう関数
+    （失敗した要素は None。キャッシュ済みの要素は送りません）
     """
-    print(f"  全文 (約{len(text)}文字) をチャンクに分割します...")
-    chunks = []
-    current_pos = 0
-    # なぜ？: text の最後まで limit (CHUNK_SIZE) ずつスライスしてリストに追加します。
-    while current_pos < len(text):
-        chunks.append(text[current_pos : current_pos + limit])
-        current_pos += limit
-    print(f"  {len(chunks)}個のチャンクに分割しました。")
-    return chunks
+    summaries = [None] * len(texts)
+    cache_keys = [cache_key_for(prompt, text) for text in texts]
+    missing = []
+    for i, text in enumerate(texts):
+        cached_summary = summary_cache.get(cache_keys[i])
+        if cached_summary:
+            summaries[i] = cached_summary
+        elif text and text.strip():
+            missing.append(i)
+    if not missing:
+        return summaries
 
+    print(f"  GCPのAIにバッチリクエストを送信します... ({len(missing)}件, 文字数: {sum(len(texts[i]) for i in missing)})")
+    batch_texts = [texts[i] for i in missing]
+    with metrics.span('gcp_batch_call', requests=1, items=len(missing),
+                      bytes_out=sum(len(text.encode('utf-8')) for text in batch_texts)) as call:
+        try:
+            response = post_to_gcp(gcp_payload(prompt, texts=batch_texts))
+            response.raise_for_status()
+            call.add(bytes_in=len(response.content))
+            results = response.json()['results']
+            # なぜ？: 形の違う応答で AttributeError が出て Map ステージごと止まらないよう、ここで確かめて
+            # 失敗として扱います (呼び出し側が1件ずつのリクエストに切り替えます)。
+            if not isinstance(results, list) or not all(isinstance(result, dict) for result in results):
+                raise TypeError(f"results が結果 (辞書) のリストではありません: {str(results)[:100]}")
+            if len(results) != len(missing):
+                raise ValueError(f"results の件数が違います ({len(results)}件 / 送信 {len(missing)}件)")
+            call.add(failed=sum(1 for result in results if not (result.get('ok') and result.get('summary'))))
+        except requests.exceptions.RequestException as e:
+            call.add(errors=1)
+            print(f"  エラー: GCPへのバッチリクエスト中にエラーが発生しました: {e}")
+            return summaries
+        except (ValueError, KeyError, TypeError) as e:
+            call.add(errors=1)
+            print(f"  エラー: GCPからのバッチレスポンスを解釈できませんでした: {e}")
+            return summaries
 
-def cleanup_note_data_file():
+    # なぜ？: バッチ内の1件が失敗しても他の結果は使えるため、要素ごとに成否を確認します。
+    for i, result in zip(missing, results):
+        if result.get('ok') and result.get('summary'):
+            summaries[i] = result['summary']
+            summary_cache.put(cache_keys[i], result['summary'])
+        else:
+            print(f"  バッチ内の {i+1}件目の要約に失敗しました: {result.get('error')}")
+    print(f"  GCPからのバッチ要約取得が完了しました。(成功: {sum(1 for i in missing if summaries[i])}/{len(missing)}件)")
+    return summaries
+
+def get_summary_with_retry(text, prompt, label=""):
+    """
+    get_summary_from_gcp を最大 GCP_MAX_RETRIES 回まで試行する関数
+    """
+    for attempt in range(GCP_MAX_RETRIES):
+        summary = get_summary_from_gcp(text, prompt)
+        if summary:
+            return summary
+        if attempt < GCP_MAX_RETRIES - 1:
+            # なぜ？: 一時的なエラー（5xx等）はしばらく待てば回復することが多いため、待ってから再送します。
+            print(f"  {label} 要約に失敗しました。{GCP_RETRY_WAIT_SECONDS}秒後に再試行します... ({attempt+1}/{GCP_MAX_RETRIES})")
+            time.sleep(GCP_RETRY_WAIT_SECONDS)
+    print(f"  {label} 最大リトライ回数 ({GCP_MAX_RETRIES}) に達しました。")
+    return None
+
+def summarize_step(text, prompt, label, checkpoint=None, step=None):
+    """
+    1ステップ分の要約を行う関数。チェックポイントに結果があればそれを使い、無ければ要約して保存する
+    """
+    if checkpoint is not None:
+        saved = checkpoint.load(step, text)
+        if saved:
+            print(f"  {label} はチェックポイントから再開します。")
+            return saved
+    summary = get_summary_with_retry(text, prompt, label)
+    if summary and checkpoint is not None:
+        checkpoint.save(step, text, summary)
+    return summary
+
+def summarize_batch_step(indices, chunks, prompt, label, checkpoint, step_prefix):
+    """
+    複数チャンクを1回のバッチリクエストで要約する関数。
+    チェックポイント済みのチャンクは送らず、バッチ内で失敗したチャンクだけ1件ずつ再試行します。
+    """
+    results = {}
+    missing = []
+    for index in indices:
+        saved = checkpoint.load(f"{step_prefix}_{index:05d}", chunks[index]) if checkpoint is not None else None
+        if saved:
+            print(f"  {label} {index+1}/{len(chunks)} はチェックポイントから再開します。")
+            results[index] = saved
+        else:
+            missing.append(index)
+
+    if missing:
+        print(f"  {label} {missing[0]+1}〜{missing[-1]+1}/{len(chunks)} をまとめて要約中...")
+        summaries = get_summaries_batch_from_gcp([chunks[index] for index in missing], prompt)
+        for index, summary in zip(missing, summaries):
+            item_label = f"{label} {index+1}/{len(chunks)}"
+            if not summary:
+                summary = get_summary_with_retry(chunks[index], prompt, item_label)
+            if summary and checkpoint is not None:
+                checkpoint.save(f"{step_prefix}_{index:05d}", chunks[index], summary)
+            results[index] = summary
+    return [results[index] for index in indices]
+
+def summarize_chunks(chunks, prompt, max_workers=None, label="チャンク", checkpoint=None, step_prefix="map",
+                     batch_size=None):
+    """
+    複数のチャンクを、同時実行数を制限したスレッドプールで並列に要約する関数 (Map)
+    戻り値は chunks と同じ順番の要約リスト（失敗したチャンクは None）
+    checkpoint を渡すと、各チャンクの結果を "{step_prefix}_{番号}" として保存・再利用します。
+    batch_size が2以上なら、その件数ずつ1回のリクエストにまとめて送ります。
+    max_workers を指定しない場合は、全ターゲットで共有するキュー (同時に MAX_CONCURRENT_REQUESTS 件まで) で要約します。
+    """
+    parallelism = max_workers or MAX_CONCURRENT_REQUESTS
+    if batch_size is None:
+        batch_size = GCP_BATCH_SIZE
+    if batch_size > 1 and len(chunks) > 1:
+        # なぜ？: チャンクごとのリクエストのオーバーヘッド（コールドスタートや呼び出し課金）を減らすため、
+        # 複数チャンクを1リクエストにまとめ、そのバッチを max_workers 並列で送ります。
+        batches = [list(range(i, min(i + batch_size, len(chunks)))) for i in range(0, len(chunks), batch_size)]
+        print(f"  {len(chunks)}個の{label}を{batch_size}件ずつ{len(batches)}バッチに分け、"
+              f"最大{min(parallelism, len(batches))}並列で要約します...")
+        batch_results = _run_parallel(
+            lambda indices: summarize_batch_step(indices, chunks, prompt, label, checkpoint, step_prefix),
+            batches, max_workers,
+        )
+        return [summary for batch in batch_results for summary in batch]
+
+    # なぜ？: 1回のGCP呼び出しは数分かかることがあり、順番に送ると全体で1時間以上かかります。
+    # I/O待ちが大半なのでスレッドで十分並列化でき、max_workers でGCPへの同時リクエスト数を抑えます。
+    if max_workers is not None:
+        max_workers = max(1, min(max_workers, len(chunks))) if chunks else 1
+    print(f"  {len(chunks)}個の{label}を最大{min(parallelism, len(chunks)) or 1}並列で要約します...")
+
+    def _summarize(index):
+        item_label = f"{label} {index+1}/{len(chunks)}"
+        print(f"  {item_label} を要約中...")
+        return summarize_step(chunks[index], prompt, item_label, checkpoint, f"{step_prefix}_{index:05d}")
+
+    return _run_parallel(_summarize, range(len(chunks)), max_workers)
+
+def group_by_budget(texts, limit, separator=SUMMARY_SEPARATOR, measure=len):
+    """
+    テキストのリストを、結合後の大きさ（既定は文字数）が limit 以内になるように順番を保ってグループ分けする関数
+    （1つだけで limit を超えるテキストは、単独のグループになります）
+    """
+    groups = []
+    current = []
+    current_size = 0
+    separator_size = measure(separator)
+    for text in texts:
+        text_size = measure(text)
+        added_size = text_size + (separator_size if current else 0)
+        if current and current_size + added_size > limit:
+            groups.append(current)
+            current = []
+            current_size = 0
+            added_size = text_size
+        current.append(text)
+        current_size += added_size
+    if current:
+        groups.append(current)
+    return groups
+
+def reduce_summaries(partial_summaries, checkpoint=None):
+    """
+    部分要約を階層的（ツリー状）に統合し、最終要約を生成する関数 (Reduce)
+    """
+    current = partial_summaries
+    depth = 0
+    if REDUCE_TOKEN_BUDGET:
+        limit, measure = REDUCE_TOKEN_BUDGET, estimate_tokens
+    else:
+        limit, measure = REDUCE_INPUT_LIMIT, len
+    # なぜ？: 全ての部分要約を1回で統合すると、繁忙日は入力が大きくなりすぎて失敗・遅延の原因になります。
+    # 上限に収まるまで「グループごとの中間要約」を繰り返し、兄弟グループは並列に要約します。
+    while measure(SUMMARY_SEPARATOR.join(current)) > limit and len(current) > 1:
+        if depth >= REDUCE_MAX_DEPTH:
+            print(f"  警告: Reduceの段数が上限 ({REDUCE_MAX_DEPTH}) に達したため、このまま最終要約を生成します。")
+            break
+        depth += 1
+        groups = group_by_budget(current, limit, measure=measure)
+        fan_out = max(len(group) for group in groups)
+        print(f"  Reduce 第{depth}段: {len(current)}個の要約を {len(groups)}グループに統合します (最大ファンアウト: {fan_out})")
+        reduced = summarize_chunks(
+            [SUMMARY_SEPARATOR.join(group) for group in groups], PROMPT_FOR_REDUCE,
+            label=f"第{depth}段グループ", checkpoint=checkpoint, step_prefix=f"reduce_L{depth}",
+        )
+
+        next_level = []
+        for group, summary in zip(groups, reduced):
+            if summary:
+                next_level.append(summary)
+            else:
+                # なぜ？: 中間要約に失敗したグループの内容を捨てないよう、元の要約を次の段に持ち越します。
+                print(f"  警告: 中間要約に失敗したグループ ({len(group)}個) を次の段に持ち越します。")
+                next_level.extend(group)
+        current = next_level
+
+    print(f"  Reduce 最終段: {len(current)}個の要約を統合して最終要約を生成します (ツリーの深さ: {depth + 1})")
+    # なぜ？: 最終要約も共有キューを通し、他のターゲットの要約と合わせた同時リクエスト数の上限を守ります。
+    return gcp_queue().submit(
+        metrics.bind(summarize_step), SUMMARY_SEPARATOR.join(current), PROMPT_FOR_FINAL, "最終要約", checkpoint, "final",
+    ).result()
+
+def finalize_report(final_summary, checkpoint=None):
     """
-    要約が完了した後、使用済みのノート蓄積ファイルをバックアップ（リネーム）する
+    最終要約を投稿の文字数制限に収める関数。まずローカルで縮め、それでも収まらない場合だけ AI に短くし直してもらう
     """
-    print(f"  クリーンアップ: ノート蓄積ファイルをバックアップします...")
+    budget = report_budget()
+    fitted = fit_report(final_summary, budget)
+    if fitted is not None:
+        if fitted != final_summary:
+            print(f"  最終要約 ({len(final_summary)}文字) を、優先度の低いセクションを削って {len(fitted)}文字に収めました。")
+        return fitted
+    # なぜ？: 主要なセクションまで削らないと収まらないほど長い場合だけ、短い再要約を1回だけ依頼します。
+    print(f"  最終要約 ({len(final_summary)}文字) がローカルでは {budget}文字に収まらないため、AIに短くし直してもらいます...")
+    prompt = PROMPT_FOR_SHORTEN.replace("[文字数]", str(int(budget * 0.85)))
+    shortened = gcp_queue().submit(
+        metrics.bind(summarize_step), final_summary, prompt, "最終要約の短縮", checkpoint, "shorten",
+    ).result()
+    if shortened:
+        fitted = fit_report(shortened, budget)
+        if fitted is not None:
+            return fitted
+        final_summary = shortened
+    print(f"  警告: 最終要約を {budget}文字に収められなかったため、後ろから切り詰めます。")
+    return hard_fit(final_summary, budget)
+
+def iter_pending_chunks(store, until=None, max_rowid=None):
+    """
+    ストア内の未要約ノートを時刻順に整形し、ノート単位で CHUNK_SIZE 以内
+    （CHUNK_TOKEN_BUDGET を設定した場合は、そのトークン数以内）のチャンクにして返すジェネレータ
+    """
+    rows = store.iter_notes(until=until, pending_only=True, max_rowid=max_rowid)
+    if needs_sampling(store, until, max_rowid):
+        # なぜ？: numpy は重いライブラリなので、絞り込みが必要な日だけ読み込みます。
+        from note_ranker import select_salient_rows
+        rows = select_salient_rows(list(rows), SALIENCE_MAX_NOTES)
+
+    if CHUNK_TOKEN_BUDGET:
+        limit, measure = CHUNK_TOKEN_BUDGET, estimate_tokens
+    else:
+        limit, measure = config.CHUNK_SIZE, len
+    joiner = COMPACT_JOINER if NOTE_COMPACTION else ENTRY_JOINER
+    compactor = NoteCompactor() if NOTE_COMPACTION else None
+    if CHUNK_TOKEN_BUDGET and compactor is None:
+        ensure_estimator_version(store)
+
+    if TOPIC_CLUSTERING:
+        # なぜ？: 時刻順に区切ると同じ話題が多くのチャンクに散らばり、何度も要約されてしまうため、
+        # 話題ごとにまとめてからチャンクに詰めます。（1回のMapで1つの話題をまとめて読めます）
+        from note_clusterer import group_by_topic
+        groups = (_iter_sized_entries(store, group, compactor, measure) for group in group_by_topic(list(rows)))
+        chunks = iter_grouped_chunks(groups, limit, measure(joiner), joiner)
+    else:
+        chunks = iter_sized_chunks(_iter_sized_entries(store, rows, compactor, measure), limit, measure(joiner), joiner)
+    yield from chunks
+    if compactor is not None:
+        compactor.report()
+
+def needs_sampling(store, until=None, max_rowid=None):
+    """
+    未要約ノートが多すぎて、注目度による絞り込みが必要かどうか
+    """
+    # なぜ？: 最終レポートは約2900文字に収めるため、繁忙日に全ノートを要約しても時間と費用に見合いません。
+    return bool(SALIENCE_MAX_NOTES) and store.count_notes(until=until, pending_only=True, max_rowid=max_rowid) > SALIENCE_MAX_NOTES
+
+def chunks_depend_on_whole_day(store, until=None):
+    """
+    チャンクの分け方が1日分のノート全体で決まる（ノートが追加されると前のチャンクも変わる）かどうか
+    """
+    return TOPIC_CLUSTERING or needs_sampling(store, until)
+
+def _iter_sized_entries(store, rows, compactor, measure):
+    """
+    ノートを整形し、(整形済みノート, 大きさ) の組を返すジェネレータ
+    """
+    if compactor is not None:
+        # なぜ？: 圧縮後の1行は複数ノートをまとめたものになるため、ノートごとのトークン数キャッシュは使わず直接見積もります。
+        for entry in compactor.iter_entries(rows):
+            yield entry, measure(entry)
+        return
+    if measure is len:
+        for row in rows:
+            entry = format_note_entry(row)
+            yield entry, len(entry)
+        return
+
+    # なぜ？: トークン数の見積もりはノートごとにストアへ保存し、次回からは計算し直しません。
+    new_counts = []
+    for row in rows:
+        entry = format_note_entry(row)
+        tokens = row['token_count']
+        if tokens is None:
+            tokens = estimate_tokens(entry)
+            new_counts.append((row['id'], tokens))
+        yield entry, tokens
+    # なぜ？: 読み出し中のカーソルと同じ接続で更新しないよう、読み終わってからまとめて保存します。
+    if new_counts:
+        store.set_token_counts(new_counts)
+
+def mark_notes_summarized(store, until, max_rowid=None):
+    """
+    要約が完了した後、要約に使ったノートを「要約済み」にして、次の日の要約対象から外す
+    """
+    print(f"  クリーンアップ: 要約に使ったノートを要約済みにします...")
     try:
-        if os.path.exists(config.NOTE_DATA_FILE_PATH):
-            # なぜ？: 削除(os.remove)するとデータが消えてしまいます。
-            # デバッグ用に昨日の日付を付けてリネーム(os.rename)し、過去ログとして残します。
-            yesterday = datetime.now() - timedelta(days=1)
-            backup_name = config.NOTE_DATA_FILE_PATH + f".bak_{yesterday.strftime('%Y%m%d')}"
-            os.rename(config.NOTE_DATA_FILE_PATH, backup_name)
-            print(f"  '{config.NOTE_DATA_FILE_PATH}' を '{backup_name}' にバックアップしました。")
+        # なぜ？: ノートは削除せずストアに残し、どの日の要約に使ったか (batch) を記録しておきます。
+        yesterday = datetime.now() - timedelta(days=1)
+        batch = yesterday.strftime('%Y%m%d')
+        marked = store.mark_summarized(batch, until, max_rowid)
+        print(f"  {marked} 件のノートを要約済み (batch: {batch}) にしました。")
     except Exception as e:
-        print(f"  ノートファイルのクリーンアップ中にエラー: {e}")
+        print(f"  ノートストアのクリーンアップ中にエラー: {e}")
 
 def execute_summarize():
     """
-    ノートを読み込み、MapReduce方式で要約を実行するメイン関数
+    全ターゲットについて要約を実行する（ターゲットが複数ある場合は同時に要約します）
+    """
+    # なぜ？: 各ターゲットのGCPへのリクエストは共有キューに入るため、同時に要約しても全体の同時実行数は増えません。
+    # 1つのターゲットの Reduce を待つ間も、他のターゲットの Map でキューを埋めておけます。
+    # なぜ？: 要約キャッシュは全ターゲットで共有するため、古いエントリの削除は始める前に1回だけ行います。
+    summary_cache.evict()
+    return targets.run_all(summarize_target, concurrent=True)
+
+def summarize_target():
+    """
+    今のターゲットのノートを読み込み、MapReduce方式で要約を実行するメイン関数
     """
+    # なぜ？: 日中の逐次要約 (rolling_summarize.py) が実行中なら、終わるのを待ってから始めます。
+    # 同じチャンクを二重にAIへ送らず、逐次要約の結果をチェックポイントから再利用できます。
+    metrics.begin('summarize')
+    try:
+        with pipeline_lock(targets.current().pipeline_lock_path):
+            return _execute_summarize_locked()
+    finally:
+        metrics.flush()
+
+def _execute_summarize_locked():
     print("==============================================")
     print(f"Misskey要約ボット【要約バッチ】開始: {datetime.now()}")
     print("==============================================")
     
+    target = targets.current()
     final_summary = None # 成功したか判定するために、先んじて変数を定義
+    # なぜ？: 途中で失敗しても、完了済みのチャンク要約・Reduce結果を次回の実行で再利用できるよう、
+    # ノートストアの隣のディレクトリに1ステップずつ保存します。
+    checkpoint = SummarizeCheckpoint(target.checkpoint_dir)
+    store = None
+    max_rowid = None
+    # なぜ？: 要約中も収集は続くため、開始時刻までに投稿されたノートだけを今回の要約対象にします。
+    until = utc_timestamp()
     try:
-        # 1. 蓄積されたノートテキストを読み込む
-        # なぜ？: config.py のパス設定を読み込みます。'bot/data/daily_notes.txt' を探します。
-        if not os.path.exists(config.NOTE_DATA_FILE_PATH):
-            print(f"  エラー: ノートファイル '{config.NOTE_DATA_FILE_PATH}' が見つかりません。")
+        # 1. 蓄積されたノートストアを開く
+        # なぜ？: ターゲットごとのノートストア (既定は config.py の 'bot/data/notes.sqlite3') を開きます。
+        if target.legacy_note_data_file_path and os.path.exists(target.legacy_note_data_file_path):
+            # なぜ？: 旧バージョンから更新した直後は、前回の要約以降に集めたノートが daily_notes.txt に残っているため、
+            # 今回の要約に含まれるよう、読み出す前にストアへ取り込みます (1回だけ。取り込んだファイルは名前を変えます)。
+            os.makedirs(target.data_dir, exist_ok=True)
+            with NoteStore(target.note_store_path) as legacy_store:
+                imported = import_legacy_note_file(legacy_store, target.legacy_note_data_file_path)
+            print(f"  旧形式のノートファイル '{target.legacy_note_data_file_path}' から {imported}件をストアに取り込みました。")
+        if not os.path.exists(target.note_store_path):
+            print(f"  エラー: ノートストア '{target.note_store_path}' が見つかりません。")
             return False
+        store = NoteStore(target.note_store_path)
+        # なぜ？: 収集は要約のロックを取らずに続き、15分前までのノート (created_at <= until) を要約中にも追加します。
+        # 読み出した後に追加されたノートを要約済みにしないよう、今ある行 (rowid) までを今回の対象にします。
+        max_rowid = store.max_rowid()
 
-        with open(config.NOTE_DATA_FILE_PATH, 'r', encoding='utf-8') as f:
-            notes_text = f.read()
+        # 2. [Map] ノート単位でチャンクに分割し、それぞれを「部分要約」
+        # なぜ？: 固定幅で切るとノートが途中で分断されるため、ノートを丸ごと詰めたチャンクを作ります。
+        # ストアからは少しずつ読み出して整形するので、全ノートを1つの文字列にまとめることはありません。
+        chunk_limit = f"{CHUNK_TOKEN_BUDGET}トークン" if CHUNK_TOKEN_BUDGET else f"{config.CHUNK_SIZE}文字"
+        print(f"  未要約のノートをノート単位でチャンクに分割します (上限: {chunk_limit})...")
+        with metrics.span('chunk') as chunking:
+            chunks = list(iter_pending_chunks(store, until, max_rowid))
+            chunking.add(chunks=len(chunks), bytes=sum(len(chunk.encode('utf-8')) for chunk in chunks))
 
-        # なぜ？: 中身が空のファイルをAIに送っても無駄なため、ここで終了します。
-        if not notes_text.strip():
-            print(f"  エラー: ノートファイルは空でした。")
+        # なぜ？: 要約対象のノートが無いのにAIへ送っても無駄なため、ここで終了します。
+        if not chunks:
+            print(f"  エラー: 未要約のノートがありませんでした。")
             return False
+        print(f"  {len(chunks)}個のチャンクに分割しました。")
+        # なぜ？: AIへ送り始める前に、今回どれだけのトークン数・費用がかかりそうかをログに残します。
+        report_plan(chunks, MAP_PROMPT, PROMPT_FOR_REDUCE, PROMPT_FOR_FINAL, REDUCE_TOKEN_BUDGET or REDUCE_INPUT_LIMIT)
 
-        # 2. [Map] チャンクに分割し、それぞれを「部分要約」
-        chunks = split_text(notes_text, config.CHUNK_SIZE)
-        partial_summaries = []
-        
-        for i, chunk in enumerate(chunks):
-            print(f"  チャンク {i+1}/{len(chunks)} を要約中...")
-            partial_summary = get_summary_from_gcp(chunk, PROMPT_FOR_CHUNK)
-            if partial_summary:
-                partial_summaries.append(partial_summary)
+        with metrics.span('map', chunks=len(chunks)) as mapping:
+            partial_summaries = [
+                summary for summary in summarize_chunks(chunks, MAP_PROMPT, checkpoint=checkpoint) if summary
+            ]
+            mapping.add(summarized=len(partial_summaries))
 
         # なぜ？: AIが全チャンクの要約に失敗した場合、最終要約が作れないため中断します。
         if not partial_summaries:
@@ -148,17 +685,24 @@ def execute_summarize():
 
         # 3. [Reduce] 「部分要約」を結合し、「最終要約」を生成
         print(f"  全ての断片を結合して、最終的な要約を生成します...")
-        combined_summary_text = "\n\n--- (次の断片の要約) ---\n\n".join(partial_summaries)
-        final_summary = get_summary_from_gcp(combined_summary_text, PROMPT_FOR_FINAL)
+        with metrics.span('reduce', inputs=len(partial_summaries),
+                          bytes_in=sum(len(summary.encode('utf-8')) for summary in partial_summaries)) as reducing:
+            final_summary = reduce_summaries(partial_summaries, checkpoint)
+            reducing.add(bytes_out=len(final_summary.encode('utf-8')) if final_summary else 0)
 
         # なぜ？: AIが最終要約の生成に失敗した場合、投稿するファイルが作れないため中断します。
         if not final_summary:
             print(f"  エラー: 最終的な要約の生成に失敗しました。")
             return False
 
+        # なぜ？: 文字数を超えた要約は投稿できないため、保存する前に投稿の上限に収めておきます。
+        with metrics.span('fit', chars_in=len(final_summary)) as fitting:
+            final_summary = finalize_report(final_summary, checkpoint)
+            fitting.add(chars_out=len(final_summary))
+
         # 4. 最終要約をファイルに保存する
         # なぜ？: このファイルを、朝8時の post_note.py が読み取って投稿するためです。
-        with open(config.SUMMARY_DATA_FILE_PATH, 'w', encoding='utf-8') as f:
+        with open(target.summary_data_file_path, 'w', encoding='utf-8') as f:
             f.write(final_summary)
         
         print(f"[{datetime.now()}] 最終要約をファイルに保存しました。")
@@ -169,14 +713,24 @@ def execute_summarize():
         return False # 失敗を返す
     
     finally:
+        summary_cache.report()
+        if checkpoint.resumed:
+            print(f"  チェックポイントから {checkpoint.resumed}ステップ分の結果を再利用しました。")
+
         # 5. 後片付け
         # なぜ？: 'final_summary' に中身がある ＝ 処理が成功した場合のみ、
-        # 収集ファイルをバックアップし、次の日の収集に備えます。
-        if final_summary:
-            cleanup_note_data_file()
+        # 使ったノートを要約済みにし、次の日の要約に備えます。
+        if final_summary and store is not None:
+            checkpoint.clear()
+            mark_notes_summarized(store, until, max_rowid)
+            if ARCHIVE_ROTATION:
+                # なぜ？: 要約済みのノートをストアに残し続けると際限なく大きくなるため、古い日は圧縮してアーカイブへ移します。
+                rotate_archive(store)
             print(f"[{datetime.now()}] 要約処理がすべて完了しました。")
         else:
-            print(f"[{datetime.now()}] 要約処理は失敗しました。収集ファイルはバックアップされません。")
+            print(f"[{datetime.now()}] 要約処理は失敗しました。ノートは未要約のまま残ります。")
+        if store is not None:
+            store.close()
         
         print("==============================================")
 
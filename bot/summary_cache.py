@@ -0,0 +1,105 @@
+# 【ファイル名: bot/summary_cache.py】
+# (GCPの要約結果を、入力内容のハッシュをキーにしてディスクへ保存するキャッシュ)
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class SummaryCache:
+    """
+    (プロンプト, テキスト, モデル設定) が同じリクエストの要約結果を再利用するためのキャッシュ
+    """
+
+    def __init__(self, cache_dir, max_age_seconds, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # なぜ？: Mapステージは複数スレッドから同時に呼ばれるため、カウンタの更新を保護します。
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(prompt, text, params=None):
+        """
+        リクエスト内容から、キャッシュのキー（SHA-256）を作る
+        """
+        payload = json.dumps(
+            {'prompt': prompt, 'text': text, 'params': params},
+            ensure_ascii=False, sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        # なぜ？: 1つのディレクトリにファイルが集中しすぎないよう、キーの先頭2文字で振り分けます。
+        return os.path.join(self.cache_dir, key[:2], f"{key}.txt")
+
+    def get(self, key):
+        """
+        キャッシュ済みの要約を返す。無ければ None
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                summary = f.read()
+            # なぜ？: 使われたエントリの更新時刻を新しくし、容量超過時に古い順（LRU）で消せるようにします。
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return summary
+
+    def put(self, key, summary):
+        """
+        要約をキャッシュに保存する（途中で落ちても壊れたファイルが残らないよう、一時ファイル経由で置き換えます）
+        """
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(summary)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"  警告: 要約キャッシュの保存に失敗しました: {e}")
+
+    def evict(self):
+        """
+        期限切れのエントリを削除し、合計サイズが上限を超えていれば古い順に削除する
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        now = time.time()
+        entries = []
+        removed = 0
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if now - stat.st_mtime > self.max_age_seconds:
+                    os.remove(path)
+                    removed += 1
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(path)
+            total_bytes -= size
+            removed += 1
+        if removed:
+            print(f"  要約キャッシュ: {removed}件の古いエントリを削除しました。(残り {total_bytes} bytes)")
+
+    def report(self):
+        print(f"  要約キャッシュ: ヒット {self.hits}件 / ミス {self.misses}件")
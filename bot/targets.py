@@ -0,0 +1,219 @@
+# 【ファイル名: bot/targets.py】
+# (要約の対象 (ターゲット) = Misskey サーバー・タイムライン・投稿アカウント・ノートストアの組を管理する)
+#
+# config.py に TARGETS を書くと、1つのデプロイで複数のサーバー・タイムラインを収集・要約・投稿できます。
+# TARGETS が無い場合は、従来の MISSKEY_URL / MISSKEY_TOKEN / NOTE_STORE_PATH 等をそのまま使う1つのターゲットになります。
+#
+# 各スクリプトは「今のターゲット」 (current()) の設定で動きます。run_all() が全ターゲットについて順に
+# (または同時に) 切り替えながら実行するので、cron やスケジューラーのジョブは1つのままで済みます。
+
+import contextvars
+import os
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+import config
+from clients import MisskeyClient
+
+DEFAULT_TARGET_NAME = 'default'
+# 収集・要約などを全ターゲットで同時に実行するときの、同時に処理するターゲット数の上限
+TARGET_MAX_CONCURRENCY = getattr(config, 'TARGET_MAX_CONCURRENCY', 8)
+
+# タイムライン -> (REST API のエンドポイント, ストリーミングのチャンネル)
+TIMELINES = {
+    'local': ('notes/local-timeline', 'localTimeline'),
+    'hybrid': ('notes/hybrid-timeline', 'hybridTimeline'),
+    'global': ('notes/global-timeline', 'globalTimeline'),
+}
+
+
+class Target:
+    """
+    要約の対象1つ分の設定 (接続先・アカウント・除外ユーザー・タイムライン・データの置き場所)
+    """
+
+    def __init__(self, name, misskey_url, misskey_token, exclude_user_id=None, timeline='local', data_dir=None,
+                 note_store_path=None, summary_data_file_path=None, last_post_id_file_path=None, archive_dir=None,
+                 legacy_note_data_file_path=None):
+        if timeline not in TIMELINES:
+            raise ValueError(f"ターゲット '{name}' のタイムライン '{timeline}' は不明です。({', '.join(TIMELINES)} のいずれか)")
+        self.name = name
+        self.misskey_url = misskey_url
+        self.misskey_token = misskey_token
+        self.exclude_user_id = exclude_user_id
+        self.timeline = timeline
+        self.data_dir = data_dir or os.path.join(config.DATA_DIR, "targets", name)
+        self.note_store_path = note_store_path or os.path.join(self.data_dir, "notes.sqlite3")
+        self.summary_data_file_path = summary_data_file_path or os.path.join(self.data_dir, "summary_for_today.txt")
+        self.last_post_id_file_path = last_post_id_file_path or os.path.join(self.data_dir, "last_post_id.txt")
+        self.archive_dir = archive_dir or os.path.join(self.data_dir, "archive")
+        # 旧バージョンのノート蓄積ファイル (daily_notes.txt)。複数ターゲットに対応する前の構成にだけあります
+        self.legacy_note_data_file_path = legacy_note_data_file_path
+
+    @property
+    def timeline_endpoint(self):
+        return TIMELINES[self.timeline][0]
+
+    @property
+    def streaming_channel(self):
+        return TIMELINES[self.timeline][1]
+
+    # なぜ？: チェックポイントとロックはノートストアの隣に置くため、ターゲットごとに別になります。
+    @property
+    def checkpoint_dir(self):
+        return self.note_store_path + ".checkpoint"
+
+    @property
+    def pipeline_lock_path(self):
+        return self.note_store_path + ".lock"
+
+    def client(self):
+        """
+        このターゲットのアカウントで MisskeyClient を作る（接続は全ターゲットで共有します）
+        """
+        return MisskeyClient(self.misskey_url, self.misskey_token)
+
+
+def _default_target():
+    # なぜ？: TARGETS を書いていない既存の config.py でも、今までと同じファイルをそのまま使います。
+    return Target(
+        DEFAULT_TARGET_NAME,
+        getattr(config, 'MISSKEY_URL', None),
+        getattr(config, 'MISSKEY_TOKEN', None),
+        exclude_user_id=getattr(config, 'EXCLUDE_USER_ID', None),
+        data_dir=config.DATA_DIR,
+        note_store_path=getattr(config, 'NOTE_STORE_PATH', None),
+        summary_data_file_path=getattr(config, 'SUMMARY_DATA_FILE_PATH', None),
+        last_post_id_file_path=getattr(config, 'LAST_POST_ID_FILE_PATH', None),
+        archive_dir=getattr(config, 'ARCHIVE_DIR', None),
+        legacy_note_data_file_path=getattr(config, 'NOTE_DATA_FILE_PATH', os.path.join(config.DATA_DIR, "daily_notes.txt")),
+    )
+
+
+def load_targets():
+    """
+    config.py の TARGETS からターゲットの一覧を作る（無ければ従来の設定の1つだけ）
+    """
+    entries = getattr(config, 'TARGETS', None)
+    if not entries:
+        return [_default_target()]
+    targets = [Target(**entry) for entry in entries]
+    names = [target.name for target in targets]
+    if len(set(names)) != len(names):
+        raise ValueError(f"TARGETS の name が重複しています: {names}")
+    return targets
+
+
+TARGETS = load_targets()
+_current_target = contextvars.ContextVar('target', default=None)
+
+
+def current():
+    """
+    今のターゲット (run_all / use の中ではそのターゲット、それ以外は最初のターゲット)
+    """
+    return _current_target.get() or TARGETS[0]
+
+
+def find(name):
+    for target in TARGETS:
+        if target.name == name:
+            return target
+    raise KeyError(f"ターゲット '{name}' は TARGETS にありません。({', '.join(t.name for t in TARGETS)})")
+
+
+@contextmanager
+def use(target):
+    """
+    with の中を target の設定で実行する
+    """
+    token = _current_target.set(target)
+    try:
+        yield target
+    finally:
+        _current_target.reset(token)
+
+
+class _TargetPrefixedOutput:
+    """
+    print の出力を1行ずつまとめ、行頭にターゲット名を付けて書き出す（複数ターゲットを同時に処理するときのログ用）
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def write(self, text):
+        # なぜ？: print は本文と改行を別々に書き込むため、スレッドごとに行が揃うまで溜めてから書き出します。
+        # （同時に動く他のターゲットのログと、1行の途中で混ざらないようにします）
+        buffered = getattr(self.local, 'buffer', '') + text
+        *lines, self.local.buffer = buffered.split('\n')
+        self._write_lines(lines)
+        return len(text)
+
+    def _write_lines(self, lines):
+        if lines:
+            target = _current_target.get()
+            prefix = f"[{target.name}] " if target is not None else ""
+            with self.lock:
+                self.stream.write(''.join(prefix + line + '\n' for line in lines))
+
+    def flush(self):
+        # なぜ？: 改行で終わらない出力 (print(..., end='') など) が溜まったまま失われないよう、
+        # このスレッドの書きかけの行も行頭にターゲット名を付けて1行として書き出します。
+        partial = getattr(self.local, 'buffer', '')
+        self.local.buffer = ''
+        if partial:
+            self._write_lines([partial])
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def prefix_output():
+    """
+    以後の print の出力の行頭に、今のターゲット名を付ける
+    """
+    if not isinstance(sys.stdout, _TargetPrefixedOutput):
+        sys.stdout = _TargetPrefixedOutput(sys.stdout)
+
+
+def _run_one(function, target):
+    with use(target):
+        try:
+            return function() is not False
+        except Exception:
+            print(f"[{datetime.now()}] ターゲット '{target.name}' の処理中に予期せぬエラーが発生しました:")
+            print(traceback.format_exc())
+            return False
+        finally:
+            # なぜ？: スレッドは次のターゲットにも使い回されるため、書きかけの行はこのターゲットの名前で書き出しておきます。
+            if isinstance(sys.stdout, _TargetPrefixedOutput):
+                sys.stdout.flush()
+
+
+def run_all(function, concurrent=False, targets=None):
+    """
+    全ターゲットについて、そのターゲットの設定で function() を実行する。
+    1つでも失敗 (False を返す・例外) したら False を返します（他のターゲットは最後まで実行します）
+    """
+    targets = targets or TARGETS
+    if len(targets) == 1:
+        return _run_one(function, targets[0])
+    prefix_output()
+    if not concurrent:
+        return all([_run_one(function, target) for target in targets])
+    # なぜ？: 収集などの待ち時間の大半は各サーバーの応答待ちなので、ターゲットごとのスレッドで同時に進めます。
+    # GCP への要約リクエストは summarize.py の共有キューで全ターゲット合わせて同時実行数・頻度を抑えます。
+    with ThreadPoolExecutor(max_workers=min(TARGET_MAX_CONCURRENCY, len(targets)),
+                            thread_name_prefix='target') as executor:
+        results = list(executor.map(
+            lambda target: contextvars.copy_context().run(_run_one, function, target), targets
+        ))
+    return all(results)
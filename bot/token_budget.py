@@ -0,0 +1,142 @@
+# 【ファイル名: bot/token_budget.py】
+# (チャンクの大きさを「トークン数」で見積もり、要約バッチ全体のトークン数と費用を事前に計算する)
+
+import math
+import re
+
+import requests
+
+import config
+from clients import post_to_gcp
+
+# --- トークン数の見積もり設定 ---
+# なぜ？: Gemini の制限と課金はトークン単位ですが、日本語と "=========" のようなASCIIの枠では
+# 1文字あたりのトークン数が大きく違うため、文字の種類ごとに分けて見積もります。
+ASCII_CHARS_PER_TOKEN = getattr(config, 'ASCII_CHARS_PER_TOKEN', 4.0)
+TOKENS_PER_NON_ASCII_CHAR = getattr(config, 'TOKENS_PER_NON_ASCII_CHAR', 1.0)
+# "local" ならローカルの見積もりだけ、"vertex" なら Cloud Function 経由の count_tokens で実数も確認します
+TOKEN_COUNT_MODE = getattr(config, 'TOKEN_COUNT_MODE', 'local')
+COUNT_TOKENS_BATCH_SIZE = 32
+
+# --- 費用の見積もり設定 (100万トークンあたりの米ドル) ---
+TOKEN_PRICE_INPUT_PER_MILLION = getattr(config, 'TOKEN_PRICE_INPUT_PER_MILLION', 0.30)
+TOKEN_PRICE_OUTPUT_PER_MILLION = getattr(config, 'TOKEN_PRICE_OUTPUT_PER_MILLION', 2.50)
+# 1回の部分要約・最終要約で出力されるおおよそのトークン数 (Reduce の段数の見積もりに使います)
+MAP_OUTPUT_TOKENS_ESTIMATE = getattr(config, 'MAP_OUTPUT_TOKENS_ESTIMATE', 800)
+FINAL_OUTPUT_TOKENS_ESTIMATE = 2000
+
+# なぜ？: 見積もりの係数やノートの整形 (format_note_entry) を変えたら、ストアに保存済みのノートごとの見積もりも
+# 作り直す必要があるため、係数を含めた「見積もり方の版」をストアに記録しておきます。
+ESTIMATOR_VERSION = f"v2:{ASCII_CHARS_PER_TOKEN}:{TOKENS_PER_NON_ASCII_CHAR}"
+ESTIMATOR_VERSION_KEY = 'token_estimator_version'
+
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
+def estimate_tokens(text):
+    """
+    テキストのおおよそのトークン数をローカルで見積もる（通信しないので、全ノートに使えます）
+    """
+    if not text:
+        return 0
+    non_ascii = len(_NON_ASCII.findall(text))
+    ascii_chars = len(text) - non_ascii
+    return math.ceil(ascii_chars / ASCII_CHARS_PER_TOKEN + non_ascii * TOKENS_PER_NON_ASCII_CHAR)
+
+
+def ensure_estimator_version(store):
+    """
+    ストアに保存済みのノートごとの見積もりが、今の係数で作られたものか確認し、違えば捨てる
+    """
+    if store.get_meta(ESTIMATOR_VERSION_KEY) != ESTIMATOR_VERSION:
+        store.reset_token_counts()
+        store.set_meta(ESTIMATOR_VERSION_KEY, ESTIMATOR_VERSION)
+
+
+def count_tokens_remote(texts):
+    """
+    Cloud Function 経由で Vertex AI の count_tokens を呼び、texts と同じ順番のトークン数を返す。
+    失敗した場合は None
+    """
+    counts = []
+    try:
+        for start in range(0, len(texts), COUNT_TOKENS_BATCH_SIZE):
+            response = post_to_gcp({'count_tokens': True, 'texts': texts[start:start + COUNT_TOKENS_BATCH_SIZE]})
+            response.raise_for_status()
+            counts.extend(response.json()['tokens'])
+    except requests.exceptions.RequestException as e:
+        print(f"  警告: count_tokens の呼び出しに失敗しました: {e}")
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"  警告: count_tokens のレスポンスを解釈できませんでした: {e}")
+        return None
+    return counts
+
+
+def estimate_reduce_plan(map_calls, reduce_budget, reduce_prompt_tokens, final_prompt_tokens):
+    """
+    部分要約の数から、Reduce の呼び出し回数と入出力トークン数を見積もる
+    （実際の部分要約の長さは要約してみるまで分からないため、MAP_OUTPUT_TOKENS_ESTIMATE を使います）
+    """
+    calls = 0
+    input_tokens = 0
+    output_tokens = 0
+    count = map_calls
+    total = count * MAP_OUTPUT_TOKENS_ESTIMATE
+    while reduce_budget and total > reduce_budget and count > 1:
+        groups = max(1, math.ceil(total / reduce_budget))
+        calls += groups
+        input_tokens += total + groups * reduce_prompt_tokens
+        output_tokens += groups * MAP_OUTPUT_TOKENS_ESTIMATE
+        count = groups
+        total = groups * MAP_OUTPUT_TOKENS_ESTIMATE
+    calls += 1
+    input_tokens += total + final_prompt_tokens
+    output_tokens += FINAL_OUTPUT_TOKENS_ESTIMATE
+    return calls, input_tokens, output_tokens
+
+
+def estimate_cost(input_tokens, output_tokens):
+    return (input_tokens * TOKEN_PRICE_INPUT_PER_MILLION + output_tokens * TOKEN_PRICE_OUTPUT_PER_MILLION) / 1_000_000
+
+
+def report_plan(chunks, map_prompt, reduce_prompt, final_prompt, reduce_budget):
+    """
+    AIへ何も送る前に、今回の要約バッチの予定トークン数と費用の見積もりを表示する。
+    戻り値は見積もりの辞書
+    """
+    map_prompt_tokens = estimate_tokens(map_prompt)
+    chunk_tokens = [estimate_tokens(chunk) for chunk in chunks]
+    source = "ローカル見積もり"
+    if TOKEN_COUNT_MODE == 'vertex' and chunks:
+        # なぜ？: ローカルの見積もりは係数による近似なので、実際のトークン数と比べてずれを確認できるようにします。
+        counted = count_tokens_remote(list(chunks))
+        if counted is not None:
+            estimated_total = sum(chunk_tokens)
+            counted_total = sum(counted)
+            if counted_total:
+                print(f"  トークン数の確認: 見積もり {estimated_total:,} / 実数 {counted_total:,} "
+                      f"(見積もり/実数: {estimated_total / counted_total:.2f})")
+            chunk_tokens = counted
+            source = "count_tokens"
+
+    map_input = sum(chunk_tokens) + map_prompt_tokens * len(chunks)
+    map_output = MAP_OUTPUT_TOKENS_ESTIMATE * len(chunks)
+    reduce_calls, reduce_input, reduce_output = estimate_reduce_plan(
+        len(chunks), reduce_budget, estimate_tokens(reduce_prompt), estimate_tokens(final_prompt),
+    )
+    plan = {
+        'map_calls': len(chunks),
+        'map_input_tokens': map_input,
+        'max_chunk_tokens': max(chunk_tokens) if chunk_tokens else 0,
+        'reduce_calls': reduce_calls,
+        'input_tokens': map_input + reduce_input,
+        'output_tokens': map_output + reduce_output,
+    }
+    plan['cost_usd'] = estimate_cost(plan['input_tokens'], plan['output_tokens'])
+    print(f"  --- 実行計画 ({source}) ---")
+    print(f"  Map: {plan['map_calls']}回 / 入力 {map_input:,}トークン (最大チャンク: {plan['max_chunk_tokens']:,}トークン)")
+    print(f"  Reduce (見積もり): {reduce_calls}回 / 入力 {reduce_input:,}トークン")
+    print(f"  合計 (見積もり): 入力 {plan['input_tokens']:,} / 出力 {plan['output_tokens']:,}トークン"
+          f" / 費用 約${plan['cost_usd']:.4f}")
+    return plan
@@ -2,66 +2,299 @@
 # (最終確定版: Gemini 2.5 Flash @ us-central1)
 
 import os
+import gzip
+import hashlib
+import importlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import functions_framework
-
-# 正しいGemini SDK（GenerativeModel）
-import vertexai
-from vertexai.generative_models import GenerativeModel
+from flask import Response
 
 # --- AIモデルの初期化 ---
-try:
-    # ★ リージョンは、Gemini 2.5 が確実にある「us-central1」を指定
-    PROJECT_ID = "sushisuki-summarizer-v2"
-    LOCATION = "us-central1"
+# ★ リージョンは、Gemini 2.5 が確実にある「us-central1」を指定
+PROJECT_ID = "sushisuki-summarizer-v2"
+LOCATION = "us-central1"
+# ★ しなりさんのGCPで利用可能な、最新の「2.5 Flash」を指定
+MODEL_NAME = "gemini-2.5-flash"
+# 初期化に失敗した後、次に初期化を試みるまでの秒数
+MODEL_INIT_RETRY_SECONDS = float(os.environ.get("MODEL_INIT_RETRY_SECONDS", "10"))
+# ローカルでの確認用: "モジュール:関数" を指定すると、Vertex AI の代わりにその関数が返すモデルを使う
+# (例: bench/check_cloud_function.py が偽のモデルを使うために指定します)
+MODEL_FACTORY = os.environ.get("MODEL_FACTORY")
+
+_model = None
+_model_lock = threading.Lock()
+_model_retry_at = 0.0
+
+def create_model():
+    """
+    AIモデルを作る（Vertex AI の SDK はここで初めて読み込みます）
+    """
+    if MODEL_FACTORY:
+        module_name, function_name = MODEL_FACTORY.split(":")
+        return getattr(importlib.import_module(module_name), function_name)()
+    # 正しいGemini SDK（GenerativeModel）
+    import vertexai
+    from vertexai.generative_models import GenerativeModel
+
     vertexai.init(project=PROJECT_ID, location=LOCATION)
+    return GenerativeModel(model_name=MODEL_NAME)
+
+def get_model():
+    """
+    AIモデルを返す。未初期化なら初期化し、失敗した場合は None を返す
+    """
+    global _model, _model_retry_at
+    if _model is not None:
+        return _model
+    # なぜ？: 以前は読み込み時に1回だけ初期化しており、一時的なエラーで失敗するとそのインスタンスが終わるまで
+    # 全リクエストが失敗していました。最初のリクエストで初期化し、失敗したら少し待ってから次のリクエストで再試行します。
+    with _model_lock:
+        if _model is None and time.monotonic() >= _model_retry_at:
+            try:
+                _model = create_model()
+                print(f"AIモデル ({MODEL_NAME} @ {LOCATION}) の初期化に成功しました。")
+            except Exception as e:
+                _model_retry_at = time.monotonic() + MODEL_INIT_RETRY_SECONDS
+                print(f"AIモデルの初期化中にエラーが発生 ({MODEL_INIT_RETRY_SECONDS:g}秒後以降のリクエストで再試行します): {e}")
+    return _model
+
+# --- 生成設定 ---
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "max_output_tokens": 8192,
+    "top_p": 1,
+    "top_k": 1
+}
+# リクエストの generation_config で上書きできる項目と、その範囲
+GENERATION_CONFIG_LIMITS = {
+    "temperature": (0.0, 2.0),
+    "max_output_tokens": (1, 8192),
+    "top_p": (0.0, 1.0),
+    "top_k": (1, 64),
+}
+
+def resolve_generation_config(requested):
+    """
+    リクエストの generation_config を既定の設定に重ねた生成設定を返す（不正な値なら ValueError）
+    """
+    if requested is None:
+        return GENERATION_CONFIG
+    if not isinstance(requested, dict):
+        raise ValueError("generation_configはオブジェクトにしてください。")
+    resolved = dict(GENERATION_CONFIG)
+    for key, value in requested.items():
+        if key not in GENERATION_CONFIG_LIMITS:
+            raise ValueError(f"generation_configの{key}は指定できません。({', '.join(GENERATION_CONFIG_LIMITS)} のみ)")
+        low, high = GENERATION_CONFIG_LIMITS[key]
+        integer = isinstance(low, int)
+        # なぜ？: 整数の項目に 1.5 などを渡されたとき、切り捨てて黙って受け付けず、他の不正な値と同じく 400 にします。
+        allowed_types = int if integer else (int, float)
+        if isinstance(value, bool) or not isinstance(value, allowed_types) or not low <= value <= high:
+            kind = "整数" if integer else "数値"
+            raise ValueError(f"generation_configの{key}は{low}〜{high}の{kind}にしてください。")
+        resolved[key] = value if integer else float(value)
+    return resolved
+
+# --- 応答のキャッシュ ---
+# インスタンス内に保持する要約の件数 (0 で無効)
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "256"))
+
+class ResponseCache:
+    """
+    プロンプト・テキスト・生成設定が同じリクエストの要約を、インスタンス内で新しい順に max_entries 件まで保持する (LRU)
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(prompt, text, generation_config):
+        material = json.dumps([prompt, text, generation_config], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            summary = self.entries.get(key)
+            if summary is not None:
+                self.entries.move_to_end(key)
+            return summary
+
+    def put(self, key, summary):
+        if self.max_entries <= 0 or not summary:
+            return
+        with self.lock:
+            self.entries[key] = summary
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+# なぜ？: Bot側はタイムアウトやエラーのたびに同じチャンクを再送するため、生成済みの要約はもう一度生成せずに返します。
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE)
+
+# バッチリクエストで、1インスタンス内から同時に Gemini を呼び出す最大数
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "8"))
+# 1回のバッチリクエストで受け付ける最大件数
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "32"))
+
+def generate_summary(prompt, text, generation_config=GENERATION_CONFIG):
+    """
+    プロンプトとテキストを結合して Gemini に要約させ、結果のテキストを返す（同じリクエストの要約はキャッシュから返す）
+    """
+    cache_key = ResponseCache.make_key(prompt, text, generation_config)
+    cached_summary = response_cache.get(cache_key)
+    if cached_summary is not None:
+        print(f"キャッシュ済みの要約を返します。(入力文字数: {len(text)}文字)")
+        return cached_summary
+
+    final_prompt = f"{prompt}\n\n{text}"
 
-    # ★ しなりさんのGCPで利用可能な、最新の「2.5 Flash」を指定
-    model = GenerativeModel(
-        model_name="gemini-2.5-flash"
+    print(f"AI要約を開始します... (入力文字数: {len(final_prompt)}文字 / 最大出力トークン: {generation_config['max_output_tokens']})")
+
+    # 正しい .generate_content() 呼び出し
+    response = get_model().generate_content(
+        final_prompt,
+        generation_config=generation_config
     )
-    
-    print("AIモデル (Gemini SDK: gemini-2.5-flash-latest @ us-central1) の初期化に成功しました。")
 
-except Exception as e:
-    print(f"AIモデルの初期化中に致命的なエラーが発生: {e}")
-    model = None
+    print("AI要約が正常に完了しました。")
+    response_cache.put(cache_key, response.text)
+    return response.text
+
+def stream_summary_events(prompt, text, generation_config=GENERATION_CONFIG):
+    """
+    Gemini のストリーミング生成を使い、生成された断片から順に NDJSON (1行1イベント) で返すジェネレータ
+      {"event": "start"} -> {"delta": "..."} の繰り返し -> {"done": true} または {"error": "..."}
+    """
+    # なぜ？: 生成が始まる前にまず1行送り、HTTPヘッダーをすぐに返してクライアント側の待ち時間を計れるようにします。
+    yield json.dumps({"event": "start"}) + "\n"
+    cache_key = ResponseCache.make_key(prompt, text, generation_config)
+    cached_summary = response_cache.get(cache_key)
+    if cached_summary is not None:
+        print(f"キャッシュ済みの要約を返します。(ストリーミング / 入力文字数: {len(text)}文字)")
+        yield json.dumps({"delta": cached_summary}, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True}) + "\n"
+        return
+    final_prompt = f"{prompt}\n\n{text}"
+    print(f"AI要約 (ストリーミング) を開始します... (入力文字数: {len(final_prompt)}文字 / 最大出力トークン: {generation_config['max_output_tokens']})")
+    try:
+        responses = get_model().generate_content(
+            final_prompt,
+            generation_config=generation_config,
+            stream=True
+        )
+        deltas = []
+        for response in responses:
+            # なぜ？: 安全フィルタ等で本文の無い断片が来ると .text が例外になるため、空として扱います。
+            try:
+                delta = response.text
+            except ValueError:
+                delta = ""
+            if delta:
+                deltas.append(delta)
+                yield json.dumps({"delta": delta}, ensure_ascii=False) + "\n"
+        print("AI要約 (ストリーミング) が正常に完了しました。")
+        # なぜ？: 途中でエラーになった生成は不完全なため、最後まで生成できた場合だけキャッシュします。
+        response_cache.put(cache_key, "".join(deltas))
+        yield json.dumps({"done": True}) + "\n"
+    except Exception as e:
+        # なぜ？: ヘッダー送信後はステータスコードを変えられないため、エラーもイベントとして伝えます。
+        print(f"ストリーミング生成中にエラーが発生: {e}")
+        yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+
+def summarize_batch(prompt, texts, generation_config=GENERATION_CONFIG):
+    """
+    複数のテキストを共通のプロンプトで並列に要約し、入力と同じ順番の結果リストを返す
+    （1件の失敗でバッチ全体を失敗させず、その件だけ ok: False を返します）
+    """
+    def _summarize(text):
+        if not isinstance(text, str) or not text.strip():
+            return {"ok": False, "error": "textが空です。"}
+        try:
+            return {"ok": True, "summary": generate_summary(prompt, text, generation_config)}
+        except Exception as e:
+            print(f"バッチ内の要約生成中にエラーが発生: {e}")
+            return {"ok": False, "error": str(e)}
+
+    # なぜ？: Gemini の呼び出しは I/O 待ちが大半のため、スレッドで並列に投げて1リクエスト内で捌きます。
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_MAX_WORKERS, len(texts)))) as executor:
+        return list(executor.map(_summarize, texts))
+
+def parse_request_json(request):
+    """
+    リクエストボディを JSON として読み込む（Content-Encoding: gzip で圧縮されたボディにも対応）
+    """
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        # なぜ？: Bot側は大きなチャンクを gzip 圧縮して送ってくるため、ここで展開してから読み込みます。
+        try:
+            return json.loads(gzip.decompress(request.get_data()).decode('utf-8'))
+        except (OSError, ValueError) as e:
+            print(f"gzipボディの展開に失敗しました: {e}")
+            return None
+    return request.get_json(silent=True)
 
 @functions_framework.http
 def summarize_text_handler(request):
     """
     HTTPリクエストを受け取って要約を実行するメインの関数
     """
+    model = get_model()
     if model is None:
+        # なぜ？: 初期化は次のリクエストで再試行するため、Bot側が再送すれば回復する「一時的な利用不可」として返します。
         print("エラー: AIモデルが初期化されていないため、処理を実行できません。")
-        return "AIモデルが利用不可能です。", 500
+        return "AIモデルが利用不可能です。", 503
 
     try:
-        request_json = request.get_json(silent=True)
+        request_json = parse_request_json(request)
         if not request_json:
             return "JSONデータがありません。", 400
 
-        notes_text = request_json.get('text')
         prompt = request_json.get('prompt')
+        # 生成設定: {"generation_config": {"max_output_tokens": 2048, ...}} で呼び出しの種類ごとに既定値を上書きできます
+        # なぜ？: Map の部分要約は最終要約より短くてよいため、Bot側から小さい max_output_tokens を指定できるようにします。
+        try:
+            generation_config = resolve_generation_config(request_json.get('generation_config'))
+        except ValueError as e:
+            return str(e), 400
+
+        # トークン数の確認: {"count_tokens": true, "texts": [...]} -> {"tokens": [...]}
+        # なぜ？: Bot側でチャンクの大きさや費用をトークン単位で見積もるため、モデルの実際の数え方で数えて返します。
+        if request_json.get('count_tokens'):
+            texts = request_json.get('texts')
+            if not isinstance(texts, list) or not texts or len(texts) > BATCH_MAX_ITEMS:
+                return f"textsは1〜{BATCH_MAX_ITEMS}件のリストにしてください。", 400
+            tokens = [model.count_tokens(text).total_tokens for text in texts]
+            return json.dumps({"tokens": tokens}), 200, {"Content-Type": "application/json; charset=utf-8"}
+
+        # バッチリクエスト: {"prompt": ..., "texts": [...]} -> {"results": [{"ok": ..., "summary"/"error": ...}, ...]}
+        # なぜ？: チャンクごとに1リクエストだと、その都度コールドスタートや呼び出し課金が発生するため、まとめて受け付けます。
+        texts = request_json.get('texts')
+        if texts is not None:
+            if not prompt or not isinstance(texts, list) or not texts:
+                return "promptと、空でないtextsのリストが必要です。", 400
+            if len(texts) > BATCH_MAX_ITEMS:
+                return f"textsは{BATCH_MAX_ITEMS}件以内にしてください。", 400
+            print(f"バッチ要約を開始します... ({len(texts)}件)")
+            results = summarize_batch(prompt, texts, generation_config)
+            print(f"バッチ要約が完了しました。(成功: {sum(1 for r in results if r['ok'])}/{len(results)}件)")
+            body = json.dumps({"results": results}, ensure_ascii=False)
+            return body, 200, {"Content-Type": "application/json; charset=utf-8"}
+
+        notes_text = request_json.get('text')
         if not notes_text or not prompt:
             return "textとpromptの両方が必要です。", 400
-        
-        final_prompt = f"{prompt}\n\n{notes_text}"
 
-        print(f"AI要約を開始します... (入力文字数: {len(final_prompt)}文字)")
-        
-        # 正しい .generate_content() 呼び出し
-        response = model.generate_content(
-            final_prompt,
-            generation_config={
-              "temperature": 0.7,
-              "max_output_tokens": 8192,
-              "top_p": 1,
-              "top_k": 1
-            }
-        )
-        
-        print("AI要約が正常に完了しました。")
-        return response.text, 200
+        if request_json.get('stream'):
+            # なぜ？: 生成済みの部分から順に返すことで、クライアントが進捗（最初の出力までの時間）を確認でき、
+            # 生成が止まった場合もタイムアウトを待たずに打ち切れます。
+            return Response(stream_summary_events(prompt, notes_text, generation_config), mimetype='application/x-ndjson')
+
+        return generate_summary(prompt, notes_text, generation_config), 200
 
     except Exception as e:
         print(f"要約生成中にエラーが発生: {e}")